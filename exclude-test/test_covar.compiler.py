@@ -0,0 +1,80 @@
+import unittest
+import threading
+import scipy as SP
+from pygp.covar import se, noise, linear, combinators
+from pygp.covar.compiler import compile_covariance
+from pygp.gp import GP
+
+
+class TestCompiledCF(unittest.TestCase):
+
+    def setUp(self):
+        SP.random.seed(1)
+        self.x = SP.random.randn(25, 2)
+        self.x2 = SP.random.randn(7, 2)
+        self.y = SP.random.randn(25, 1)
+        self.covars = [combinators.SumCF((se.SqexpCFARD(2), se.SqexpCFARD(2), noise.NoiseCFISO())),
+                       combinators.SumCF((combinators.ProductCF((se.SqexpCFARD(2), linear.LinearCFISO(2))),
+                                          se.SqexpCFARD(1, dimension_indices=[1]), noise.NoiseCFISO())),
+                       combinators.ProductCF((se.SqexpCFARD(2), se.SqexpCFARD(2), se.SqexpCFARD(1)))]
+
+    def theta(self, covar):
+        return 0.3 * SP.random.randn(covar.get_number_of_parameters())
+
+    def assertClose(self, A, B):
+        self.assertTrue(SP.allclose(A, B, rtol=1E-10, atol=1E-10))
+
+    def test_K(self):
+        for covar in self.covars:
+            compiled = compile_covariance(covar)
+            theta = self.theta(covar)
+            self.assertClose(compiled.K(theta, self.x), covar.K(theta, self.x))
+            self.assertClose(compiled.K(theta, self.x, self.x2), covar.K(theta, self.x, self.x2))
+            self.assertClose(compiled.Kdiag(theta, self.x), covar.Kdiag(theta, self.x))
+
+    def test_grad(self):
+        W = SP.random.randn(25, 25)
+        for covar in self.covars:
+            compiled = compile_covariance(covar)
+            theta = self.theta(covar)
+            for i, Kd in enumerate(compiled.Kgrad_theta_all(theta, self.x)):
+                self.assertClose(Kd, covar.Kgrad_theta(theta, self.x, i))
+                self.assertClose(compiled.Kgrad_theta(theta, self.x, i), Kd)
+            self.assertClose(compiled.contract_grad_theta(theta, self.x, W), covar.contract_grad_theta(theta, self.x, W))
+
+    def test_inputs_modified_in_place(self):
+        covar = self.covars[0]
+        compiled = compile_covariance(covar)
+        theta = self.theta(covar)
+        x = self.x.copy()
+        compiled.K(theta, x)
+        x += 1.5 * SP.random.randn(*x.shape)
+        self.assertClose(compiled.K(theta, x), covar.K(theta, x))
+
+    def test_threads(self):
+        covar = self.covars[0]
+        compiled = compile_covariance(covar)
+        thetas = [self.theta(covar) for i in xrange(8)]
+        RV = [None] * len(thetas)
+
+        def run(i):
+            RV[i] = compiled.K(thetas[i], self.x)
+        threads = [threading.Thread(target=run, args=(i,)) for i in xrange(len(thetas))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for i in xrange(len(thetas)):
+            self.assertClose(RV[i], covar.K(thetas[i], self.x))
+
+    def test_GP(self):
+        for covar in self.covars:
+            hyperparams = {'covar': self.theta(covar)}
+            gp = GP(covar_func=covar, x=self.x, y=self.y)
+            cgp = GP(covar_func=compile_covariance(covar), x=self.x, y=self.y)
+            self.assertAlmostEqual(gp.LML(hyperparams), cgp.LML(hyperparams), 8)
+            self.assertClose(gp.LMLgrad(hyperparams)['covar'], cgp.LMLgrad(hyperparams)['covar'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+import scipy as SP
+from pygp.covar import fixed, combinators, noise
+from pygp.covar.dist import sq_dist
+
+
+class TestTiledFixed(unittest.TestCase):
+    """covariances depending on the position of the inputs evaluated block by block"""
+
+    def setUp(self):
+        SP.random.seed(1)
+        self.x = SP.random.randn(50, 2)
+        X = SP.random.randn(50, 3)
+        self.covars = [(fixed.FixedCF(SP.dot(X, X.T)), SP.array([0.3])),
+                       (fixed.SqexpFixed(SP.sqrt(sq_dist(X, X))), SP.array([0.3, 0.2]))]
+        self.covars.append((combinators.SumCF((self.covars[1][0], noise.NoiseCFISO())), SP.array([0.3, 0.2, -1.])))
+
+    def test_K_tiled(self):
+        for covar, theta in self.covars:
+            K = covar.K(theta, self.x)
+            self.assertTrue(SP.allclose(covar.K_tiled(theta, self.x, max_memory=8 * 20 * 20), K))
+            self.assertTrue(SP.allclose(covar.K_tiled(theta, self.x, self.x, max_memory=8 * 20 * 20),
+                                        covar.K(theta, self.x, self.x)))
+
+    def test_Kgrad_theta_tiled(self):
+        for covar, theta in self.covars:
+            for i in xrange(len(theta)):
+                self.assertTrue(SP.allclose(covar.Kgrad_theta_tiled(theta, self.x, i, max_memory=8 * 20 * 20),
+                                            covar.Kgrad_theta(theta, self.x, i)))
+
+
+if __name__ == '__main__':
+    unittest.main()
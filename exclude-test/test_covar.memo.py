@@ -0,0 +1,76 @@
+import unittest
+import threading
+import sys
+import scipy as SP
+from pygp.covar import se, noise, combinators
+from pygp.gp import GP
+from pygp.gp.composite import GroupGP
+
+
+class TestChildMemo(unittest.TestCase):
+
+    def setUp(self):
+        SP.random.seed(1)
+        self.covar = combinators.SumCF((combinators.ProductCF((se.SqexpCFARD(2), se.SqexpCFARD(2))),
+                                        noise.NoiseCFISO()))
+        self.theta = 0.3 * SP.random.randn(self.covar.get_number_of_parameters())
+        self.xs = [SP.random.randn(30, 2) for i in xrange(8)]
+        self.y = SP.random.randn(30, 1)
+
+    def memos(self):
+        product = self.covar.covars[0]
+        return [self.covar._memo, product._memo]
+
+    def test_threads(self):
+        #concurrent evaluations on different inputs share one covariance function
+        RV = [None] * len(self.xs)
+        errors = []
+
+        def run(i):
+            try:
+                for r in xrange(200):
+                    RV[i] = self.covar.K(self.theta, self.xs[i])
+            except Exception, e:
+                errors.append(e)
+        #switch threads as often as possible
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        try:
+            threads = [threading.Thread(target=run, args=(i,)) for i in xrange(len(self.xs))]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            sys.setcheckinterval(interval)
+        self.assertEqual(errors, [])
+        fresh = combinators.SumCF((combinators.ProductCF((se.SqexpCFARD(2), se.SqexpCFARD(2))),
+                                   noise.NoiseCFISO()), memoize=False)
+        for i in xrange(len(self.xs)):
+            self.assertTrue(SP.allclose(RV[i], fresh.K(self.theta, self.xs[i])))
+
+    def test_group_threads(self):
+        gps = [GP(covar_func=self.covar, x=x, y=self.y) for x in self.xs]
+        group = GroupGP(GPs=gps, executor='thread', n_workers=4)
+        hyperparams = {'covar': self.theta}
+        LML = group.LML(hyperparams)
+        self.assertAlmostEqual(LML, sum([GP(covar_func=self.covar, x=x, y=self.y).LML(hyperparams) for x in self.xs]), 8)
+
+    def test_released(self):
+        #the memo does not outlive an evaluation
+        gp = GP(covar_func=self.covar, x=self.xs[0], y=self.y)
+        hyperparams = {'covar': self.theta}
+        gp.LML_and_grad(hyperparams)
+        gp.predict(hyperparams, self.xs[1])
+        for memo in self.memos():
+            self.assertEqual(memo._local.__dict__, {})
+        #but it is shared within one evaluation
+        self.covar.K(self.theta, self.xs[0])
+        self.assertEqual(len(self.covar._memo._local.inputs), 1)
+        self.covar.clear_memo()
+        for memo in self.memos():
+            self.assertEqual(memo._local.__dict__, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+import scipy as SP
+import scipy.optimize as OPT
+from pygp.covar import se, linear, combinators
+from pygp.covar.combinators import _leave_one_out_products
+from pygp.gp import GP
+from pygp.likelihood import GaussLikISO
+
+
+class TestLeaveOneOutProducts(unittest.TestCase):
+
+    def test_products(self):
+        SP.random.seed(1)
+        for C in xrange(1, 6):
+            Ks = [SP.random.randn(4, 3) for c in xrange(C)]
+            Ks_copy = [K.copy() for K in Ks]
+            RV = _leave_one_out_products(Ks)
+            self.assertEqual(len(RV), C)
+            for c in xrange(C):
+                brute = SP.ones((4, 3))
+                for j in xrange(C):
+                    if j != c:
+                        brute = brute * Ks[j]
+                self.assertTrue(SP.allclose(RV[c], brute))
+            #the factors are not modified
+            for K, K_copy in zip(Ks, Ks_copy):
+                self.assertTrue((K == K_copy).all())
+
+
+class TestProductCF(unittest.TestCase):
+
+    def setUp(self):
+        SP.random.seed(1)
+        self.x = SP.random.randn(20, 2)
+        self.y = SP.random.randn(20, 1)
+        self.covar = combinators.ProductCF((se.SqexpCFARD(2), linear.LinearCFISO(2), se.SqexpCFARD(1, dimension_indices=[1])))
+        self.theta = 0.3 * SP.random.randn(self.covar.get_number_of_parameters())
+
+    def test_grad(self):
+        #all gradient paths against the brute force product of the factors
+        W = SP.random.randn(20, 20)
+        brute = []
+        for i in xrange(len(self.theta)):
+            nc = self.covar.covars_covar_I[i]
+            Kd = SP.ones((20, 20))
+            for c, covar in enumerate(self.covar.covars):
+                theta_c = self.theta[self.covar.covars_theta_I[c]]
+                if c == nc:
+                    Kd = Kd * covar.Kgrad_theta(theta_c, self.x, i - self.covar.covars_theta_I[c].min())
+                else:
+                    Kd = Kd * covar.K(theta_c, self.x)
+            brute.append(Kd)
+        for i, Kd in enumerate(self.covar.Kgrad_theta_all(self.theta, self.x)):
+            self.assertTrue(SP.allclose(Kd, brute[i]))
+            self.assertTrue(SP.allclose(self.covar.Kgrad_theta(self.theta, self.x, i), brute[i]))
+            self.assertTrue(SP.allclose(self.covar.Kgrad_theta_diag(self.theta, self.x, i), brute[i].diagonal()))
+        self.assertTrue(SP.allclose(self.covar.contract_grad_theta(self.theta, self.x, W),
+                                    [(W * Kd).sum() for Kd in brute]))
+
+    def test_GP(self):
+        gp = GP(covar_func=self.covar, likelihood=GaussLikISO(), x=self.x, y=self.y)
+        P = len(self.theta)
+        f = lambda p: gp.LML({'covar': p[:P], 'lik': p[P:]})
+        df = lambda p: SP.concatenate((gp.LMLgrad({'covar': p[:P], 'lik': p[P:]})['covar'],
+                                       gp.LMLgrad({'covar': p[:P], 'lik': p[P:]})['lik']))
+        self.assertTrue(OPT.check_grad(f, df, SP.concatenate((self.theta, [-1.]))) < 1E-4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,20 +1,25 @@
 import numpy as NP
-import sq_dist_new as D_N
-import sq_dist as D
+from pygp.covar import dist as D
 
-x1 = NP.linspace(0,1,10000).reshape(-1,1)
+x1 = NP.linspace(0,1,2000).reshape(-1,2)
+x2 = NP.random.randn(300,2)
 
-def sq1(): return D.dist(x1,x1)
-def sq2(): return D_N.dist(x1,x1)
+def sq_explicit(X,Y):
+    #explicit N x M x D difference tensor (previous implementation)
+    return (D.dist(X,Y)**2).sum(axis=2).T
+def sq1(): return sq_explicit(x1,x1)
+def sq2(): return D.sq_dist(x1)
 
 from timeit import Timer
 
 t1 = Timer(sq1)
 t2 = Timer(sq2)
 
-print "old dist: %f.15" % (t1.timeit(number=1))
-print "new dist: %f.15" % (t2.timeit(number=1))
+print "explicit sq_dist: %f.15" % (t1.timeit(number=1))
+print "gemm sq_dist: %f.15" % (t2.timeit(number=1))
 
-D_d = D.dist(x1,x1)
-D_N_d = D_N.dist(x1,x1)
-assert (D_d==D_N_d).all(), "Not right format"
+assert NP.allclose(sq_explicit(x1,x1),D.sq_dist(x1)), "symmetric distances differ"
+assert NP.allclose(sq_explicit(x1,x2),D.sq_dist(x1,x2)), "cross distances differ"
+assert (D.sq_dist(x1)>=0).all(), "negative distances"
+out = NP.empty([x1.shape[0],x2.shape[0]])
+assert D.sq_dist(x1,x2,out=out) is out, "output buffer not used"
@@ -0,0 +1,94 @@
+import unittest
+import scipy as SP
+import scipy.optimize as OPT
+from pygp.covar import se
+from pygp.gp import GP
+from pygp.gp.batched_gp import BatchedGP
+from pygp.likelihood import GaussLikISO
+from pygp.optimize.optimize_base import opt_hyper_batch
+import pygp.priors.lnpriors as lnpriors
+
+
+class TestBatchedGP(unittest.TestCase):
+
+    def setUp(self):
+        SP.random.seed(1)
+        self.B = 3
+        self.x = SP.random.randn(30, 2)
+        self.y = SP.random.randn(30, self.B)
+        self.hyperparams = {'covar': 0.3 * SP.random.randn(self.B, 3), 'lik': -1 + 0.3 * SP.random.randn(self.B, 1)}
+        self.priors = {'covar': [[lnpriors.lnGammaExp, [1, 2]], [lnpriors.lnGammaExp, [1, 1]], [lnpriors.lnGammaExp, [1, 1]]]}
+
+    def batched_gp(self, **kw_args):
+        return BatchedGP(covar_func=se.SqexpCFARD(2), likelihood=GaussLikISO(), x=self.x, y=self.y, **kw_args)
+
+    def single_gp(self, b):
+        gp = GP(covar_func=se.SqexpCFARD(2), likelihood=GaussLikISO(), x=self.x, y=self.y[:, b:b + 1])
+        return gp, {'covar': self.hyperparams['covar'][b], 'lik': self.hyperparams['lik'][b]}
+
+    def test_LML(self):
+        for batch_size in [None, 2]:
+            LML = self.batched_gp(batch_size=batch_size).LML_batch(self.hyperparams)
+            for b in xrange(self.B):
+                gp, hp = self.single_gp(b)
+                self.assertAlmostEqual(LML[b], gp.LML(hp), 8)
+
+    def test_grad(self):
+        for batch_size in [None, 2]:
+            grad = self.batched_gp(batch_size=batch_size).LMLgrad(self.hyperparams)
+            for b in xrange(self.B):
+                gp, hp = self.single_gp(b)
+                grad_b = gp.LMLgrad(hp)
+                self.assertTrue(SP.allclose(grad['covar'][b], grad_b['covar']))
+                self.assertTrue(SP.allclose(grad['lik'][b], grad_b['lik']))
+
+    def test_grad_priors(self):
+        gp = self.batched_gp()
+        P = self.hyperparams['covar'].shape[1]
+
+        def f(p):
+            return gp.LML({'covar': p[:-self.B].reshape(self.B, P), 'lik': p[-self.B:, SP.newaxis]}, priors=self.priors)
+
+        def df(p):
+            grad = gp.LMLgrad({'covar': p[:-self.B].reshape(self.B, P), 'lik': p[-self.B:, SP.newaxis]}, priors=self.priors)
+            return SP.concatenate((grad['covar'].ravel(), grad['lik'].ravel()))
+        p0 = SP.concatenate((self.hyperparams['covar'].ravel(), self.hyperparams['lik'].ravel()))
+        self.assertTrue(OPT.check_grad(f, df, p0) < 1E-4)
+        #repeated evaluations must not modify the cached gradients
+        self.assertTrue(SP.allclose(df(p0), df(p0)))
+
+    def test_not_positive_definite(self):
+        #duplicated inputs without noise: the covariance of the second target is singular
+        x = SP.concatenate((self.x, self.x[:5]))
+        y = SP.random.randn(x.shape[0], self.B)
+        gp = BatchedGP(covar_func=se.SqexpCFARD(2), likelihood=GaussLikISO(), x=x, y=y)
+        hyperparams = {'covar': self.hyperparams['covar'].copy(), 'lik': self.hyperparams['lik'].copy()}
+        hyperparams['covar'][1, 1:] = 5
+        hyperparams['lik'][1] = -SP.inf
+        LML = gp.LML_batch(hyperparams)
+        self.assertEqual(LML[1], SP.inf)
+        for b in [0, 2]:
+            single = GP(covar_func=se.SqexpCFARD(2), likelihood=GaussLikISO(), x=x, y=y[:, b:b + 1])
+            self.assertAlmostEqual(LML[b], single.LML({'covar': hyperparams['covar'][b], 'lik': hyperparams['lik'][b]}), 8)
+        self.assertEqual(gp.LML(hyperparams), 1E6)
+        grad = gp.LMLgrad(hyperparams)
+        self.assertTrue(SP.isfinite(grad['covar']).all() and SP.isfinite(grad['lik']).all())
+
+    def test_opt_hyper_batch(self):
+        gp = self.batched_gp()
+        #no iterations: the starting point
+        hyperparams, LML = opt_hyper_batch(gp, self.hyperparams, maxiter=0)
+        self.assertTrue(SP.allclose(hyperparams['covar'], self.hyperparams['covar']))
+        self.assertTrue(SP.allclose(LML, gp.LML_batch(self.hyperparams)))
+        #the targets are optimized independently
+        hyperparams, LML = opt_hyper_batch(gp, self.hyperparams, maxiter=50)
+        for b in xrange(self.B):
+            hp_b = {'covar': self.hyperparams['covar'][b:b + 1], 'lik': self.hyperparams['lik'][b:b + 1]}
+            hyperparams_b, LML_b = opt_hyper_batch(gp.select_targets([b]), hp_b, maxiter=50)
+            self.assertTrue(SP.allclose(hyperparams['covar'][b], hyperparams_b['covar'][0]))
+            self.assertAlmostEqual(LML[b], LML_b[0], 8)
+        self.assertTrue((LML <= gp.LML_batch(self.hyperparams)).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
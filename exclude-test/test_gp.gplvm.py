@@ -0,0 +1,50 @@
+import unittest
+import scipy as SP
+import scipy.optimize as OPT
+from pygp.covar import se, noise, combinators
+from pygp.gp.gplvm import GPLVM
+
+
+class TestGPLVMCombinators(unittest.TestCase):
+    """the latent inputs are updated in place; memoized combinators must see the new values"""
+
+    def setUp(self):
+        SP.random.seed(1)
+        self.y = SP.random.randn(20, 3)
+        self.x0 = SP.random.randn(20, 2)
+        self.x1 = SP.random.randn(20, 2)
+        self.covars = [combinators.SumCF((se.SqexpCFARD(2), noise.NoiseCFISO())),
+                       combinators.SumCF((combinators.ProductCF((se.SqexpCFARD(2), se.SqexpCFARD(2))),
+                                          noise.NoiseCFISO()))]
+
+    def gplvm(self, covar, x):
+        return GPLVM(covar_func=covar, x=x.copy(), y=self.y)
+
+    def hyperparams(self, covar, x):
+        return {'covar': 0.1 * SP.ones(covar.get_number_of_parameters()), 'x': x.copy()}
+
+    def test_LML(self):
+        for covar in self.covars:
+            gp = self.gplvm(covar, self.x0)
+            gp.LML(self.hyperparams(covar, self.x0))
+            LML1 = gp.LML(self.hyperparams(covar, self.x1))
+            LML1_fresh = self.gplvm(covar, self.x1).LML(self.hyperparams(covar, self.x1))
+            self.assertAlmostEqual(LML1, LML1_fresh, 10)
+
+    def test_grad_x(self):
+        covar = self.covars[0]
+        gp = self.gplvm(covar, self.x0)
+        hyperparams = self.hyperparams(covar, self.x0)
+
+        def f(x):
+            hyperparams['x'] = x.reshape(self.x0.shape)
+            return gp.LML(hyperparams)
+
+        def df(x):
+            hyperparams['x'] = x.reshape(self.x0.shape)
+            return gp.LMLgrad(hyperparams)['x'].ravel()
+        self.assertTrue(OPT.check_grad(f, df, self.x0.ravel()) < 1E-4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+import scipy as SP
+from pygp.covar import se
+from pygp.gp import GP
+from pygp.gp.iterative_gp import IterativeGP
+from pygp.likelihood import GaussLikISO
+
+
+class TestIterativeGP(unittest.TestCase):
+
+    def setUp(self):
+        SP.random.seed(1)
+        self.x = SP.random.randn(100, 1)
+        self.y = SP.sin(self.x) + 0.1 * SP.random.randn(100, 1)
+        self.xstar = SP.random.randn(10, 1)
+        self.hyperparams = {'covar': SP.array([0.1, -0.2]), 'lik': SP.array([-1.])}
+        self.gp = GP(covar_func=se.SqexpCFARD(1), likelihood=GaussLikISO(), x=self.x, y=self.y)
+        self.igp = IterativeGP(n_probes=64, tol=1E-10, covar_func=se.SqexpCFARD(1),
+                               likelihood=GaussLikISO(), x=self.x, y=self.y)
+
+    def test_predict(self):
+        #CG solves are exact up to the tolerance
+        mu, S2 = self.gp.predict(self.hyperparams, self.xstar)
+        imu, iS2 = self.igp.predict(self.hyperparams, self.xstar)
+        self.assertTrue(SP.allclose(mu, imu, atol=1E-8))
+        self.assertTrue(SP.allclose(S2, iS2, atol=1E-8))
+
+    def test_LML(self):
+        #stochastic log determinant estimate
+        self.assertTrue(abs(self.gp.LML(self.hyperparams) - self.igp.LML(self.hyperparams)) < 1.)
+        #deterministic for fixed probe vectors
+        self.assertEqual(self.igp.LML(self.hyperparams), self.igp.LML(self.hyperparams))
+
+    def test_grad(self):
+        grad = self.gp.LMLgrad(self.hyperparams)
+        igrad = self.igp.LMLgrad(self.hyperparams)
+        for key in grad.keys():
+            self.assertTrue(SP.absolute(grad[key] - igrad[key]).max() < 0.05 * SP.absolute(grad[key]).max())
+
+
+if __name__ == '__main__':
+    unittest.main()
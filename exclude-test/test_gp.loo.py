@@ -0,0 +1,66 @@
+import unittest
+import scipy as SP
+import scipy.optimize as OPT
+from pygp.covar import se, noise, combinators
+from pygp.gp import GP
+from pygp.likelihood import GaussLikISO
+from pygp.optimize.optimize_base import opt_hyper
+
+
+class TestLeaveOneOut(unittest.TestCase):
+
+    def setUp(self):
+        SP.random.seed(1)
+        self.x = SP.random.randn(25, 1)
+        self.y = SP.concatenate((SP.sin(self.x), SP.cos(self.x)), axis=1) + 0.1 * SP.random.randn(25, 2)
+        self.hyperparams = {'covar': SP.array([0.1, -0.2]), 'lik': SP.array([-1.])}
+
+    def gp(self, x=None, y=None):
+        if x is None:
+            x, y = self.x, self.y
+        return GP(covar_func=se.SqexpCFARD(1), likelihood=GaussLikISO(), x=x, y=y)
+
+    def test_loo_predict(self):
+        #closed form against refits without the i-th point
+        mu, S2 = self.gp().loo_predict(self.hyperparams)
+        for i in xrange(self.x.shape[0]):
+            I = SP.arange(self.x.shape[0]) != i
+            rmu, rS2 = self.gp(self.x[I], self.y[I]).predict(self.hyperparams, self.x[i:i + 1], output=None)
+            self.assertTrue(SP.allclose(mu[i], rmu[0]))
+            self.assertAlmostEqual(S2[i], rS2[0], 10)
+
+    def test_LOO_CV(self):
+        mu, S2 = self.gp().loo_predict(self.hyperparams)
+        r = self.y - mu
+        LOO = 0.5 * (SP.log(S2)[:, SP.newaxis] + r ** 2 / S2[:, SP.newaxis] + SP.log(2 * SP.pi)).sum()
+        self.assertAlmostEqual(self.gp().LOO_CV(self.hyperparams), LOO, 10)
+
+    def test_LOO_CVgrad(self):
+        for covar, hyperparams in [(se.SqexpCFARD(1), self.hyperparams),
+                                   (combinators.SumCF((se.SqexpCFARD(1), noise.NoiseCFISO())),
+                                    {'covar': SP.array([0.1, -0.2, -1.])})]:
+            likelihood = GaussLikISO() if 'lik' in hyperparams else None
+            gp = GP(covar_func=covar, likelihood=likelihood, x=self.x, y=self.y)
+            P = len(hyperparams['covar'])
+
+            def hp(p):
+                RV = {'covar': p[:P]}
+                if likelihood is not None:
+                    RV['lik'] = p[P:]
+                return RV
+            f = lambda p: gp.LOO_CV(hp(p))
+            df = lambda p: SP.concatenate([gp.LOO_CVgrad(hp(p))[key] for key in ['covar', 'lik'] if key in hyperparams])
+            p0 = SP.concatenate([hyperparams[key] for key in ['covar', 'lik'] if key in hyperparams])
+            self.assertTrue(OPT.check_grad(f, df, p0) < 1E-4)
+            LOO, grad = gp.LOO_CV_and_grad(hyperparams)
+            self.assertEqual(LOO, f(p0))
+
+    def test_opt_hyper(self):
+        gp = self.gp()
+        hyperparams, LOO = opt_hyper(gp, self.hyperparams, objective='LOO_CV')
+        self.assertAlmostEqual(LOO, gp.LOO_CV(hyperparams), 10)
+        self.assertTrue(LOO < gp.LOO_CV(self.hyperparams))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import copy
+import unittest
+import scipy as SP
+from pygp.covar import se, noise, combinators
+from pygp.gp import GP
+from pygp.likelihood import GaussLikISO, GaussGroupLikISO
+
+
+class TestNoiseSweep(unittest.TestCase):
+
+    def setUp(self):
+        SP.random.seed(1)
+        self.x = SP.random.randn(30, 2)
+        self.x[:, 1] = SP.arange(30) % 2
+        self.y = SP.random.randn(30, 2)
+        self.noise_values = SP.linspace(-3, 1, 5)
+        sum_cf = lambda: combinators.SumCF((se.SqexpCFARD(2), noise.NoiseCFISO()))
+        #(covar, likelihood, hyperparams, swept parameter)
+        self.models = [(se.SqexpCFARD(2), GaussLikISO(), {'covar': SP.array([0.1, -0.2, 0.3]), 'lik': SP.array([-1.])}, ('lik', 0)),
+                       (sum_cf(), None, {'covar': SP.array([0.1, -0.2, 0.3, -1.])}, ('covar', 3)),
+                       (sum_cf(), GaussLikISO(), {'covar': SP.array([0.1, -0.2, 0.3, -1.5]), 'lik': SP.array([-1.])}, ('lik', 0)),
+                       (sum_cf(), GaussGroupLikISO(2, column=1), {'covar': SP.array([0.1, -0.2, 0.3, -1.]),
+                                                                 'lik': SP.array([-1., -0.5])}, ('covar', 3))]
+
+    def test_sweep(self):
+        #against the Cholesky based LML and gradient at every noise value
+        for covar, likelihood, hyperparams, (key, index) in self.models:
+            gp = GP(covar_func=covar, likelihood=likelihood, x=self.x, y=self.y)
+            LML, LMLgrad = gp.noise_sweep(hyperparams, self.noise_values)
+            for i, v in enumerate(self.noise_values):
+                hp = copy.deepcopy(hyperparams)
+                hp[key][index] = v
+                self.assertAlmostEqual(LML[i], gp.LML(hp), 8)
+                self.assertAlmostEqual(LMLgrad[i], gp.LMLgrad(hp)[key][index], 8)
+            #the eigendecomposition does not depend on the swept parameter
+            hp = copy.deepcopy(hyperparams)
+            hp[key][index] = 2.
+            LML2, LMLgrad2 = gp.noise_sweep(hp, self.noise_values)
+            self.assertTrue(SP.allclose(LML, LML2) and SP.allclose(LMLgrad, LMLgrad2))
+
+    def test_optimize_noise(self):
+        for covar, likelihood, hyperparams, (key, index) in self.models:
+            gp = GP(covar_func=covar, likelihood=likelihood, x=self.x, y=self.y)
+            hp, LML = gp.optimize_noise(hyperparams)
+            self.assertAlmostEqual(LML, gp.LML(hp), 8)
+            self.assertTrue(abs(gp.LMLgrad(hp)[key][index]) < 1E-3)
+            #the other hyperparameters are unchanged
+            hp[key][index] = hyperparams[key][index]
+            for k in hyperparams.keys():
+                self.assertTrue((hp[k] == hyperparams[k]).all())
+            self.assertTrue(LML <= gp.noise_sweep(hyperparams, self.noise_values)[0].min() + 1E-8)
+
+
+if __name__ == '__main__':
+    unittest.main()
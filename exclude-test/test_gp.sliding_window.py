@@ -0,0 +1,65 @@
+import unittest
+import scipy as SP
+import scipy.linalg as linalg
+from pygp.covar import se
+from pygp.gp import GP
+from pygp.gp.sliding_window import SlidingWindowGP
+from pygp.likelihood import GaussLikISO
+from pygp.linalg import chol_update
+
+
+class TestCholUpdate(unittest.TestCase):
+
+    def test_chol_update(self):
+        SP.random.seed(1)
+        A = SP.random.randn(10, 10)
+        L = linalg.cholesky(SP.dot(A, A.T) + SP.eye(10), lower=True)
+        for X in [SP.random.randn(10), SP.random.randn(10, 3)]:
+            X2 = X.reshape(10, -1)
+            L1 = chol_update(L, X)
+            self.assertTrue(SP.allclose(L1, linalg.cholesky(SP.dot(L, L.T) + SP.dot(X2, X2.T), lower=True)))
+        #L is only modified with overwrite
+        L0 = L.copy()
+        chol_update(L, X)
+        self.assertTrue((L == L0).all())
+        L1 = chol_update(L, X, overwrite=True)
+        self.assertTrue(L1 is L)
+
+
+class TestSlidingWindowGP(unittest.TestCase):
+
+    def setUp(self):
+        SP.random.seed(1)
+        self.x = SP.random.randn(60, 1)
+        self.y = SP.sin(self.x) + 0.1 * SP.random.randn(60, 1)
+        self.xstar = SP.random.randn(10, 1)
+        self.hyperparams = {'covar': SP.array([0.1, -0.2]), 'lik': SP.array([-1.])}
+
+    def test_stream(self):
+        #after every step the model equals a GP refit on the window
+        W = 25
+        gp = SlidingWindowGP(window_size=W, covar_func=se.SqexpCFARD(1), likelihood=GaussLikISO())
+        for i0 in xrange(0, 60, 7):
+            gp.update(self.hyperparams, self.x[i0:i0 + 7], self.y[i0:i0 + 7])
+            i1 = min(i0 + 7, 60)
+            window = slice(max(0, i1 - W), i1)
+            refit = GP(covar_func=se.SqexpCFARD(1), likelihood=GaussLikISO(), x=self.x[window], y=self.y[window])
+            self.assertEqual(gp.n, refit.n)
+            self.assertAlmostEqual(gp.LML(self.hyperparams), refit.LML(self.hyperparams), 8)
+            mu, S2 = gp.predict(self.hyperparams, self.xstar)
+            rmu, rS2 = refit.predict(self.hyperparams, self.xstar)
+            self.assertTrue(SP.allclose(mu, rmu) and SP.allclose(S2, rS2))
+
+    def test_remove_oldest(self):
+        gp = SlidingWindowGP(window_size=60, covar_func=se.SqexpCFARD(1), likelihood=GaussLikISO(),
+                             x=self.x, y=self.y)
+        gp.get_covariances(self.hyperparams)
+        gp.remove_oldest(20)
+        refit = GP(covar_func=se.SqexpCFARD(1), likelihood=GaussLikISO(), x=self.x[20:], y=self.y[20:])
+        KV = gp.get_covariances(self.hyperparams)
+        self.assertTrue(SP.allclose(KV['L'], refit.get_covariances(self.hyperparams)['L']))
+        self.assertAlmostEqual(gp.LML(self.hyperparams), refit.LML(self.hyperparams), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
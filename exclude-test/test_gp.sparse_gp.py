@@ -0,0 +1,96 @@
+import unittest
+import scipy as SP
+import scipy.optimize as OPT
+from pygp.covar import se, linear, noise, delta, combinators, CovarianceFunction
+from pygp.covar.compiler import compile_covariance
+from pygp.gp import GP
+from pygp.gp.sparse_gp import SparseGP
+from pygp.likelihood import GaussLikISO
+from pygp.optimize.optimize_base import param_dict_to_list, param_list_to_dict
+import pygp.priors.lnpriors as lnpriors
+
+
+class TestSparseGP(unittest.TestCase):
+
+    def setUp(self):
+        SP.random.seed(1)
+        self.x = SP.random.randn(40, 1)
+        self.y = SP.sin(self.x) + 0.1 * SP.random.randn(40, 1)
+        self.Xm = SP.linspace(-2, 2, 7)[:, SP.newaxis]
+        self.hyperparams = {'covar': SP.array([0.1, -0.2]), 'lik': SP.array([-1.])}
+        self.skeys = SP.sort(self.hyperparams.keys())
+
+    def sparse_gp(self, method, Xm=None):
+        if Xm is None:
+            Xm = self.Xm
+        return SparseGP(Xm=Xm, method=method, covar_func=se.SqexpCFARD(1),
+                        likelihood=GaussLikISO(), x=self.x, y=self.y)
+
+    def check_grad(self, gp, hyperparams):
+        struct = dict([(k, hyperparams[k].shape) for k in self.skeys])
+        f = lambda p: gp.LML(param_list_to_dict(p, struct, self.skeys))
+        df = lambda p: param_dict_to_list(gp.LMLgrad(param_list_to_dict(p, struct, self.skeys)), self.skeys)
+        return OPT.check_grad(f, df, param_dict_to_list(hyperparams, self.skeys))
+
+    def test_full_inducing_set(self):
+        #with Xm = x, FITC and DTC are exact
+        gp = GP(covar_func=se.SqexpCFARD(1), likelihood=GaussLikISO(), x=self.x, y=self.y)
+        for method in ['fitc', 'dtc']:
+            sgp = self.sparse_gp(method, Xm=self.x)
+            self.assertAlmostEqual(gp.LML(self.hyperparams), sgp.LML(self.hyperparams), 3)
+
+    def test_grad(self):
+        for method in ['fitc', 'vfe', 'dtc']:
+            self.assertTrue(self.check_grad(self.sparse_gp(method), self.hyperparams) < 1E-4)
+
+    def test_grad_Xm(self):
+        hyperparams = dict(self.hyperparams)
+        hyperparams['Xm'] = self.Xm.copy()
+        self.skeys = SP.sort(hyperparams.keys())
+        for method in ['fitc', 'vfe']:
+            self.assertTrue(self.check_grad(self.sparse_gp(method), hyperparams) < 1E-4)
+
+    def test_grad_priors(self):
+        #repeated evaluations with priors must not modify the cached gradients
+        priors = {'covar': [[lnpriors.lnGammaExp, [1, 2]], [lnpriors.lnGammaExp, [1, 1]]]}
+        gp = self.sparse_gp('fitc')
+        g1 = dict([(k, v.copy()) for k, v in gp.LMLgrad(self.hyperparams, priors=priors).iteritems()])
+        g2 = gp.LMLgrad(self.hyperparams, priors=priors)
+        for key in g1.keys():
+            self.assertTrue(SP.allclose(g1[key], g2[key]))
+
+    def test_grad_linear(self):
+        #kernels without a dedicated Kgrad_theta_block
+        covar = combinators.SumCF((se.SqexpCFARD(1), linear.LinearCFISO(1)))
+        gp = SparseGP(Xm=self.Xm, covar_func=covar, likelihood=GaussLikISO(), x=self.x, y=self.y)
+        hyperparams = {'covar': SP.array([0.1, -0.2, -0.5]), 'lik': SP.array([-1.])}
+        self.assertTrue(self.check_grad(gp, hyperparams) < 1E-4)
+
+
+class TestCrossContraction(unittest.TestCase):
+    """contract_grad_theta_cross against the derivatives for the joint inputs"""
+
+    def setUp(self):
+        SP.random.seed(1)
+        self.x1 = SP.random.randn(6, 2)
+        self.x2 = SP.random.randn(15, 2)
+        self.x2[:5] = self.x1[:5]
+        self.W = SP.random.randn(6, 15)
+
+    def test_covars(self):
+        covars = [(se.SqexpCFARD(2), None), (linear.LinearCFISO(2), None), (linear.LinearCF(2), None),
+                  (linear.LinearCFARD(2), SP.array([1.5, 0.7])), (noise.NoiseCFISO(), None),
+                  (delta.DeltaCFISO(2), None), (delta.DeltaCF(2), None),
+                  (combinators.SumCF((se.SqexpCFARD(2), linear.LinearCFISO(2), noise.NoiseCFISO())), None),
+                  (combinators.ProductCF((se.SqexpCFARD(2), linear.LinearCF(2))), None)]
+        covars.append((compile_covariance(covars[-1][0]), None))
+        for covar, theta in covars:
+            if theta is None:
+                theta = 0.3 * SP.random.randn(covar.get_number_of_parameters())
+            RV = covar.contract_grad_theta_cross(theta, self.x1, self.x2, self.W)
+            joint = CovarianceFunction.contract_grad_theta_cross(covar, theta, self.x1, self.x2, self.W)
+            self.assertTrue(SP.allclose(RV, joint), covar)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import shutil
+import tempfile
+import scipy as SP
+import scipy.optimize as OPT
+from pygp.covar import se, noise, linear, combinators
+from pygp.gp import GP
+from pygp.gp.woodbury_gp import WoodburyGP, FrozenWoodburyGP
+from pygp.gp.frozen import load
+from pygp.likelihood import GaussLikISO
+
+
+class TestWoodburyGP(unittest.TestCase):
+
+    def setUp(self):
+        SP.random.seed(1)
+        self.x = SP.random.randn(30, 3)
+        self.y = SP.random.randn(30, 2)
+        self.xstar = SP.random.randn(8, 3)
+        self.models = [(combinators.SumCF((linear.LinearCFISO(3), noise.NoiseCFISO())), None, {}),
+                       (linear.LinearCFISO(3), GaussLikISO(), {'lik': SP.array([-1.])}),
+                       (combinators.SumCF((linear.LinearCF(3), linear.LinearCFARD(3))), GaussLikISO(),
+                        {'lik': SP.array([-0.5])})]
+
+    def gps(self, covar, likelihood, lik):
+        hyperparams = dict(lik)
+        hyperparams['covar'] = 0.3 * SP.random.randn(covar.get_number_of_parameters())
+        if likelihood is None:
+            #noise level of the NoiseCFISO summand
+            hyperparams['covar'][-1] = -1.
+        elif isinstance(covar, combinators.SumCF):
+            #LinearCFARD is parametrized by positive inverse scales
+            hyperparams['covar'][3:] = 1 + SP.random.rand(3)
+        gp = GP(covar_func=covar, likelihood=likelihood, x=self.x, y=self.y)
+        wgp = WoodburyGP(woodbury=True, covar_func=covar, likelihood=likelihood, x=self.x, y=self.y)
+        return gp, wgp, hyperparams
+
+    def test_LML(self):
+        for covar, likelihood, lik in self.models:
+            gp, wgp, hyperparams = self.gps(covar, likelihood, lik)
+            self.assertAlmostEqual(gp.LML(hyperparams), wgp.LML(hyperparams), 8)
+            self.assertTrue(wgp._is_woodbury(wgp.get_covariances(hyperparams)))
+            grad = gp.LMLgrad(hyperparams)
+            wgrad = wgp.LMLgrad(hyperparams)
+            for key in grad.keys():
+                self.assertTrue(SP.allclose(grad[key], wgrad[key]))
+
+    def test_grad(self):
+        covar, likelihood, lik = self.models[1]
+        gp, wgp, hyperparams = self.gps(covar, likelihood, lik)
+        P = len(hyperparams['covar'])
+        f = lambda p: wgp.LML({'covar': p[:P], 'lik': p[P:]})
+        df = lambda p: SP.concatenate((wgp.LMLgrad({'covar': p[:P], 'lik': p[P:]})['covar'],
+                                       wgp.LMLgrad({'covar': p[:P], 'lik': p[P:]})['lik']))
+        self.assertTrue(OPT.check_grad(f, df, SP.concatenate((hyperparams['covar'], hyperparams['lik']))) < 1E-4)
+
+    def test_predict(self):
+        for covar, likelihood, lik in self.models:
+            gp, wgp, hyperparams = self.gps(covar, likelihood, lik)
+            for output in [0, None]:
+                mu, S2 = gp.predict(hyperparams, self.xstar, output=output)
+                wmu, wS2 = wgp.predict(hyperparams, self.xstar, output=output)
+                self.assertTrue(SP.allclose(mu, wmu))
+                self.assertTrue(SP.allclose(S2, wS2))
+            for A, B in zip(gp.loo_predict(hyperparams), wgp.loo_predict(hyperparams)):
+                self.assertTrue(SP.allclose(A, B))
+
+    def test_append_data(self):
+        covar, likelihood, lik = self.models[1]
+        gp, wgp, hyperparams = self.gps(covar, likelihood, lik)
+        wgp.LML(hyperparams)
+        x_new = SP.random.randn(5, 3)
+        y_new = SP.random.randn(5, 2)
+        gp.append_data(x_new, y_new)
+        wgp.append_data(x_new, y_new)
+        self.assertAlmostEqual(gp.LML(hyperparams), wgp.LML(hyperparams), 8)
+        self.assertTrue(SP.allclose(gp.predict(hyperparams, self.xstar)[0], wgp.predict(hyperparams, self.xstar)[0]))
+
+    def test_modes(self):
+        covar = se.SqexpCFARD(3)
+        hyperparams = {'covar': SP.zeros(4), 'lik': SP.array([-1.])}
+        wgp = WoodburyGP(woodbury=True, covar_func=covar, likelihood=GaussLikISO(), x=self.x, y=self.y)
+        self.assertRaises(ValueError, wgp.LML, hyperparams)
+        wgp = WoodburyGP(covar_func=covar, likelihood=GaussLikISO(), x=self.x, y=self.y)
+        gp = GP(covar_func=covar, likelihood=GaussLikISO(), x=self.x, y=self.y)
+        self.assertAlmostEqual(gp.LML(hyperparams), wgp.LML(hyperparams), 8)
+        self.assertFalse(wgp._is_woodbury(wgp.get_covariances(hyperparams)))
+
+    def test_freeze(self):
+        for covar, likelihood, lik in self.models:
+            gp, wgp, hyperparams = self.gps(covar, likelihood, lik)
+            frozen = wgp.freeze(hyperparams)
+            self.assertTrue(isinstance(frozen, FrozenWoodburyGP))
+            mu, S2 = wgp.predict(hyperparams, self.xstar)
+            fmu, fS2 = frozen.predict(self.xstar)
+            self.assertTrue(SP.allclose(mu, fmu))
+            self.assertTrue(SP.allclose(S2, fS2))
+            dirname = tempfile.mkdtemp()
+            try:
+                frozen.save(dirname)
+                loaded = load(dirname)
+                self.assertTrue(isinstance(loaded, FrozenWoodburyGP))
+                lmu, lS2 = loaded.predict(self.xstar)
+                self.assertTrue(SP.allclose(mu, lmu))
+                self.assertTrue(SP.allclose(S2, lS2))
+            finally:
+                shutil.rmtree(dirname)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import scipy as SP
+import scipy.optimize as OPT
+from pygp.linalg import Dense, Diagonal, LowRank, Sum
+from pygp.covar import se, noise, linear, combinators
+from pygp.likelihood import GaussLikISO, GaussGroupLikISO
+from pygp.gp import GP
+
+
+class TestStructuredMatrices(unittest.TestCase):
+
+    def setUp(self):
+        SP.random.seed(1)
+        n = 20
+        self.A = SP.random.randn(n, n)
+        self.d = SP.random.rand(n)
+        self.U = SP.random.randn(n, 3)
+        self.V = SP.random.randn(n, 3)
+        self.W = SP.random.randn(n, n)
+        self.B = SP.random.randn(n, 4)
+        self.terms = [(Dense(self.A), self.A), (Diagonal(self.d), SP.diag(self.d)),
+                      (LowRank(self.U, self.V), SP.dot(self.U, self.V.T))]
+
+    def check(self, S, M):
+        self.assertTrue(SP.allclose(S.to_dense(), M))
+        out = SP.ones(M.shape)
+        self.assertTrue(S.add_to(out) is out)
+        self.assertTrue(SP.allclose(out, M + 1))
+        self.assertTrue(SP.allclose(S.diagonal(), M.diagonal()))
+        self.assertAlmostEqual(S.contract(self.W), (M * self.W).sum(), 10)
+        self.assertTrue(SP.allclose(S.dot(self.B), SP.dot(M, self.B)))
+
+    def test_terms(self):
+        for S, M in self.terms:
+            self.check(S, M)
+
+    def test_sum(self):
+        S = Sum([S for S, M in self.terms])
+        self.check(S, sum([M for S, M in self.terms]))
+        self.check(Sum([], self.A.shape), SP.zeros(self.A.shape))
+        self.check(Diagonal(self.d) + LowRank(self.U, self.V), SP.diag(self.d) + SP.dot(self.U, self.V.T))
+        #to_dense does not modify the dense summand
+        A = self.A.copy()
+        Sum([Dense(self.A), Diagonal(self.d)]).to_dense()
+        self.assertTrue((A == self.A).all())
+
+
+class TestStructuredCovariances(unittest.TestCase):
+
+    def setUp(self):
+        SP.random.seed(1)
+        self.x = SP.random.randn(20, 2)
+        self.x[:, 0] = SP.arange(20) % 2
+        self.x2 = SP.random.randn(5, 2)
+        self.y = SP.random.randn(20, 1)
+        self.covar = combinators.SumCF((se.SqexpCFARD(2), linear.LinearCFISO(2), noise.NoiseCFISO()))
+        self.theta = 0.3 * SP.random.randn(self.covar.get_number_of_parameters())
+
+    def test_K_structured(self):
+        covars = [self.covar, linear.LinearCF(2), noise.NoiseCFISO(),
+                  noise.NoiseCFReplicates(SP.arange(20) % 3)]
+        for covar in covars:
+            theta = 0.3 * SP.random.randn(covar.get_number_of_parameters())
+            self.assertTrue(SP.allclose(covar.K_structured(theta, self.x).to_dense(), covar.K(theta, self.x)))
+            for i in xrange(len(theta)):
+                self.assertTrue(SP.allclose(covar.Kgrad_theta_structured(theta, self.x, i).to_dense(),
+                                            covar.Kgrad_theta(theta, self.x, i)))
+        self.assertTrue(SP.allclose(self.covar.K_structured(self.theta, self.x, self.x2).to_dense(),
+                                    self.covar.K(self.theta, self.x, self.x2)))
+        self.assertTrue(SP.allclose(linear.LinearCFARD(2).K_structured(SP.array([1., 2.]), self.x).to_dense(),
+                                    linear.LinearCFARD(2).K(SP.array([1., 2.]), self.x)))
+
+    def test_likelihoods(self):
+        for likelihood, theta in [(GaussLikISO(), SP.array([-1.])),
+                                  (GaussGroupLikISO(2, column=0), SP.array([-1., 0.5]))]:
+            self.assertTrue(SP.allclose(likelihood.K_structured(theta, self.x).to_dense(), likelihood.K(theta, self.x)))
+            for i in xrange(len(theta)):
+                self.assertTrue(SP.allclose(likelihood.Kgrad_theta_structured(theta, self.x, i).to_dense(),
+                                            likelihood.Kgrad_theta(theta, self.x, i)))
+
+    def test_GP(self):
+        #structured noise against the dense likelihood gradient (W * dK).sum()
+        gp = GP(covar_func=self.covar, likelihood=GaussGroupLikISO(2, column=0), x=self.x, y=self.y)
+        hyperparams = {'covar': self.theta, 'lik': SP.array([-1., 0.5])}
+        grad = gp.LMLgrad(hyperparams)
+        W = gp._covar_cache['W']
+        dense = [0.5 * (W * gp.likelihood.Kgrad_theta(hyperparams['lik'], self.x, i)).sum() for i in xrange(2)]
+        self.assertTrue(SP.allclose(grad['lik'], dense))
+        #finite differences
+        P = len(self.theta)
+        f = lambda p: gp.LML({'covar': p[:P], 'lik': p[P:]})
+        df = lambda p: SP.concatenate((gp.LMLgrad({'covar': p[:P], 'lik': p[P:]})['covar'],
+                                       gp.LMLgrad({'covar': p[:P], 'lik': p[P:]})['lik']))
+        self.assertTrue(OPT.check_grad(f, df, SP.concatenate((self.theta, hyperparams['lik']))) < 1E-4)
+
+
+if __name__ == '__main__':
+    unittest.main()
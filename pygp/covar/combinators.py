@@ -4,16 +4,129 @@ Covariance Function Combinators
 
 Each combinator is a covariance function (CF) itself. It combines one or several covariance function(s) into another. For instance, :py:class:`pygp.covar.combinators.SumCF` combines all given CFs into one sum; use this class to add noise.
 
+Combinators memoize the evaluations of their children at the current
+hyperparameter setting (see :py:class:`ChildMemo`), so that the kernels
+of a tree are computed once for K and all gradients. The memo is kept
+per thread and dropped by the GP models when an evaluation ends (see
+:py:meth:`pygp.covar.CovarianceFunction.clear_memo`). Pass memoize=False
+to trade this for memory.
+
 """
 
 from pygp.covar import CovarianceFunction
+from pygp.linalg.structured import Sum
 from pygp.covar.dist import dist
+from collections import OrderedDict
+import threading
+import hashlib
 import scipy as sp
 import sys
 sys.path.append('../')
 import pdb
 
 
+def _input_key(x):
+    """key of an input array by its contents, so that inputs modified in place (e.g. GPLVM latents) are not confused"""
+    if x is None:
+        return None
+    x = sp.ascontiguousarray(x)
+    return (x.shape, x.dtype.str, hashlib.sha1(x).hexdigest())
+
+
+class ChildMemo(object):
+    """
+    Memo of the child evaluations of a combinator at one hyperparameter
+    setting, keyed by (child, kind, theta slice) and the contents of the
+    inputs. Entering another setting (:py:meth:`scope`) clears the memo.
+    At most max_inputs input pairs are kept, so that the cross covariances
+    of successive test blocks do not accumulate; max_inputs=0 disables
+    memoization. Every thread has its own memo, so that models sharing a
+    covariance function can be evaluated concurrently; :py:meth:`clear`
+    drops the memo of the calling thread. Memoized values are shared and
+    must not be modified in place.
+    """
+    __slots__ = ["max_inputs", "_local"]
+
+    def __init__(self, max_inputs=2):
+        self.max_inputs = max_inputs
+        self._local = threading.local()
+
+    def __getstate__(self):
+        return {'max_inputs': self.max_inputs}
+
+    def __setstate__(self, state):
+        self.__init__(state['max_inputs'])
+
+    def _get_state(self):
+        """(theta, inputs) memo of the calling thread"""
+        local = self._local
+        if not hasattr(local, 'inputs'):
+            local.theta = None
+            local.inputs = OrderedDict()
+        return local
+
+    def scope(self, theta):
+        """enter the hyperparameter setting theta"""
+        if self.max_inputs == 0:
+            return
+        local = self._get_state()
+        key = theta.tostring()
+        if key != local.theta:
+            local.theta = key
+            local.inputs.clear()
+
+    def clear(self):
+        """drop the memo of the calling thread"""
+        self._local.__dict__.clear()
+
+    def get(self, child, kind, theta, x1, x2, compute):
+        """return compute() for (child, kind, theta) on x1, x2, evaluating it at most once"""
+        if self.max_inputs == 0:
+            return compute()
+        inputs = self._get_state().inputs
+        ikey = (_input_key(x1), _input_key(x2))
+        values = inputs.pop(ikey, None)
+        if values is None:
+            values = {}
+        inputs[ikey] = values
+        while len(inputs) > self.max_inputs:
+            inputs.popitem(last=False)
+        key = (id(child), kind, theta.tostring())
+        if key not in values:
+            values[key] = compute()
+        return values[key]
+
+
+def _getstate_without_memo(cf):
+    """pickle state of a combinator with an empty memo"""
+    state = dict(cf.__dict__)
+    state['_memo'] = ChildMemo(cf._memo.max_inputs)
+    slots = dict([(name, getattr(cf, name)) for name in CovarianceFunction.__slots__ if hasattr(cf, name)])
+    return (state, slots)
+
+
+def _leave_one_out_products(Ks):
+    """
+    For factors Ks = [K_0,...,K_{C-1}] return [prod_{j!=c} K_j for all c],
+    built from prefix and suffix products with 3(C-2) multiplications.
+    Entries may alias the factors and must not be modified in place.
+    """
+    C = len(Ks)
+    if C == 1:
+        return [sp.ones(sp.shape(Ks[0]))]
+    suffix = [None] * C
+    suffix[C - 1] = Ks[C - 1]
+    for c in xrange(C - 2, 0, -1):
+        suffix[c] = suffix[c + 1] * Ks[c]
+    RV = [suffix[1]]
+    prefix = Ks[0]
+    for c in xrange(1, C - 1):
+        RV.append(prefix * suffix[c + 1])
+        prefix = prefix * Ks[c]
+    RV.append(prefix)
+    return RV
+
+
 class SumCF(CovarianceFunction):
     """
     Sum Covariance function. This function adds
@@ -22,14 +135,19 @@ class SumCF(CovarianceFunction):
     *covars* : [:py:class:`pygp.covar.CovarianceFunction`]
     
         Covariance functions to sum up.
+
+    *memoize* : boolean
+
+        memoize the covariances of the children (see :py:class:`ChildMemo`)
     """
 
 #    __slots__ = ["n_params_list","covars","covars_theta_I"]
 
-    def __init__(self, covars, *args, **kw_args):
+    def __init__(self, covars, memoize=True, *args, **kw_args):
         #1. check that all covars are covariance functions
         #2. get number of params
         super(SumCF, self).__init__()
+        self._memo = ChildMemo(2 if memoize else 0)
         self.n_params_list = []
         self.covars = []
         self.covars_theta_I = []
@@ -49,6 +167,20 @@ class SumCF(CovarianceFunction):
         self.n_params_list = sp.array(self.n_params_list)
         self.n_hyperparameters = self.n_params_list.sum()
 
+    def __getstate__(self):
+        return _getstate_without_memo(self)
+
+    def clear_memo(self):
+        self._memo.clear()
+        for covar in self.covars:
+            covar.clear_memo()
+
+    def _child_K(self, theta, nc, x1, x2=None):
+        """memoized structured covariance of the nc-th summand"""
+        covar = self.covars[nc]
+        _theta = theta[self.covars_theta_I[nc]]
+        return self._memo.get(covar, 'K', _theta, x1, x2, lambda: covar.K_structured(_theta, x1, x2))
+
     def get_hyperparameter_names(self):
         """return the names of hyperparameters to make identification easier"""
         names = []
@@ -68,16 +200,46 @@ class SumCF(CovarianceFunction):
         """
         #1. check theta has correct length
         assert theta.shape[0] == self.n_hyperparameters, 'K: theta has wrong shape'
-        #2. create sum of covarainces..
+        #2. create sum of covarainces in a new array, diagonal terms are added in place
+        return self.K_structured(theta, x1, x2).to_dense()
+
+    def K_structured(self, theta, x1, x2=None):
+        """
+        Sum of the structured covariances of all covariance functions.
+
+        **Parameters:**
+        See :py:meth:`pygp.covar.CovarianceFunction.K_structured`
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'K: theta has wrong shape'
+        self._memo.scope(theta)
+        shape = (x1.shape[0], x1.shape[0] if x2 is None else x2.shape[0])
+        return Sum([self._child_K(theta, nc, x1, x2) for nc in xrange(len(self.covars))], shape)
+
+    def Kgrad_theta_structured(self, theta, x1, i):
+        """
+        Structured partial derivative with respect to the i-th hyperparameter.
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'K: theta has wrong shape'
+        nc = self.covars_covar_I[i]
+        j = i - self.covars_theta_I[nc].min()
+        return self.covars[nc].Kgrad_theta_structured(theta[self.covars_theta_I[nc]], x1, j)
+
+    def Kdiag(self, theta, x1):
+        """
+        Get diagonal of the sum covariance: sum of the diagonals
+        of all covariance functions.
+
+        **Parameters:**
+        See :py:class:`pygp.covar.CovarianceFunction`
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'K: theta has wrong shape'
+        self._memo.scope(theta)
+        RV = sp.zeros([x1.shape[0]])
         for nc in xrange(len(self.covars)):
             covar = self.covars[nc]
             _theta = theta[self.covars_theta_I[nc]]
-            K_ = covar.K(_theta, x1, x2)
-            if (nc == 0):
-                K = K_
-            else:
-                K += K_
-        return K
+            RV = RV + self._memo.get(covar, 'Kdiag', _theta, x1, None, lambda: covar.Kdiag(_theta, x1))
+        return RV
 
     def Kgrad_theta(self, theta, x1, i):
         '''
@@ -94,12 +256,98 @@ class SumCF(CovarianceFunction):
         d = self.covars_theta_I[nc].min()
         j = i - d
         return covar.Kgrad_theta(theta[self.covars_theta_I[nc]], x1, j)
+
+    def Kgrad_theta_all(self, theta, x1):
+        """
+        Iterate over the partial derivatives with respect to all
+        hyperparameters, delegating to each covariance function in turn.
+
+        **Parameters:**
+        See :py:meth:`pygp.covar.CovarianceFunction.Kgrad_theta_all`
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'K: theta has wrong shape'
+        for nc in xrange(len(self.covars)):
+            covar = self.covars[nc]
+            for Kd in covar.Kgrad_theta_all(theta[self.covars_theta_I[nc]], x1):
+                yield Kd
+
+    def contract_grad_theta(self, theta, x1, W):
+        """
+        Contract the derivatives with W, delegating to each
+        covariance function in turn.
+
+        **Parameters:**
+        See :py:meth:`pygp.covar.CovarianceFunction.contract_grad_theta`
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'K: theta has wrong shape'
+        RV = sp.zeros(self.n_hyperparameters)
+        for nc in xrange(len(self.covars)):
+            covar = self.covars[nc]
+            I = self.covars_theta_I[nc]
+            RV[I] = covar.contract_grad_theta(theta[I], x1, W)
+        return RV
+
+    def contract_grad_theta_cross(self, theta, x1, x2, W):
+        """
+        Contract the derivatives of the cross covariance with W,
+        summing up the contractions of all covariance functions.
+
+        **Parameters:**
+        See :py:meth:`pygp.covar.CovarianceFunction.contract_grad_theta_cross`
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'K: theta has wrong shape'
+        RV = sp.zeros(self.n_hyperparameters)
+        for nc in xrange(len(self.covars)):
+            I = self.covars_theta_I[nc]
+            RV[I] = self.covars[nc].contract_grad_theta_cross(theta[I], x1, x2, W)
+        return RV
+
+    def K_block(self, theta, x1, x2, rows, cols):
+        """
+        Block [rows,cols] of the sum covariance, summing up the
+        corresponding blocks of all covariance functions.
+
+        **Parameters:**
+        See :py:meth:`pygp.covar.CovarianceFunction.K_block`
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'K: theta has wrong shape'
+        if x2 is None:
+            K = sp.zeros([x1[rows].shape[0], x1[cols].shape[0]])
+        else:
+            K = sp.zeros([x1[rows].shape[0], x2[cols].shape[0]])
+        for nc in xrange(len(self.covars)):
+            covar = self.covars[nc]
+            _theta = theta[self.covars_theta_I[nc]]
+            K += covar.K_block(_theta, x1, x2, rows, cols)
+        return K
+
+    def Kgrad_theta_block(self, theta, x1, i, rows, cols):
+        """
+        Block [rows,cols] of the partial derivative with respect
+        to the i-th hyperparameter.
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'K: theta has wrong shape'
+        nc = self.covars_covar_I[i]
+        covar = self.covars[nc]
+        j = i - self.covars_theta_I[nc].min()
+        return covar.Kgrad_theta_block(theta[self.covars_theta_I[nc]], x1, j, rows, cols)
+
+    def Kgrad_theta_diag(self, theta, x1, i):
+        """
+        Diagonal of the partial derivative with respect
+        to the i-th hyperparameter.
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'K: theta has wrong shape'
+        nc = self.covars_covar_I[i]
+        covar = self.covars[nc]
+        j = i - self.covars_theta_I[nc].min()
+        return covar.Kgrad_theta_diag(theta[self.covars_theta_I[nc]], x1, j)
         
 
     #derivative with respect to inputs
     def Kgrad_x(self, theta, x1, x2, d):
         assert theta.shape[0] == self.n_hyperparameters, 'K: theta has wrong shape'
-        RV = sp.zeros([x1.shape[0], x1.shape[0]])
+        RV = sp.zeros([x1.shape[0], x2.shape[0]])
         for nc in xrange(len(self.covars)):
             covar = self.covars[nc]
             _theta = theta[self.covars_theta_I[nc]]
@@ -127,12 +375,17 @@ class ProductCF(CovarianceFunction):
     covars : [CFs of type :py:class:`pygp.covar.CovarianceFunction`]
     
         Covariance functions to be multiplied.
+
+    memoize : boolean
+
+        memoize the covariances of the factors (see :py:class:`ChildMemo`)
         
     """
     #    __slots__=["n_params_list","covars","covars_theta_I"]
     
-    def __init__(self, covars, *args, **kw_args):
+    def __init__(self, covars, memoize=True, *args, **kw_args):
         super(ProductCF, self).__init__()
+        self._memo = ChildMemo(2 if memoize else 0)
         self.n_params_list = []
         self.covars = []
         self.covars_theta_I = []
@@ -163,6 +416,33 @@ class ProductCF(CovarianceFunction):
             names.extend(covar.get_hyperparameter_names())
         return names
 
+    def __getstate__(self):
+        return _getstate_without_memo(self)
+
+    def clear_memo(self):
+        self._memo.clear()
+        for covar in self.covars:
+            covar.clear_memo()
+
+    def _get_factors(self, theta, x1, x2=None, diag=False):
+        """
+        Returns [Ks, others]: the covariance (or its diagonal) of every
+        factor and the leave-one-out products of the other factors,
+        memoized so that K and the gradients for all hyperparameters at
+        one setting compute each factor once.
+        """
+        kind = 'Kdiag' if diag else 'K'
+        self._memo.scope(theta)
+        Ks = []
+        for nc in xrange(len(self.covars)):
+            covar = self.covars[nc]
+            _theta = theta[self.covars_theta_I[nc]]
+            if diag:
+                Ks.append(self._memo.get(covar, kind, _theta, x1, x2, lambda: covar.Kdiag(_theta, x1)))
+            else:
+                Ks.append(self._memo.get(covar, kind, _theta, x1, x2, lambda: covar.K(_theta, x1, x2)))
+        others = self._memo.get(self, 'others' + kind, theta, x1, x2, lambda: _leave_one_out_products(Ks))
+        return Ks, others
 
     def K(self, theta, x1, x2=None):
         """
@@ -176,18 +456,40 @@ class ProductCF(CovarianceFunction):
         """
         #1. check theta has correct length
         assert theta.shape[0] == self.n_hyperparameters, 'ProductCF: K: theta has wrong shape'
-        #2. create sum of covarainces..
+        #2. product of the factors; the last one times all others
+        Ks, others = self._get_factors(theta, x1, x2)
         if x2 is None:
             K = sp.ones([x1.shape[0], x1.shape[0]])
         else:
             K = sp.ones([x1.shape[0], x2.shape[0]])
-        for nc in xrange(len(self.covars)):
-            covar = self.covars[nc]
-            _theta = theta[self.covars_theta_I[nc]]
-            K *= covar.K(_theta, x1, x2)
+        K *= others[-1]
+        K *= Ks[-1]
         return K
 
 
+    def Kdiag(self, theta, x1):
+        """
+        Get diagonal of the product covariance: product of the
+        diagonals of all covariance functions.
+
+        **Parameters:**
+        See :py:class:`pygp.covar.CovarianceFunction`
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'ProductCF: K: theta has wrong shape'
+        Ks, others = self._get_factors(theta, x1, diag=True)
+        return sp.ones([x1.shape[0]]) * others[-1] * Ks[-1]
+
+    def Kgrad_theta_diag(self, theta, x, i):
+        """
+        Diagonal of the partial derivative with respect to the
+        i-th hyperparameter.
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'ProductCF: K: theta has wrong shape'
+        nc = self.covars_covar_I[i]
+        d = i - self.covars_theta_I[nc].min()
+        Ks, others = self._get_factors(theta, x, diag=True)
+        return self.covars[nc].Kgrad_theta_diag(theta[self.covars_theta_I[nc]], x, d) * others[nc]
+
     def Kgrad_theta(self, theta, x, i):
         '''The derivatives of the covariance matrix for
         the i-th hyperparameter.
@@ -215,28 +517,104 @@ class ProductCF(CovarianceFunction):
         nc = self.covars_covar_I[i]
         covar = self.covars[nc]
         d = i - self.covars_theta_I[nc].min()
-        Kd = covar.Kgrad_theta(theta[self.covars_theta_I[nc]],x,d)
+        #product of all other factors, shared by all hyperparameters at this setting
+        Ks, others = self._get_factors(theta, x)
+        return covar.Kgrad_theta(theta[self.covars_theta_I[nc]],x,d) * others[nc]
+
+    def Kgrad_theta_all(self, theta, x):
+        """
+        Iterate over the partial derivatives with respect to all
+        hyperparameters. The covariance of each factor is computed
+        only once and the products of all other factors are formed
+        from prefix and suffix products.
+
+        **Parameters:**
+        See :py:meth:`pygp.covar.CovarianceFunction.Kgrad_theta_all`
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'ProductCF: K: theta has wrong shape'
+        Ks, others = self._get_factors(theta, x)
+        for nc in xrange(len(self.covars)):
+            for Kd in self.covars[nc].Kgrad_theta_all(theta[self.covars_theta_I[nc]], x):
+                yield Kd * others[nc]
+
+    def contract_grad_theta(self, theta, x, W):
+        """
+        Contract the derivatives with W. The derivative of the product
+        with respect to a parameter of factor c is the derivative of c
+        times all other factors, hence each factor contracts against
+        W times the product of all other factors.
+
+        **Parameters:**
+        See :py:meth:`pygp.covar.CovarianceFunction.contract_grad_theta`
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'ProductCF: K: theta has wrong shape'
+        Ks, others = self._get_factors(theta, x)
+        RV = sp.zeros(self.n_hyperparameters)
+        for nc in xrange(len(self.covars)):
+            I = self.covars_theta_I[nc]
+            RV[I] = self.covars[nc].contract_grad_theta(theta[I], x, W * others[nc])
+        return RV
+
+    def contract_grad_theta_cross(self, theta, x1, x2, W):
+        """
+        Contract the derivatives of the cross covariance with W
+        (see :py:meth:`contract_grad_theta`).
+
+        **Parameters:**
+        See :py:meth:`pygp.covar.CovarianceFunction.contract_grad_theta_cross`
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'ProductCF: K: theta has wrong shape'
+        Ks, others = self._get_factors(theta, x1, x2)
+        RV = sp.zeros(self.n_hyperparameters)
+        for nc in xrange(len(self.covars)):
+            I = self.covars_theta_I[nc]
+            RV[I] = self.covars[nc].contract_grad_theta_cross(theta[I], x1, x2, W * others[nc])
+        return RV
+
+    def K_block(self, theta, x1, x2, rows, cols):
+        """
+        Block [rows,cols] of the product covariance, multiplying the
+        corresponding blocks of all covariance functions.
+
+        **Parameters:**
+        See :py:meth:`pygp.covar.CovarianceFunction.K_block`
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'ProductCF: K: theta has wrong shape'
+        if x2 is None:
+            K = sp.ones([x1[rows].shape[0], x1[cols].shape[0]])
+        else:
+            K = sp.ones([x1[rows].shape[0], x2[cols].shape[0]])
+        for nc in xrange(len(self.covars)):
+            covar = self.covars[nc]
+            _theta = theta[self.covars_theta_I[nc]]
+            K *= covar.K_block(_theta, x1, x2, rows, cols)
+        return K
+
+    def Kgrad_theta_block(self, theta, x, i, rows, cols):
+        """
+        Block [rows,cols] of the partial derivative with respect
+        to the i-th hyperparameter.
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'ProductCF: K: theta has wrong shape'
+        nc = self.covars_covar_I[i]
+        covar = self.covars[nc]
+        d = i - self.covars_theta_I[nc].min()
+        Kd = covar.Kgrad_theta_block(theta[self.covars_theta_I[nc]], x, d, rows, cols)
         for ind in xrange(len(self.covars)):
             if(ind != nc):
                 _theta = theta[self.covars_theta_I[ind]]
-                Kd *= self.covars[ind].K(_theta, x)
+                Kd = Kd * self.covars[ind].K_block(_theta, x, None, rows, cols)
         return Kd
 
     #derivative with respect to inputs
     def Kgrad_x(self, theta, x1, x2, d):
         assert theta.shape[0] == self.n_hyperparameters, 'Product CF: K: theta has wrong shape'
-        RV_sum = sp.zeros([x1.shape[0], x1.shape[0]])
-        RV_prod = sp.ones([x1.shape[0], x1.shape[0]])
+        #product rule: sum_c dK_c/dx * prod_{j!=c} K_j
+        Ks, others = self._get_factors(theta, x1, x2)
+        RV_sum = sp.zeros([x1.shape[0], x2.shape[0]])
         for nc in xrange(len(self.covars)):
-            RV_prod = sp.ones([x1.shape[0], x1.shape[0]])
-            for j in xrange(len(self.covars)):
-                _theta = theta[self.covars_theta_I[j]]
-                covar = self.covars[j]
-                if(j==nc):
-                    RV_prod*=covar.Kgrad_x(_theta,x1,x2,d)
-                else:
-                    RV_prod*=covar.K(_theta, x1, x2)
-            RV_sum += RV_prod
+            _theta = theta[self.covars_theta_I[nc]]
+            RV_sum += self.covars[nc].Kgrad_x(_theta, x1, x2, d) * others[nc]
         return RV_sum
 #            covar = self.covars[nc]
 #            if(d in covar.dimension_indices):
@@ -268,17 +646,11 @@ class ProductCF(CovarianceFunction):
 #        return RV_sum * RV_prod
 
 #        pdb.set_trace()
+        Ks, others = self._get_factors(theta, x1, diag=True)
         RV_sum = sp.zeros([x1.shape[0]])
         for nc in xrange(len(self.covars)):
-            RV_prod = sp.ones([x1.shape[0]])
-            for j in xrange(len(self.covars)):
-                _theta = theta[self.covars_theta_I[j]]
-                covar = self.covars[j]
-                if(j==nc):
-                    RV_prod*=covar.Kgrad_xdiag(_theta,x1,d)
-                else:
-                    RV_prod*=covar.Kdiag(_theta, x1)
-            RV_sum += RV_prod
+            _theta = theta[self.covars_theta_I[nc]]
+            RV_sum += self.covars[nc].Kgrad_xdiag(_theta, x1, d) * others[nc]
         return RV_sum
 
 #    def get_Iexp(self, theta):
@@ -317,12 +689,18 @@ class ShiftCF(CovarianceFunction):
             
         Thus, the replicate indices represent
         which inputs correspond to which replicate.
+
+    memoize : boolean
+
+        memoize the shifted inputs (see :py:class:`ChildMemo`), so that
+        covar sees the same input array in all evaluations at a setting
         
     """
 #    __slots__=["n_params_list","covars","covars_theta_I"]
 
-    def __init__(self, covar, replicate_indices, *args, **kw_args):
+    def __init__(self, covar, replicate_indices, memoize=True, *args, **kw_args):
         super(ShiftCF, self).__init__()
+        self._memo = ChildMemo(2 if memoize else 0)
         #1. check that covar is covariance function
         assert isinstance(covar, CovarianceFunction), 'ShiftCF: ShiftCF is constructed from a CovarianceFunction, which provides the partial derivative for the covariance matrix K with respect to input X'
         #2. get number of params
@@ -356,11 +734,8 @@ class ShiftCF(CovarianceFunction):
         #1. check theta has correct length
         assert theta.shape[0] == self.n_hyperparameters, 'ShiftCF: K: theta has wrong shape'
         #2. shift inputs of covarainces..
-        # get time shift parameter
         covar_n_hyper = self.covar.get_number_of_parameters()
-        # shift inputs
-        T = theta[covar_n_hyper:covar_n_hyper + self.n_replicates]
-        shift_x1 = self._shift_x(x1.copy(), T)
+        shift_x1 = self._get_shifted_x(theta, x1)
         K = self.covar.K(theta[:covar_n_hyper], shift_x1, x2)
         return K
 
@@ -389,8 +764,7 @@ class ShiftCF(CovarianceFunction):
         #1. check theta has correct length
         assert theta.shape[0] == self.n_hyperparameters, 'ShiftCF: K: theta has wrong shape'
         covar_n_hyper = self.covar.get_number_of_parameters()
-        T = theta[covar_n_hyper:covar_n_hyper + self.n_replicates]
-        shift_x = self._shift_x(x.copy(), T)        
+        shift_x = self._get_shifted_x(theta, x)
         if i >= covar_n_hyper:
             Kdx = self.covar.Kgrad_x(theta[:covar_n_hyper], shift_x, shift_x, 0)
             c = sp.array(self.replicate_indices == (i - covar_n_hyper),
@@ -405,6 +779,86 @@ class ShiftCF(CovarianceFunction):
         else:
             return self.covar.Kgrad_theta(theta[:covar_n_hyper], shift_x, i)
 
+    def Kgrad_theta_all(self, theta, x):
+        """
+        Iterate over the partial derivatives with respect to all
+        hyperparameters. The inputs are shifted once and the
+        derivative of the covariance with respect to the inputs is
+        shared by all time-shift parameters.
+
+        **Parameters:**
+        See :py:meth:`pygp.covar.CovarianceFunction.Kgrad_theta_all`
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'ShiftCF: K: theta has wrong shape'
+        covar_n_hyper = self.covar.get_number_of_parameters()
+        shift_x = self._get_shifted_x(theta, x)
+        for Kd in self.covar.Kgrad_theta_all(theta[:covar_n_hyper], shift_x):
+            yield Kd
+        Kdx = self.covar.Kgrad_x(theta[:covar_n_hyper], shift_x, shift_x, 0)
+        for r in xrange(self.n_replicates):
+            c = sp.array(self.replicate_indices == r, dtype='int')
+            if c.shape[0] != x.shape[0]:
+                yield Kdx.copy()
+            else:
+                yield Kdx * (c[sp.newaxis, :] - c[:, sp.newaxis])
+
+    def contract_grad_theta(self, theta, x, W):
+        """
+        Contract the derivatives with W (see :py:meth:`Kgrad_theta_all`).
+
+        **Parameters:**
+        See :py:meth:`pygp.covar.CovarianceFunction.contract_grad_theta`
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'ShiftCF: K: theta has wrong shape'
+        covar_n_hyper = self.covar.get_number_of_parameters()
+        shift_x = self._get_shifted_x(theta, x)
+        RV = sp.zeros(self.n_hyperparameters)
+        RV[:covar_n_hyper] = self.covar.contract_grad_theta(theta[:covar_n_hyper], shift_x, W)
+        WKdx = self.covar.Kgrad_x(theta[:covar_n_hyper], shift_x, shift_x, 0)
+        WKdx *= W
+        #sum_ij WKdx_ij (c_j - c_i)
+        WKdx_diff = WKdx.sum(axis=0) - WKdx.sum(axis=1)
+        WKdx_sum = WKdx.sum()
+        for r in xrange(self.n_replicates):
+            c = sp.array(self.replicate_indices == r, dtype='int')
+            if c.shape[0] != x.shape[0]:
+                RV[covar_n_hyper + r] = WKdx_sum
+            else:
+                RV[covar_n_hyper + r] = sp.dot(WKdx_diff, c)
+        return RV
+
+    def K_block(self, theta, x1, x2, rows, cols):
+        """
+        Block [rows,cols] of the covariance matrix on the shifted inputs.
+        The complete x1 is shifted first as the replicate of an input
+        is determined by its position.
+
+        **Parameters:**
+        See :py:meth:`pygp.covar.CovarianceFunction.K_block`
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'ShiftCF: K: theta has wrong shape'
+        covar_n_hyper = self.covar.get_number_of_parameters()
+        shift_x1 = self._get_shifted_x(theta, x1)
+        return self.covar.K_block(theta[:covar_n_hyper], shift_x1, x2, rows, cols)
+
+    def Kgrad_theta_block(self, theta, x, i, rows, cols):
+        """
+        Block [rows,cols] of the partial derivative with respect
+        to the i-th hyperparameter (see :py:meth:`Kgrad_theta`).
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'ShiftCF: K: theta has wrong shape'
+        covar_n_hyper = self.covar.get_number_of_parameters()
+        shift_x = self._get_shifted_x(theta, x)
+        if i >= covar_n_hyper:
+            Kdx = self.covar.Kgrad_x(theta[:covar_n_hyper], shift_x[rows], shift_x[cols], 0)
+            c = sp.array(self.replicate_indices == (i - covar_n_hyper), dtype='int')
+            if c.shape[0] != x.shape[0]:
+                return Kdx
+            cdist = c[cols][sp.newaxis, :] - c[rows][:, sp.newaxis]
+            return Kdx * cdist
+        else:
+            return self.covar.Kgrad_theta_block(theta[:covar_n_hyper], shift_x, i, rows, cols)
+
 #    def get_Iexp(self, theta):
 #        """
 #        Return indices of which hyperparameters are to be exponentiated
@@ -419,6 +873,20 @@ class ShiftCF(CovarianceFunction):
 #        Iexp = sp.array(Iexp,dtype='bool')
 #        return Iexp
         
+    def __getstate__(self):
+        return _getstate_without_memo(self)
+
+    def clear_memo(self):
+        self._memo.clear()
+        self.covar.clear_memo()
+
+    def _get_shifted_x(self, theta, x):
+        """memoized inputs x shifted by the time-shift parameters in theta"""
+        self._memo.scope(theta)
+        covar_n_hyper = self.covar.get_number_of_parameters()
+        T = theta[covar_n_hyper:covar_n_hyper + self.n_replicates]
+        return self._memo.get(self, 'shift', T, x, None, lambda: self._shift_x(x.copy(), T))
+
     def _shift_x(self, x, T):
         # subtract T, respectively
         if(x.shape[0]==self.replicate_indices.shape[0]):
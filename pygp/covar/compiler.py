@@ -0,0 +1,415 @@
+"""
+Covariance compiler
+===================
+
+Opt-in evaluation plans for trees of covariance functions::
+
+    from pygp.covar.compiler import compile_covariance
+    covar = compile_covariance(combinators.SumCF((combinators.ProductCF((SE1,SE2)),noise)))
+
+The returned :py:class:`CompiledCF` is a covariance function with the
+same hyperparameters as the tree. Its plan
+
+* computes the per-dimension squared distances once for all squared
+  exponential leaves acting on the same input dimensions,
+* evaluates sums and products in place into the output array, adding or
+  multiplying every leaf as soon as it is computed (exp, scaling and
+  accumulation are in-place numpy operations),
+* reuses scratch buffers within a call.
+
+Distances and buffers live in a workspace of a single call (K,
+Kgrad_theta, contract_grad_theta, ...), so a compiled covariance holds no
+data between calls, can be shared by threads and sees inputs modified
+in place.
+
+Compiled rules exist for :py:class:`pygp.covar.combinators.SumCF`,
+:py:class:`pygp.covar.combinators.ProductCF`,
+:py:class:`pygp.covar.se.SqexpCFARD`, :py:class:`pygp.covar.noise.NoiseCFISO`
+and :py:class:`pygp.covar.linear.LinearCFISO`; all other covariance
+functions (e.g. :py:class:`pygp.covar.combinators.ShiftCF`) are leaves
+evaluated through their own methods.
+"""
+
+from pygp.covar import CovarianceFunction
+from pygp.covar.combinators import SumCF, ProductCF, _leave_one_out_products
+from pygp.covar.se import SqexpCFARD
+from pygp.covar.noise import NoiseCFISO
+from pygp.covar.linear import LinearCFISO
+from pygp.covar import dist
+import scipy as SP
+
+
+def compile_covariance(covar):
+    """
+    Compile the covariance function tree covar into a :py:class:`CompiledCF`.
+    """
+    return CompiledCF(covar)
+
+
+class _Node(object):
+    """plan node: kind ('sum','prod','se','noise','linear','leaf'), covariance, theta indices, children"""
+    __slots__ = ["kind", "cf", "I", "children", "dims"]
+
+    def __init__(self, kind, cf, I, children=None):
+        self.kind = kind
+        self.cf = cf
+        self.I = I
+        self.children = children
+        self.dims = None
+        if kind == 'se':
+            self.dims = tuple(cf.dimension_indices)
+
+
+def _build_plan(covar, offset=0):
+    n = covar.get_number_of_parameters()
+    I = SP.arange(offset, offset + n)
+    if type(covar) in (SumCF, ProductCF):
+        children = [_build_plan(covar.covars[nc], offset + covar.covars_theta_I[nc][0] if len(covar.covars_theta_I[nc]) else offset)
+                    for nc in xrange(len(covar.covars))]
+        return _Node('sum' if type(covar) is SumCF else 'prod', covar, I, children)
+    kinds = {SqexpCFARD: 'se', NoiseCFISO: 'noise', LinearCFISO: 'linear'}
+    return _Node(kinds.get(type(covar), 'leaf'), covar, I)
+
+
+def _leaves(node):
+    if node.children is None:
+        return [node]
+    return sum([_leaves(child) for child in node.children], [])
+
+
+class _Workspace(object):
+    """state of a single evaluation: inputs, shared distance stacks and scratch buffers"""
+    __slots__ = ["x1", "x2", "dist", "buffers"]
+
+    def __init__(self, x1, x2=None):
+        self.x1 = x1
+        self.x2 = x2
+        self.dist = {}
+        self.buffers = []
+
+    def acquire(self, shape):
+        """scratch buffer of the given shape (return with :py:meth:`release`)"""
+        for i, buf in enumerate(self.buffers):
+            if buf.shape == shape:
+                return self.buffers.pop(i)
+        return SP.empty(shape)
+
+    def release(self, buf):
+        self.buffers.append(buf)
+        del self.buffers[:-4]
+
+    def get_dist(self, dims):
+        """[D x N x M] per-dimension squared distances for dims, shared by the SE leaves"""
+        if dims not in self.dist:
+            x1, x2 = self.x1, self.x2
+            stack = SP.empty([len(dims), x1.shape[0], x1.shape[0] if x2 is None else x2.shape[0]])
+            for d in xrange(len(dims)):
+                i = dims[d]
+                dist.sq_dist(x1[:, i:i + 1], None if x2 is None else x2[:, i:i + 1], out=stack[d])
+            self.dist[dims] = stack
+        return self.dist[dims]
+
+
+class CompiledCF(CovarianceFunction):
+    """
+    Covariance function evaluating the tree covar through a compiled plan.
+
+    **Parameters:**
+
+    covar : :py:class:`pygp.covar.CovarianceFunction`
+        covariance function (tree) to compile
+    """
+
+    def __init__(self, covar, *args, **kw_args):
+        super(CompiledCF, self).__init__()
+        self.covar = covar
+        self.n_hyperparameters = covar.get_number_of_parameters()
+        self.plan = _build_plan(covar)
+        #common subexpressions: dimensions shared by several SE leaves
+        dims = [leaf.dims for leaf in _leaves(self.plan) if leaf.kind == 'se']
+        self.shared_dims = set([d for d in dims if dims.count(d) > 1])
+
+    def get_hyperparameter_names(self):
+        return self.covar.get_hyperparameter_names()
+
+    def get_number_of_parameters(self):
+        return self.n_hyperparameters
+
+    def clear_memo(self):
+        self.covar.clear_memo()
+
+    def contract_grad_theta_cross(self, theta, x1, x2, W):
+        """cross contractions are not compiled; see :py:meth:`pygp.covar.CovarianceFunction.contract_grad_theta_cross`"""
+        return self.covar.contract_grad_theta_cross(theta, x1, x2, W)
+
+    #distances
+    def _sq_dist_dim(self, node, ws, d, out):
+        """squared distances in the d-th dimension of an SE leaf"""
+        if node.dims in self.shared_dims:
+            out[:] = ws.get_dist(node.dims)[d]
+            return out
+        i = node.dims[d]
+        x1, x2 = ws.x1, ws.x2
+        return dist.sq_dist(x1[:, i:i + 1], None if x2 is None else x2[:, i:i + 1], out=out)
+
+    #covariance
+    def K(self, theta, x1, x2=None):
+        """
+        Get Covariance matrix K with given hyperparameters
+        theta and inputs x1 and x2, evaluated in place by the plan.
+
+        **Parameters:**
+        See :py:class:`pygp.covar.CovarianceFunction`
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'CompiledCF: K: theta has wrong shape'
+        out = SP.empty([x1.shape[0], x1.shape[0] if x2 is None else x2.shape[0]])
+        self._eval(self.plan, theta, _Workspace(x1, x2), out, 'set')
+        return out
+
+    def _eval(self, node, theta, ws, out, op):
+        """out = / += / *= covariance of node (op 'set', 'add', 'mul')"""
+        if node.kind in ('sum', 'prod'):
+            #sums accumulate into out by adding, products by multiplying
+            inner = 'add' if node.kind == 'sum' else 'mul'
+            if op not in ('set', inner):
+                buf = ws.acquire(out.shape)
+                self._eval(node, theta, ws, buf, 'set')
+                self._combine(out, buf, op)
+                ws.release(buf)
+                return
+            for j, child in enumerate(node.children):
+                self._eval(child, theta, ws, out, op if j == 0 else inner)
+            return
+        th = theta[node.I]
+        if node.kind == 'noise':
+            self._eval_noise(th, ws.x2, out, op)
+            return
+        if op == 'set':
+            self._eval_leaf(node, th, ws, out)
+            return
+        buf = ws.acquire(out.shape)
+        self._eval_leaf(node, th, ws, buf)
+        self._combine(out, buf, op)
+        ws.release(buf)
+
+    def _combine(self, out, buf, op):
+        if op == 'set':
+            out[:] = buf
+        elif op == 'add':
+            out += buf
+        else:
+            out *= buf
+
+    def _eval_noise(self, th, x2, out, op):
+        """noise only touches the diagonal of self covariances"""
+        s = SP.exp(2 * th[0])
+        n = out.shape[0]
+        if x2 is not None:
+            if op != 'add':
+                out[:] = 0
+        elif op == 'set':
+            out[:] = 0
+            out.flat[::n + 1] = s
+        elif op == 'add':
+            out.flat[::n + 1] += s
+        else:
+            diag = out.diagonal() * s
+            out[:] = 0
+            out.flat[::n + 1] = diag
+
+    def _eval_leaf(self, node, th, ws, out):
+        """write the covariance of leaf node into out"""
+        x1, x2 = ws.x1, ws.x2
+        if node.kind == 'se':
+            L2 = SP.exp(2 * th[1:])
+            if node.dims in self.shared_dims:
+                D = ws.get_dist(node.dims)
+                SP.dot(-0.5 / L2, D.reshape(D.shape[0], -1), out=out.reshape(-1))
+            else:
+                L = SP.sqrt(L2)
+                dims = list(node.dims)
+                dist.sq_dist(x1[:, dims] / L, None if x2 is None else x2[:, dims] / L, out=out)
+                out *= -0.5
+            SP.exp(out, out)
+            out *= SP.exp(2 * th[0])
+        elif node.kind == 'linear':
+            x1_, x2_ = node.cf._filter_input_dimensions(x1, x2)
+            SP.dot(x1_, x2_.T, out=out)
+            out *= SP.exp(2 * th[0])
+        else:
+            out[:] = node.cf.K(th, x1, x2)
+
+    def Kdiag(self, theta, x1):
+        """
+        Get diagonal of the covariance matrix.
+
+        **Parameters:**
+        See :py:class:`pygp.covar.CovarianceFunction`
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'CompiledCF: K: theta has wrong shape'
+        return self._eval_diag(self.plan, theta, x1)
+
+    def _eval_diag(self, node, theta, x1):
+        if node.kind == 'sum':
+            RV = SP.zeros(x1.shape[0])
+            for child in node.children:
+                RV += self._eval_diag(child, theta, x1)
+            return RV
+        if node.kind == 'prod':
+            RV = SP.ones(x1.shape[0])
+            for child in node.children:
+                RV *= self._eval_diag(child, theta, x1)
+            return RV
+        th = theta[node.I]
+        if node.kind in ('se', 'noise'):
+            return SP.exp(2 * th[0]) * SP.ones(x1.shape[0])
+        return node.cf.Kdiag(th, x1)
+
+    #derivatives
+    def Kgrad_theta(self, theta, x1, i):
+        """
+        The partial derivative of the covariance matrix with
+        respect to the i-th hyperparameter; only the branch of the
+        plan holding theta[i] is evaluated.
+
+        **Parameters:**
+        See :py:class:`pygp.covar.CovarianceFunction`
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'CompiledCF: K: theta has wrong shape'
+        for j, Kd in self._grad(self.plan, theta, _Workspace(x1), None, i):
+            if j == i:
+                return Kd
+
+    def Kgrad_theta_all(self, theta, x1):
+        """
+        Iterate over the partial derivatives with respect to all
+        hyperparameters (see :py:meth:`pygp.covar.CovarianceFunction.Kgrad_theta_all`).
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'CompiledCF: K: theta has wrong shape'
+        for j, Kd in self._grad(self.plan, theta, _Workspace(x1), None, None):
+            yield Kd
+
+    def _grad(self, node, theta, ws, mult, index):
+        """
+        yield (i, mult * dK_node/dtheta_i) for the parameters of node
+        (only the subtree holding theta[index] if index is given)
+        """
+        if index is not None and index not in node.I:
+            return
+        if node.kind == 'sum':
+            for child in node.children:
+                for RV in self._grad(child, theta, ws, mult, index):
+                    yield RV
+            return
+        if node.kind == 'prod':
+            others = self._others(node, theta, ws)
+            for child, other in zip(node.children, others):
+                if index is not None and index not in child.I:
+                    continue
+                child_mult = other if mult is None else mult * other
+                for RV in self._grad(child, theta, ws, child_mult, index):
+                    yield RV
+            return
+        th = theta[node.I]
+        x1 = ws.x1
+        n = x1.shape[0]
+        if node.kind == 'se':
+            K = SP.empty([n, n])
+            self._eval_leaf(node, th, ws, K)
+            if mult is not None:
+                K *= mult
+            yield node.I[0], 2 * K
+            L2 = SP.exp(2 * th[1:])
+            for d in xrange(len(node.dims)):
+                if index is not None and index != node.I[1 + d]:
+                    continue
+                Kd = self._sq_dist_dim(node, ws, d, SP.empty([n, n]))
+                Kd *= K
+                Kd /= L2[d]
+                yield node.I[1 + d], Kd
+        elif node.kind in ('noise', 'linear'):
+            K = SP.empty([n, n])
+            if node.kind == 'noise':
+                self._eval_noise(th, None, K, 'set')
+            else:
+                self._eval_leaf(node, th, ws, K)
+            K *= 2
+            if mult is not None:
+                K *= mult
+            yield node.I[0], K
+        else:
+            for j, Kd in enumerate(node.cf.Kgrad_theta_all(th, x1)):
+                if mult is not None:
+                    Kd = Kd * mult
+                yield node.I[j], Kd
+
+    def _others(self, node, theta, ws):
+        """leave-one-out products of the factors of a product node"""
+        Ks = []
+        n = ws.x1.shape[0]
+        for child in node.children:
+            K = SP.empty([n, n])
+            self._eval(child, theta, ws, K, 'set')
+            Ks.append(K)
+        return _leave_one_out_products(Ks)
+
+    def contract_grad_theta(self, theta, x1, W):
+        """
+        Contract the derivatives with W, passing W times the other
+        factors of products down to the leaves; squared exponential
+        leaves contract the length-scale derivatives with the shared
+        distances without forming the derivatives.
+
+        **Parameters:**
+        See :py:meth:`pygp.covar.CovarianceFunction.contract_grad_theta`
+        """
+        assert theta.shape[0] == self.n_hyperparameters, 'CompiledCF: K: theta has wrong shape'
+        RV = SP.zeros(self.n_hyperparameters)
+        self._contract(self.plan, theta, _Workspace(x1), W, RV)
+        return RV
+
+    def _contract(self, node, theta, ws, W, RV):
+        if node.kind == 'sum':
+            for child in node.children:
+                self._contract(child, theta, ws, W, RV)
+            return
+        if node.kind == 'prod':
+            for child, other in zip(node.children, self._others(node, theta, ws)):
+                self._contract(child, theta, ws, W * other, RV)
+            return
+        th = theta[node.I]
+        x1 = ws.x1
+        n = x1.shape[0]
+        if node.kind == 'se':
+            WK = ws.acquire((n, n))
+            self._eval_leaf(node, th, ws, WK)
+            WK *= W
+            RV[node.I[0]] = 2 * WK.sum()
+            L2 = SP.exp(2 * th[1:])
+            if node.dims in self.shared_dims:
+                D = ws.get_dist(node.dims)
+                RV[node.I[1:]] = SP.dot(D.reshape(D.shape[0], -1), WK.reshape(-1)) / L2
+            else:
+                buf = ws.acquire((n, n))
+                for d in xrange(len(node.dims)):
+                    self._sq_dist_dim(node, ws, d, buf)
+                    RV[node.I[1 + d]] = SP.vdot(buf, WK) / L2[d]
+                ws.release(buf)
+            ws.release(WK)
+        elif node.kind == 'noise':
+            RV[node.I[0]] = 2 * SP.exp(2 * th[0]) * W.trace()
+        elif node.kind == 'linear':
+            x1_ = node.cf._filter_x(x1)
+            RV[node.I[0]] = 2 * SP.exp(2 * th[0]) * (x1_ * SP.dot(W, x1_)).sum()
+        else:
+            RV[node.I] = node.cf.contract_grad_theta(th, x1, W)
+
+    #delegated to the tree
+    def Kgrad_theta_diag(self, theta, x1, i):
+        return self.covar.Kgrad_theta_diag(theta, x1, i)
+
+    def Kgrad_x(self, theta, x1, x2, d):
+        return self.covar.Kgrad_x(theta, x1, x2, d)
+
+    def Kgrad_xdiag(self, theta, x1, d):
+        return self.covar.Kgrad_xdiag(theta, x1, d)
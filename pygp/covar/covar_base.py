@@ -20,6 +20,52 @@ For example to use the squared exponential CF with noise::
 # import scipy:
 import scipy as SP
 import logging as LG
+from pygp.linalg.structured import Dense
+
+
+#default memory budget (in bytes) of a single block in tiled kernel
+#evaluations (see CovarianceFunction.K_tiled)
+MAX_TILE_MEMORY = 64*2**20
+
+
+def tile_slices(n1,n2=None,max_memory=None,itemsize=8):
+    """
+    Partition an [n1 x n2] matrix into blocks which need at most
+    max_memory bytes each.
+
+    **Parameters:**
+
+    n1, n2 : int
+
+        Number of rows and columns. If n2 is None the matrix is
+        symmetric [n1 x n1]: rows and columns are partitioned
+        identically and only the blocks on and above the diagonal
+        are returned.
+
+    max_memory : int
+
+        Memory budget of a single block in bytes
+        (default: MAX_TILE_MEMORY).
+
+    **Returns:**
+
+    [(rows,cols)] : list of slice pairs, one per block.
+    """
+    if max_memory is None:
+        max_memory = MAX_TILE_MEMORY
+    n_entries = max(1,int(max_memory/itemsize))
+    if n2 is None:
+        #square blocks, diagonal blocks have identical row and column slices
+        b = max(1,min(n1,int(SP.sqrt(n_entries))))
+        starts = range(0,n1,b)
+        return [(slice(i,min(i+b,n1)),slice(j,min(j+b,n1))) for i in starts for j in starts if j>=i]
+    if n2<=n_entries:
+        #full rows
+        br = max(1,min(n1,n_entries//max(n2,1)))
+        bc = max(n2,1)
+    else:
+        br = bc = max(1,int(SP.sqrt(n_entries)))
+    return [(slice(i,min(i+br,n1)),slice(j,min(j+bc,n2))) for i in range(0,n1,br) for j in range(0,n2,bc)]
 
 
 class CovarianceFunction(object):
@@ -133,6 +179,106 @@ class CovarianceFunction(object):
         print "please implement Kd"
         pass
 
+    def Kgrad_theta_diag(self, theta, x1, i):
+        """
+        Diagonal of the partial derivative of the covariance
+        matrix with respect to the i-th hyperparameter.
+
+        *Default*: Diagonals of the diagonal blocks
+        (see :py:meth:`Kgrad_theta_block`). This may be
+        overwritten more efficiently.
+        """
+        RV = SP.empty(x1.shape[0])
+        for rows, cols in tile_slices(x1.shape[0]):
+            if rows == cols:
+                RV[rows] = self.Kgrad_theta_block(theta, x1, i, rows, cols).diagonal()
+        return RV
+
+    def Kgrad_theta_all(self, theta, x1):
+        """
+        Iterate over the partial derivatives of the covariance
+        matrix K with respect to all hyperparameters, in the
+        order of theta. Each derivative is a new array which
+        may be modified by the caller.
+
+        *Default*: Call :py:meth:`Kgrad_theta` for each
+        hyperparameter. Covariance functions should overwrite this
+        to compute intermediate results (kernel, distances) once for
+        all hyperparameters.
+
+        **Parameters:**
+
+        theta : [double]
+
+            The hyperparameters for covariance.
+
+        x1 : [double]
+        
+            The training input X.
+
+        """
+        for i in xrange(self.get_number_of_parameters()):
+            yield self.Kgrad_theta(theta,x1,i)
+
+    def contract_grad_theta(self, theta, x1, W):
+        """
+        Contract the partial derivatives of K(x1,x1) with
+        a weight matrix W, i.e. return the vector::
+
+            RV[i] = (W * Kgrad_theta(theta,x1,i)).sum()
+
+        for all hyperparameters. This is all GP models need
+        from the derivatives to compute the gradient of the
+        log marginal likelihood; implementations do not need to
+        materialize the derivative matrices.
+
+        *Default*: Contract the derivatives one at a time
+        (see :py:meth:`Kgrad_theta_all`).
+
+        **Parameters:**
+
+        theta : [double]
+
+            The hyperparameters for covariance.
+
+        x1 : [double]
+        
+            The training input X.
+
+        W : [double]
+
+            Symmetric [x1 x x1] weight matrix.
+        """
+        RV = SP.zeros(self.get_number_of_parameters())
+        for i,Kd in enumerate(self.Kgrad_theta_all(theta,x1)):
+            Kd *= W
+            RV[i] = Kd.sum()
+        return RV
+
+    def contract_grad_theta_cross(self, theta, x1, x2, W):
+        """
+        Contract the partial derivatives of the cross covariance
+        K(x1,x2) with a weight matrix W [x1 x x2], i.e. return::
+
+            RV[i] = (W * d/dtheta_i K(x1,x2)).sum()
+
+        as needed by sparse approximations for the inducing
+        inputs x1 and the training inputs x2.
+
+        *Default*: Cut the cross blocks out of the derivatives for
+        the joint inputs [x1;x2] (see :py:meth:`Kgrad_theta_block`),
+        which costs O((x1+x2)^2) per hyperparameter. Covariance
+        functions should overwrite this with an O(x1 x2) contraction.
+        """
+        n1 = x1.shape[0]
+        x_ = SP.concatenate((x1,x2),axis=0)
+        rows = slice(0,n1)
+        cols = slice(n1,x_.shape[0])
+        RV = SP.zeros(self.get_number_of_parameters())
+        for i in xrange(len(RV)):
+            RV[i] = (W*self.Kgrad_theta_block(theta,x_,i,rows,cols)).sum()
+        return RV
+
     def Kgrad_x(self,theta,x1,x2,d):
         """
         Partial derivatives of K[X1,X2] with respect to x1(:)^d
@@ -153,6 +299,211 @@ class CovarianceFunction(object):
         #print("%s: Function Kgrad_xdiag not yet implemented"%(self.__class__))
         return None
 
+    def K_tiled(self, theta, x1, x2=None, out=None, max_memory=None):
+        """
+        Get Covariance matrix K(x1,x2), evaluated block by block
+        such that no intermediate exceeds the memory budget.
+        The result is identical to :py:meth:`K`.
+
+        **Parameters:**
+
+        out : [double]
+
+            Optional preallocated [x1 x x2] output array, for
+            instance a numpy memmap for matrices which do not
+            fit into memory.
+
+        max_memory : int
+
+            Memory budget of a single block in bytes
+            (default: MAX_TILE_MEMORY).
+
+        Others see :py:meth:`K`
+        """
+        n1 = x1.shape[0]
+        if x2 is None:
+            n2 = None
+            shape = [n1,n1]
+        else:
+            n2 = x2.shape[0]
+            shape = [n1,n2]
+        if out is None:
+            out = SP.empty(shape)
+        for rows,cols in tile_slices(n1,n2,max_memory=max_memory):
+            Kb = self.K_block(theta,x1,x2,rows,cols)
+            out[rows,cols] = Kb
+            if (x2 is None) and (rows!=cols):
+                #symmetric: mirror the off-diagonal block
+                out[cols,rows] = SP.transpose(Kb)
+        return out
+
+    def Kgrad_theta_tiled(self, theta, x1, i, out=None, max_memory=None):
+        """
+        Get partial derivative of K with respect to the i-th
+        hyperparameter, evaluated block by block (see :py:meth:`K_tiled`).
+        The result is identical to :py:meth:`Kgrad_theta`.
+        """
+        n1 = x1.shape[0]
+        if out is None:
+            out = SP.empty([n1,n1])
+        for rows,cols in tile_slices(n1,max_memory=max_memory):
+            Kb = self.Kgrad_theta_block(theta,x1,i,rows,cols)
+            out[rows,cols] = Kb
+            if rows!=cols:
+                out[cols,rows] = SP.transpose(Kb)
+        return out
+
+    def K_batch(self, thetas, x1):
+        """
+        Stack [B x N x N] of the covariance matrices K(thetas[b],x1)
+        for B hyperparameter vectors thetas [B x P].
+
+        *Default*: Evaluate K for each hyperparameter vector.
+        """
+        return SP.array([self.K(theta,x1) for theta in thetas])
+
+    def contract_grad_theta_batch(self, thetas, x1, W, K=None):
+        """
+        Contract the derivatives of a stack of covariance matrices
+        (see :py:meth:`K_batch`) with a stack of matrices W [B x N x N]::
+
+            RV[b,i] = sum(Kgrad_theta(thetas[b],x1,i) * W[b])
+
+        K is the stack K_batch(thetas,x1), if it is already available;
+        implementations may use it to avoid recomputing the covariances.
+
+        *Default*: :py:meth:`contract_grad_theta` for each hyperparameter vector.
+        """
+        return SP.array([self.contract_grad_theta(thetas[b],x1,W[b]) for b in xrange(len(thetas))])
+
+    def K_dot(self, theta, x1, V, max_memory=None):
+        """
+        Matrix product K(x1,x1)*V, evaluated block by block so that
+        the covariance matrix is never formed (see :py:meth:`K_tiled`).
+
+        **Parameters:**
+
+        V : [N x k]
+            matrix to multiply with
+
+        Others see :py:meth:`K_tiled`
+        """
+        RV = SP.zeros(V.shape)
+        for rows,cols in tile_slices(x1.shape[0],max_memory=max_memory):
+            Kb = self.K_block(theta,x1,None,rows,cols)
+            RV[rows] += SP.dot(Kb,V[cols])
+            if rows!=cols:
+                RV[cols] += SP.dot(SP.transpose(Kb),V[rows])
+        return RV
+
+    def contract_grad_theta_lowrank(self, theta, x1, A, B, max_memory=None):
+        """
+        Contract the partial derivatives with the low rank matrix W=A*B'
+        (see :py:meth:`contract_grad_theta`), block by block without
+        forming W or the derivatives::
+
+            RV[i] = sum(Kgrad_theta(theta,x1,i) * dot(A,B.T))
+
+        **Parameters:**
+
+        A, B : [N x r]
+            factors of W
+
+        Others see :py:meth:`K_tiled`
+        """
+        RV = SP.zeros(self.get_number_of_parameters())
+        for rows,cols in tile_slices(x1.shape[0],max_memory=max_memory):
+            #the symmetric derivative collects W[rows,cols] and W[cols,rows]'
+            Wb = SP.dot(A[rows],B[cols].T)
+            if rows!=cols:
+                Wb += SP.dot(B[rows],A[cols].T)
+            for i in xrange(len(RV)):
+                RV[i] += (self.Kgrad_theta_block(theta,x1,i,rows,cols)*Wb).sum()
+        return RV
+
+    def K_block(self, theta, x1, x2, rows, cols):
+        """
+        Get the block K(x1,x2)[rows,cols] of the covariance matrix.
+        If x2 is None the block is taken from K(x1,x1).
+
+        *Default*: Evaluate K on the sliced inputs, diagonal
+        blocks of symmetric covariances are evaluated as self
+        covariances. Covariance functions which depend on the
+        position of the inputs (rather than their values) have
+        to overwrite this.
+
+        **Parameters:**
+
+        rows, cols : slice
+
+            Rows of x1 and columns of x2 (x1 if x2 is None)
+            the block is taken from.
+
+        Others see :py:meth:`K`
+        """
+        if x2 is None:
+            if rows==cols:
+                return self.K(theta,x1[rows])
+            return self.K(theta,x1[rows],x1[cols])
+        return self.K(theta,x1[rows],x2[cols])
+
+    def Kgrad_theta_block(self, theta, x1, i, rows, cols):
+        """
+        Get the block [rows,cols] of the partial derivative of K(x1,x1)
+        with respect to the i-th hyperparameter.
+
+        *Default*: Diagonal blocks are evaluated on the sliced inputs,
+        off-diagonal blocks are cut out of the derivative for the joint
+        inputs x1[rows] and x1[cols]. This may be overwritten
+        more efficiently.
+        """
+        if rows==cols:
+            return self.Kgrad_theta(theta,x1[rows],i)
+        xr = x1[rows]
+        nr = xr.shape[0]
+        x_ = SP.concatenate((xr,x1[cols]),axis=0)
+        return self.Kgrad_theta(theta,x_,i)[:nr,nr:]
+
+    def K_structured(self, theta, x1, x2=None):
+        """
+        Covariance matrix as a structured matrix (see
+        :py:mod:`pygp.linalg.structured`), e.g.
+        :py:class:`pygp.linalg.Diagonal` for noise terms, which
+        combinators and GP models add or contract without forming
+        the dense matrix.
+
+        *Default*: :py:class:`pygp.linalg.Dense` of :py:meth:`K`.
+        """
+        return Dense(SP.asarray(self.K(theta, x1, x2)))
+
+    def Kgrad_theta_structured(self, theta, x1, i):
+        """
+        Partial derivative with respect to the i-th hyperparameter
+        as a structured matrix (see :py:meth:`K_structured`).
+
+        *Default*: :py:class:`pygp.linalg.Dense` of :py:meth:`Kgrad_theta`.
+        """
+        return Dense(self.Kgrad_theta(theta, x1, i))
+
+    def clear_memo(self):
+        """
+        Drop the evaluations memoized for the current hyperparameters
+        (see :py:class:`pygp.covar.combinators.ChildMemo`) in the calling
+        thread. The GP models call this when an evaluation ends.
+
+        *Default*: nothing is memoized.
+        """
+        pass
+
+    def freeze(self, theta):
+        """
+        Return a :py:class:`FrozenCF`, i.e. this covariance function
+        with the hyperparameters theta fixed, for repeated evaluation
+        against stored training inputs (see :py:class:`pygp.gp.frozen.FrozenGP`).
+        Covariance functions may override this to precompute constants.
+        """
+        return FrozenCF(self, theta)
+
     def get_hyperparameter_names(self):
         """
         Return names of hyperparameters to make
@@ -203,6 +554,32 @@ class CovarianceFunction(object):
         Filter is self.dimension_indices.
         Returns : filtered x1, filtered x2
         """
-        if x2 == None:
+        if x2 is None:
             return self._filter_x(x1), self._filter_x(x1)
         return self._filter_x(x1), self._filter_x(x2)
+
+
+class FrozenCF(object):
+    """
+    Covariance function with fixed hyperparameters, as returned by
+    :py:meth:`CovarianceFunction.freeze`.
+
+    Training inputs are transformed once by :py:meth:`prepare`;
+    :py:meth:`K` evaluates the cross covariance between prepared
+    and raw inputs.
+    """
+    def __init__(self, covar, theta):
+        self.covar = covar
+        self.theta = SP.array(theta, dtype='float')
+
+    def prepare(self, x):
+        """transform inputs x to be passed as x1 to :py:meth:`K`"""
+        return x
+
+    def K(self, x1, x2):
+        """cross covariance between prepared inputs x1 and inputs x2"""
+        return self.covar.K_tiled(self.theta, x1, x2)
+
+    def Kdiag(self, x):
+        """diagonal of the covariance of the inputs x"""
+        return self.covar.Kdiag(self.theta, x)
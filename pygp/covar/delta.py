@@ -47,6 +47,13 @@ class DeltaCFISO(CovarianceFunction):
         RV*=2
         return RV
 
+    def contract_grad_theta_cross(self,theta,x1,x2,W):
+        """contract the derivative of the cross covariance [x1 x x2] with W"""
+        x1, x2 = self._filter_input_dimensions(x1,x2)
+        #dist(x2,x1) is [x1 x x2 x dimensions]
+        K = (dist.dist(x2,x1)==0).sum(axis=2)
+        return SP.array([2*SP.exp(2*theta[0])*(W*K).sum()])
+
     def Kgrad_x(self,theta,x1,x2,d):
         RV = SP.zeros([x1.shape[0],x2.shape[0]])
         return RV
@@ -95,6 +102,13 @@ class DeltaCF(CovarianceFunction):
         #derivative w.r.t. to amplitude
         return K
 
+    def contract_grad_theta_cross(self,theta,x1,x2,W):
+        """contract the derivatives of the cross covariance with W"""
+        A  = 2*SP.exp(2*theta)
+        #dist(x2,x1) is [x1 x x2 x dimensions]
+        D = 1.0*(dist.dist(x2,x1)==0)
+        return A*(W[:,:,SP.newaxis]*D).sum(axis=0).sum(axis=0)
+
     def Kdiag(self,theta,x1):
         """self covariance"""
         if (x1.shape[0]==self._K.shape[0]):
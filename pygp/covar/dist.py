@@ -26,16 +26,50 @@ def dist(X,Y=None):
         rv = _dist_1_dimension(X, Y)
     return rv
 
-def sq_dist(*args):
+def sq_dist(X,Y=None,out=None):
     '''calcualte square-distance of all inputs:
     sq_dist(X)     : Matrix of all combinations of distances of Xi with Xj
-    sq_dist(X1,X2) : Matrix of all combinations of distances of X1i with X2j'''
-    rv = dist(*args)
-    #elementwise product does the tric:
-    rv = rv*rv
-    #now sum up the last dimension:
-    rv = rv.sum(axis=2)
-    return rv
+    sq_dist(X1,X2) : Matrix of all combinations of distances of X1i with X2j
+
+    The distances are computed using the expansion
+    |x-y|^2 = |x|^2 + |y|^2 - 2 x'y, i.e. the only N x M operation is a
+    single matrix product (BLAS gemm). Negative values caused by round-off
+    are clamped to zero.
+
+    out : optional preallocated [N x M] array (e.g. a memmap) the result
+          is written into.'''
+    if(len(X.shape)<=1):
+        X=X.reshape(-1,1)
+    X = SP.asarray(X,dtype='float64')
+    symmetric = Y is None
+    if symmetric:
+        Y = X
+    else:
+        if(len(Y.shape)<=1):
+            Y=Y.reshape(-1,1)
+        Y = SP.asarray(Y,dtype='float64')
+    #squared norms
+    X2 = (X*X).sum(axis=1)
+    if symmetric:
+        Y2 = X2
+    else:
+        Y2 = (Y*Y).sum(axis=1)
+    if out is None:
+        out = SP.empty([X.shape[0],Y.shape[0]])
+    #-2x'y
+    if out.flags.c_contiguous and out.dtype==SP.float64:
+        SP.dot(X,Y.T,out=out)
+    else:
+        out[:,:] = SP.dot(X,Y.T)
+    out *= -2
+    out += X2[:,SP.newaxis]
+    out += Y2[SP.newaxis,:]
+    #clamp negative round-off
+    SP.maximum(out,0,out)
+    if symmetric:
+        #distance to self is exactly zero
+        out.flat[::out.shape[1]+1] = 0
+    return out
 
 
 def Bdist(*args):
@@ -45,12 +45,32 @@ class FixedCF(CovarianceFunction):
         else:
             return SP.zeros([x1.shape[0]])
 
+    def K_block(self,theta,x1,x2,rows,cols):
+        """block [rows,cols] of the fixed covariance structure"""
+        if x2 is None:
+            x2 = x1
+        A  = SP.exp(2*theta[0])
+        if (x1.shape[0]==self._K.shape[0]) and (x2.shape[0]==self._K.shape[1]):
+            return A*self._K[rows,cols]
+        else:
+            return SP.zeros([x1[rows].shape[0],x2[cols].shape[0]])
+
+    def Kgrad_theta_block(self,theta,x1,i,rows,cols):
+        RV = self.K_block(theta,x1,None,rows,cols)
+        #derivative w.r.t. to amplitude
+        RV*=2
+        return RV
+
     def Kgrad_theta(self,theta,x1,i):
         RV = self.K(theta,x1)
         #derivative w.r.t. to amplitude
         RV*=2
         return RV
 
+    def contract_grad_theta_cross(self,theta,x1,x2,W):
+        """contract the derivative of the cross covariance (zero unless x1, x2 match the fixed matrix) with W"""
+        return SP.array([2*(W*self.K(theta,x1,x2)).sum()])
+
     def Kgrad_x(self,theta,x1,x2,d):
         RV = SP.zeros([x1.shape[0],x2.shape[0]])
         return RV
@@ -111,6 +131,37 @@ class SqexpFixed(CovarianceFunction):
             RV *= Dr         
         return RV
 
+    def K_block(self,theta,x1,x2,rows,cols):
+        """block [rows,cols] of the covariance of the fixed distances"""
+        if x2 is None:
+            x2 = x1
+        if (x1.shape[0]==self._K.shape[0]) and (x2.shape[0]==self._K.shape[1]):
+            A  = SP.exp(2*theta[0])
+            L  = SP.exp(theta[1])
+            Dr = (self._K[rows,cols]/L)**2
+            return A*SP.exp(-0.5*Dr)
+        else:
+            return SP.zeros([x1[rows].shape[0],x2[cols].shape[0]])
+
+    def Kgrad_theta_block(self,theta,x1,i,rows,cols):
+        RV = self.K_block(theta,x1,None,rows,cols)
+        if i==0:
+            #derivative w.r.t. to amplitude
+            RV*=2
+        elif i==1:
+            #lengthscale
+            L  = SP.exp(theta[1])
+            RV *= (self._K[rows,cols]/L)**2
+        return RV
+
+    def contract_grad_theta_cross(self,theta,x1,x2,W):
+        """contract the derivatives of the cross covariance (zero unless x1, x2 match the fixed matrix) with W"""
+        if (x1.shape[0]!=self._K.shape[0]) or (x2.shape[0]!=self._K.shape[1]):
+            return SP.zeros(2)
+        WK = W*self.K(theta,x1,x2)
+        L  = SP.exp(theta[1])
+        return SP.array([2*WK.sum(),(WK*(self._K/L)**2).sum()])
+
 
     def get_hyperparameter_names(self):
         names = []
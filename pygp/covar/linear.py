@@ -12,6 +12,7 @@ LinearCFARD
 
 import scipy as SP
 from pygp.covar import CovarianceFunction
+from pygp.linalg.structured import LowRank
 import pdb
 
 class LinearCFISO(CovarianceFunction):
@@ -33,10 +34,19 @@ class LinearCFISO(CovarianceFunction):
 
     def Kdiag(self,theta,x1):
         x1 = self._filter_x(x1)
-        RV = SP.dot(x1,x1.T).sum(axis=1)
-        RV*=2
+        A  = SP.exp(2*theta[0])
+        RV = A*(x1*x1).sum(axis=1)
         return RV
 
+    def K_structured(self,theta,x1,x2=None):
+        """the linear covariance A x1 x2' as :py:class:`pygp.linalg.LowRank`"""
+        x1, x2 = self._filter_input_dimensions(x1,x2)
+        return LowRank(SP.exp(2*theta[0])*x1,x2)
+
+    def Kgrad_theta_structured(self,theta,x1,i):
+        assert i==0, 'LinearCF: Kgrad_theta: only one hyperparameter for linear covariance'
+        x1 = self._filter_x(x1)
+        return LowRank(2*SP.exp(2*theta[0])*x1,x1)
 
     def Kgrad_theta(self,theta,x1,i):
         assert i==0, 'LinearCF: Kgrad_theta: only one hyperparameter for linear covariance'
@@ -45,6 +55,18 @@ class LinearCFISO(CovarianceFunction):
         RV*=2
         return RV
 
+    def contract_grad_theta(self,theta,x1,W):
+        """contract derivative with W without forming the kernel: 2*A*sum(x1 * W x1)"""
+        x1 = self._filter_x(x1)
+        A  = SP.exp(2*theta[0])
+        return SP.array([2*A*(x1*SP.dot(W,x1)).sum()])
+
+    def contract_grad_theta_cross(self,theta,x1,x2,W):
+        """contract the derivative of the cross covariance with W: 2*A*sum(x1 * W x2)"""
+        x1, x2 = self._filter_input_dimensions(x1,x2)
+        A  = SP.exp(2*theta[0])
+        return SP.array([2*A*(x1*SP.dot(W,x2)).sum()])
+
 
     def Kgrad_x(self,theta,x1,x2,d):
         x1, x2 = self._filter_input_dimensions(x1,x2)
@@ -111,11 +133,34 @@ class LinearCF(CovarianceFunction):
 	    
         return RV
 
+    def K_structured(self,logtheta,x1,x2=None):
+        """the linear covariance as :py:class:`pygp.linalg.LowRank`"""
+        if x2 is None:
+            x2 = x1
+        L = SP.exp(2*logtheta[0:self.n_dimensions])
+        return LowRank(x1[:,self.dimension_indices]*L,x2[:,self.dimension_indices])
+
     def Kgrad_theta(self,logtheta,x1,i):
         iid = self.dimension_indices[i]
         Li = SP.exp(2*logtheta[i])
         RV = 2*Li*SP.dot(x1[:,iid:iid+1],x1[:,iid:iid+1].T)
         return RV
+
+    def Kgrad_theta_structured(self,logtheta,x1,i):
+        iid = self.dimension_indices[i]
+        Li = SP.exp(2*logtheta[i])
+        return LowRank(2*Li*x1[:,iid:iid+1],x1[:,iid:iid+1])
+
+    def contract_grad_theta(self,logtheta,x1,W):
+        """contract derivatives with W without forming the kernel: 2*L_i x1_i' W x1_i"""
+        x1_ = x1[:,self.dimension_indices]
+        L  = SP.exp(2*logtheta[0:self.n_dimensions])
+        return 2*L*(x1_*SP.dot(W,x1_)).sum(axis=0)
+
+    def contract_grad_theta_cross(self,logtheta,x1,x2,W):
+        """contract the derivatives of the cross covariance with W: 2*L_i x1_i' W x2_i"""
+        L  = SP.exp(2*logtheta[0:self.n_dimensions])
+        return 2*L*(x1[:,self.dimension_indices]*SP.dot(W,x2[:,self.dimension_indices])).sum(axis=0)
     
 
     def Kgrad_x(self,logtheta,x1,x2,d):
@@ -178,12 +223,35 @@ class LinearCFARD(CovarianceFunction):
 	RV = SP.dot(SP.dot(x1[:, self.dimension_indices], M), x2[:, self.dimension_indices].T)
         return RV
 
+    def K_structured(self,theta,x1,x2=None):
+        """the linear covariance as :py:class:`pygp.linalg.LowRank`"""
+        if x2 is None:
+            x2 = x1
+        L = 1./theta[0:self.n_dimensions]
+        return LowRank(x1[:,self.dimension_indices]*L,x2[:,self.dimension_indices])
+
     def Kgrad_theta(self,theta,x1,i):
         iid = self.dimension_indices[i]
         #Li = SP.exp(-2*theta[i])
         Li = 1./theta[i]
         RV = -1*Li**2*SP.dot(x1[:,iid:iid+1],x1[:,iid:iid+1].T)
         return RV
+
+    def Kgrad_theta_structured(self,theta,x1,i):
+        iid = self.dimension_indices[i]
+        Li = 1./theta[i]
+        return LowRank(-1*Li**2*x1[:,iid:iid+1],x1[:,iid:iid+1])
+
+    def contract_grad_theta(self,theta,x1,W):
+        """contract derivatives with W without forming the kernel: -x1_i' W x1_i / theta_i^2"""
+        x1_ = x1[:,self.dimension_indices]
+        L = 1./theta[0:self.n_dimensions]
+        return -1*L**2*(x1_*SP.dot(W,x1_)).sum(axis=0)
+
+    def contract_grad_theta_cross(self,theta,x1,x2,W):
+        """contract the derivatives of the cross covariance with W: -x1_i' W x2_i / theta_i^2"""
+        L = 1./theta[0:self.n_dimensions]
+        return -1*L**2*(x1[:,self.dimension_indices]*SP.dot(W,x2[:,self.dimension_indices])).sum(axis=0)
     
 
     def Kgrad_x(self,theta,x1,x2,d):
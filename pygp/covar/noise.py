@@ -14,6 +14,7 @@ sys.path.append("../")
 import scipy as SP
 
 from pygp.covar import CovarianceFunction
+from pygp.linalg.structured import Diagonal, Sum
 
 
 
@@ -49,6 +50,28 @@ class NoiseCFISO(CovarianceFunction):
 
         return noise
 
+    def Kdiag(self,theta,x1):
+        """
+        Get diagonal of the noise covariance.
+
+        **Parameters:**
+        See :py:class:`pygp.covar.CovarianceFunction`
+        """
+        return SP.exp(2*theta[0])*SP.ones([x1.shape[0]])
+
+    def K_structured(self,theta,x1,x2=None):
+        """
+        Noise covariance as :py:class:`pygp.linalg.Diagonal`
+        (zero for cross covariances).
+        """
+        if x2 is None:
+            return Diagonal(self.Kdiag(theta,x1))
+        return Sum([],(x1.shape[0],x2.shape[0]))
+
+    def Kgrad_theta_structured(self,theta,x1,i):
+        assert i==0, 'unknown hyperparameter'
+        return Diagonal(self.Kgrad_theta_diag(theta,x1,i))
+
     def Kgrad_theta(self,theta,x1,i):
         """
         The derivative of the covariance matrix with
@@ -63,6 +86,35 @@ class NoiseCFISO(CovarianceFunction):
         assert i==0, 'unknown hyperparameter'
         return 2*K
 
+    def Kgrad_theta_diag(self,theta,x1,i):
+        """
+        Diagonal of the derivative with respect to the noise level.
+        """
+        assert i==0, 'unknown hyperparameter'
+        return 2*self.Kdiag(theta,x1)
+
+    def contract_grad_theta(self,theta,x1,W):
+        """
+        Contract the derivative with W; only the diagonal of W matters.
+
+        **Parameters:**
+        See :py:meth:`pygp.covar.CovarianceFunction.contract_grad_theta`
+        """
+        return SP.array([2*SP.exp(2*theta[0])*W.trace()])
+
+    def contract_grad_theta_cross(self,theta,x1,x2,W):
+        """the cross covariance has no noise"""
+        return SP.zeros(self.n_hyperparameters)
+
+    def Kgrad_theta_block(self,theta,x1,i,rows,cols):
+        """
+        Block [rows,cols] of the derivative with respect to the noise
+        level; only diagonal blocks are non-zero.
+        """
+        if rows==cols:
+            return self.Kgrad_theta(theta,x1[rows],i)
+        return SP.zeros([x1[rows].shape[0],x1[cols].shape[0]])
+
     def Kgrad_x(self,theta,x1,x2,d):
         RV = SP.zeros([x1.shape[0],x2.shape[0]])
         return RV
@@ -97,13 +149,32 @@ class NoiseCFReplicates(CovarianceFunction):
         assert len(theta)==self.n_hyperparameters,'Too many hyperparameters'
         #noise is only present if have a single argument
         if(x2 is None):
-            noise = SP.eye(x1.shape[0])
-            for i_,n in enumerate(theta):
-                noise[self.replicate_indices==i_] *= SP.exp(2*n)
+            noise = SP.diag(self.Kdiag(theta,x1))
         else:
             noise = 0 
         return noise
 
+    def Kdiag(self,theta,x1):
+        """noise level of the replicate of each input"""
+        return SP.exp(2*SP.asarray(theta,dtype='float'))[self.replicate_indices]
+
+    def K_structured(self,theta,x1,x2=None):
+        """
+        Noise covariance as :py:class:`pygp.linalg.Diagonal`
+        (zero for cross covariances).
+        """
+        if x2 is None:
+            return Diagonal(self.Kdiag(theta,x1))
+        return Sum([],(x1.shape[0],x2.shape[0]))
+
+    def Kgrad_theta_structured(self,theta,x1,i):
+        assert i<self.n_hyperparameters, 'unknown hyperparameters'
+        return Diagonal(self.Kgrad_theta_diag(theta,x1,i))
+
+    def Kgrad_theta_diag(self,theta,x1,i):
+        assert i<self.n_hyperparameters, 'unknown hyperparameters'
+        return 2*SP.exp(2*theta[i])*(self.replicate_indices==i)
+
     def Kgrad_theta(self,theta,x1,i):
         '''
         The derivative of the covariance matrix with
@@ -114,12 +185,45 @@ class NoiseCFReplicates(CovarianceFunction):
         '''
         #1. calculate kernel
         #no noise
-        assert i<self.n_hyperparameters, 'unknown hyperparameters'
-        K = SP.eye(x1.shape[0])
-        K[self.replicate_indices==i] *= SP.exp(
-            2*theta[i])
-        K[self.replicate_indices!=i] *= 0
-        return 2*K  
+        return SP.diag(self.Kgrad_theta_diag(theta,x1,i))
+
+    def contract_grad_theta(self,theta,x1,W):
+        """
+        Contract the derivatives with W; only the diagonal of W matters.
+
+        **Parameters:**
+        See :py:meth:`pygp.covar.CovarianceFunction.contract_grad_theta`
+        """
+        Wdiag = W.diagonal()
+        RV = SP.zeros(self.n_hyperparameters)
+        for i in xrange(self.n_hyperparameters):
+            RV[i] = 2*SP.exp(2*theta[i])*Wdiag[self.replicate_indices==i].sum()
+        return RV
+
+    def contract_grad_theta_cross(self,theta,x1,x2,W):
+        """the cross covariance has no noise"""
+        return SP.zeros(self.n_hyperparameters)
+
+    def K_block(self,theta,x1,x2,rows,cols):
+        """
+        Block [rows,cols] of the covariance matrix. Noise levels
+        are assigned by position, hence only diagonal blocks of the
+        self covariance are non-zero.
+        """
+        if (x2 is None) and (rows==cols):
+            sigma = SP.exp(2*SP.array(theta))
+            return SP.diag(sigma[self.replicate_indices[rows]])
+        return 0
+
+    def Kgrad_theta_block(self,theta,x1,i,rows,cols):
+        """
+        Block [rows,cols] of the derivative with respect to the i-th
+        noise level.
+        """
+        if rows==cols:
+            Kd = 2*SP.exp(2*theta[i])*(self.replicate_indices[rows]==i)
+            return SP.diag(1.0*Kd)
+        return SP.zeros([x1[rows].shape[0],x1[cols].shape[0]])
 
     def Kgrad_x(self,theta,x1,x2,d):
         RV = SP.zeros([x1.shape[0],x2.shape[0]])
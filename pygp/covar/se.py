@@ -9,7 +9,7 @@ or :py:class:`pygp.covar.combinators.ProductCF` with the :py:class:`pygp.covar.n
 
 import scipy as SP
 import logging as LG
-from pygp.covar import CovarianceFunction
+from pygp.covar import CovarianceFunction, FrozenCF, tile_slices
 import dist
 import pdb
 
@@ -61,14 +61,19 @@ class SqexpCFARD(CovarianceFunction):
         **Parameters:**
         See :py:class:`pygp.covar.CovarianceFunction`
         """
-        #1. get inputs
-        x1, x2 = self._filter_input_dimensions(x1,x2)
-        #2. exponentialte parameters
+        #1. exponentialte parameters
         V0 = SP.exp(2*theta[0])
         L  = SP.exp(theta[1:1+self.n_dimensions])
-        sqd = dist.sq_dist(x1/L,x2/L)
-        #3. calculate the whole covariance matrix:
-        rv = V0*SP.exp(-0.5*sqd)
+        #2. get (rescaled) inputs and squared distances
+        x1_ = self._filter_x(x1)/L
+        if x2 is None:
+            rv = dist.sq_dist(x1_)
+        else:
+            rv = dist.sq_dist(x1_,self._filter_x(x2)/L)
+        #3. calculate the whole covariance matrix (inplace):
+        rv *= -0.5
+        SP.exp(rv,rv)
+        rv *= V0
         return rv
 
     def Kdiag(self,theta, x1):
@@ -91,23 +96,161 @@ class SqexpCFARD(CovarianceFunction):
         **Parameters:**
         See :py:class:`pygp.covar.CovarianceFunction`
         """
-        x1 = self._filter_x(x1)
-        # 2. exponentiate params:
-        V0 = SP.exp(2*theta[0])
+        # 1. exponentiate params:
         L  = SP.exp(theta[1:1+self.n_dimensions])
-        # calculate squared distance manually as we need to dissect this below
-        x1_ = x1/L
-        d  = dist.dist(x1_,x1_)
-        sqd = (d*d)
-        sqdd = sqd.sum(axis=2)
-        #3. calcualte withotu derivatives, need this anyway:
-        rv0 = V0*SP.exp(-0.5*sqdd)
+        #2. calcualte without derivatives, need this anyway:
+        rv0 = self.K(theta,x1)
         if i==0:
-            return 2*rv0
+            rv0 *= 2
+            return rv0
         else:
-            return rv0*sqd[:,:,i-1]
+            # squared distance in the dimension of the lengthscale
+            x1_ = self._filter_x(x1)[:,i-1]/L[i-1]
+            rv0 *= dist.sq_dist(x1_)
+            return rv0
+
+    def Kgrad_theta_diag(self, theta, x1, i):
+        """
+        Diagonal of the partial derivative with respect to the
+        i-th hyperparameter; only the amplitude enters the diagonal.
+
+        **Parameters:**
+        See :py:meth:`pygp.covar.CovarianceFunction.Kgrad_theta_diag`
+        """
+        if i == 0:
+            return 2*SP.exp(2*theta[0])*SP.ones([x1.shape[0]])
+        return SP.zeros([x1.shape[0]])
+
+    def Kgrad_theta_all(self, theta, x1):
+        """
+        Iterate over the derivatives with respect to amplitude and
+        all length-scales. The kernel is computed only once.
+
+        **Parameters:**
+        See :py:meth:`pygp.covar.CovarianceFunction.Kgrad_theta_all`
+        """
+        L  = SP.exp(theta[1:1+self.n_dimensions])
+        rv0 = self.K(theta,x1)
+        yield 2*rv0
+        x1_ = self._filter_x(x1)/L
+        for d in xrange(self.n_dimensions):
+            Kd = dist.sq_dist(x1_[:,d])
+            Kd *= rv0
+            yield Kd
+
+    def contract_grad_theta(self, theta, x1, W, max_memory=None):
+        """
+        Contract all derivatives with W streaming over blocks of rows,
+        the length-scale derivatives are sums of W*K*(x1_i-x1_j)^2/L^2.
+
+        **Parameters:**
+
+        max_memory : int
+
+            Memory budget of a single block in bytes.
+
+        Others see :py:meth:`pygp.covar.CovarianceFunction.contract_grad_theta`
+        """
+        L  = SP.exp(theta[1:1+self.n_dimensions])
+        x1_ = self._filter_x(x1)/L
+        n = x1.shape[0]
+        RV = SP.zeros(self.n_dimensions+1)
+        for rows,cols in tile_slices(n,n,max_memory=max_memory):
+            WK = self.K_block(theta,x1,None,rows,cols)
+            WK *= W[rows,cols]
+            RV[0] += 2*WK.sum()
+            for d in xrange(self.n_dimensions):
+                RV[1+d] += (WK*dist.sq_dist(x1_[rows,d],x1_[cols,d])).sum()
+        return RV
+
+    def contract_grad_theta_cross(self, theta, x1, x2, W):
+        """
+        Contract the derivatives of the cross covariance K(x1,x2) with W
+        in O(x1 x2) per dimension.
+
+        **Parameters:**
+        See :py:meth:`pygp.covar.CovarianceFunction.contract_grad_theta_cross`
+        """
+        L  = SP.exp(theta[1:1+self.n_dimensions])
+        x1_ = self._filter_x(x1)/L
+        x2_ = self._filter_x(x2)/L
+        WK = self.K(theta,x1,x2)
+        WK *= W
+        RV = SP.zeros(self.n_dimensions+1)
+        RV[0] = 2*WK.sum()
+        for d in xrange(self.n_dimensions):
+            RV[1+d] = (WK*dist.sq_dist(x1_[:,d],x2_[:,d])).sum()
+        return RV
+
+    def Kgrad_theta_block(self, theta, x1, i, rows, cols):
+        """
+        Block [rows,cols] of the derivative with respect
+        to the i-th hyperparameter.
+
+        **Parameters:**
+        See :py:meth:`pygp.covar.CovarianceFunction.Kgrad_theta_block`
+        """
+        if rows==cols:
+            return self.Kgrad_theta(theta,x1[rows],i)
+        L  = SP.exp(theta[1:1+self.n_dimensions])
+        rv0 = self.K(theta,x1[rows],x1[cols])
+        if i==0:
+            rv0 *= 2
+            return rv0
+        else:
+            x1_ = self._filter_x(x1)[:,i-1]/L[i-1]
+            rv0 *= dist.sq_dist(x1_[rows],x1_[cols])
+            return rv0
+
+    def K_batch(self, thetas, x1):
+        """
+        Stack of covariance matrices for hyperparameter vectors thetas [B x P],
+        sharing the per-dimension squared distances.
+
+        **Parameters:**
+        See :py:meth:`pygp.covar.CovarianceFunction.K_batch`
+        """
+        V0 = SP.exp(2*thetas[:,0])
+        L2 = SP.exp(2*thetas[:,1:1+self.n_dimensions])
+        rv = SP.tensordot(-0.5/L2,self._sq_dist_stack(x1),axes=(1,0))
+        SP.exp(rv,rv)
+        rv *= V0[:,SP.newaxis,SP.newaxis]
+        return rv
+
+    def contract_grad_theta_batch(self, thetas, x1, W, K=None):
+        """
+        Contract the derivatives for a stack of hyperparameter vectors
+        with the stack W [B x N x N] in a few tensor products.
+
+        **Parameters:**
+        See :py:meth:`pygp.covar.CovarianceFunction.contract_grad_theta_batch`
+        """
+        L2 = SP.exp(2*thetas[:,1:1+self.n_dimensions])
+        if K is None:
+            K = self.K_batch(thetas,x1)
+        WK = W*K
+        RV = SP.empty(thetas.shape)
+        RV[:,0] = 2*WK.sum(axis=2).sum(axis=1)
+        RV[:,1:] = SP.tensordot(WK,self._sq_dist_stack(x1),axes=([1,2],[1,2]))/L2
+        return RV
+
+    def _sq_dist_stack(self, x1):
+        """[D x N x N] squared distances in each input dimension"""
+        x1_ = self._filter_x(x1)
+        return SP.array([dist.sq_dist(x1_[:,d:d+1]) for d in xrange(x1_.shape[1])])
+
+    def freeze(self, theta):
+        """
+        Fixed hyperparameters: inputs are filtered and rescaled by
+        the length-scales once.
+
+        **Parameters:**
+        See :py:meth:`pygp.covar.CovarianceFunction.freeze`
+        """
+        V0 = SP.exp(2*theta[0])
+        L  = SP.exp(theta[1:1+self.n_dimensions])
+        return FrozenSqexpCFARD(V0, L, self.dimension_indices)
 
-    
     def Kgrad_x(self,theta,x1,x2,d):
         """
         The partial derivative of the covariance matrix with
@@ -132,9 +275,9 @@ class SqexpCFARD(CovarianceFunction):
 #        #3. calculate the whole covariance matrix:
 #        rv = V0*SP.exp(-0.5*sqd)
         #4. get non-squared distance in right dimesnion:
-        nsdist = -dist.dist(x1,x2)[:,:,d]/L2[d]
-        
-        return rv * nsdist
+        nsdist = (x2[:,d][SP.newaxis,:]-x1[:,d][:,SP.newaxis])/L2[d]
+        rv *= nsdist
+        return rv
     
     def Kgrad_xdiag(self,theta,x1,d):
         """"""
@@ -142,3 +285,27 @@ class SqexpCFARD(CovarianceFunction):
         #because (x1^d-x1^d) = 0
         RV = SP.zeros([x1.shape[0]])
         return RV
+
+
+class FrozenSqexpCFARD(FrozenCF):
+    """
+    :py:class:`SqexpCFARD` with fixed amplitude V0 and length-scales L.
+    See :py:class:`pygp.covar.FrozenCF`
+    """
+    def __init__(self, V0, L, dimension_indices):
+        self.V0 = V0
+        self.L = SP.array(L)
+        self.dimension_indices = SP.array(dimension_indices)
+
+    def prepare(self, x):
+        return x[:,self.dimension_indices]/self.L
+
+    def K(self, x1, x2):
+        rv = dist.sq_dist(x1,self.prepare(x2))
+        rv *= -0.5
+        SP.exp(rv,rv)
+        rv *= self.V0
+        return rv
+
+    def Kdiag(self, x):
+        return self.V0*SP.ones([x.shape[0]])
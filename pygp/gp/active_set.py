@@ -0,0 +1,74 @@
+"""
+Active set selection
+====================
+
+Greedy selection of a representative subset of the training data, in
+the spirit of the informative vector machine (Lawrence et al., 2003):
+the point with the largest posterior variance given the points selected
+so far is added, until a target size is reached or the largest remaining
+variance falls below a tolerance. The posterior is tracked by an
+incomplete (pivoted) Cholesky factorization, which grows by one column
+per step, so selecting k points costs O(N k^2).
+
+Usage::
+
+    I = greedy_variance_selection(covar, hyperparams['covar'], x, noise, max_size=500)
+    gp.set_active_set_indices(I)
+"""
+
+import scipy as SP
+import logging as LG
+
+
+def greedy_variance_selection(covar, theta, x, noise=None, max_size=None, tol=0.):
+    """
+    Select an active set by greedy maximization of the posterior variance.
+
+    **Parameters:**
+
+    covar : :py:class:`pygp.covar.CovarianceFunction`
+        covariance function of the latent process (without noise)
+
+    theta : [double]
+        hyperparameters of covar
+
+    x : [N x D]
+        training inputs
+
+    noise : [N] or double
+        observation noise variance (default: 0)
+
+    max_size : int
+        maximum number of selected points (default: N)
+
+    tol : double
+        stop once the largest posterior variance is below tol
+
+    **Returns:**
+
+    indices : [int], the selected points in order of selection
+    """
+    n = x.shape[0]
+    if max_size is None:
+        max_size = n
+    max_size = min(max_size, n)
+    if noise is None:
+        noise = 0.
+    noise = noise * SP.ones(n)
+    #1. posterior variance and incomplete Cholesky factor of K+noise
+    d = SP.array(covar.Kdiag(theta, x), dtype='float')
+    G = SP.zeros([n, max_size])
+    indices = []
+    for k in xrange(max_size):
+        j = d.argmax()
+        if d[j] <= tol:
+            break
+        #2. rank-one update: new column of the factor
+        kj = covar.K(theta, x, x[j:j + 1])[:, 0]
+        g = (kj - SP.dot(G[:, :k], G[j, :k])) / SP.sqrt(d[j] + noise[j])
+        G[:, k] = g
+        d -= g * g
+        d[indices + [j]] = -SP.inf
+        indices.append(j)
+    LG.debug("active set: %d points, max. remaining variance %g" % (len(indices), d.max()))
+    return SP.array(indices, dtype='int')
@@ -0,0 +1,265 @@
+"""
+Batched independent GPs
+=======================
+
+B independent GP regressions on shared inputs x, one for each column of
+y, each with its own hyperparameters. Covariance matrices, Cholesky
+factors and inverses are handled as stacks [B x N x N] with vectorized
+numpy linear algebra, so the work is done in BLAS/LAPACK calls rather
+than in a Python loop over models; inverses are obtained from the
+Cholesky factors (LAPACK dpotri).
+
+Hyperparameters are stacked per target::
+
+    hyperparams = {'covar': [B x P], 'lik': [B x 1]}
+
+and are optimized with :py:func:`pygp.optimize.opt_hyper_batch`, which
+runs one BFGS optimizer per target in lockstep with batched evaluations.
+:py:func:`pygp.optimize.opt_hyper` also works (the objective is the sum of
+the individual negative log marginal likelihoods) but couples the line
+searches of all targets.
+"""
+
+from pygp.gp import GP
+import numpy as NP
+import scipy as SP
+import scipy.lib.lapack.flapack
+import logging as LG
+
+
+class BatchedGP(GP):
+    """
+    Independent GPs for all columns of y, sharing the inputs x.
+
+    **Parameters:**
+
+    batch_size : int
+        number of targets whose [N x N] matrices are held in memory at once
+        (default: all)
+
+    covar_func : :py:class:`pygp.covar.CovarianceFunction`
+        covariance function; :py:meth:`pygp.covar.CovarianceFunction.K_batch`
+        and :py:meth:`pygp.covar.CovarianceFunction.contract_grad_theta_batch`
+        are used for the stacks
+
+    likelihood : :py:class:`pygp.likelihood.GaussLikISO`
+        isotropic Gaussian noise, one noise level per target
+
+    See :py:class:`pygp.gp.GP` for the remaining parameters.
+    """
+    __slots__ = ["batch_size"]
+
+    def __init__(self, batch_size=None, **kw_args):
+        self.batch_size = batch_size
+        super(BatchedGP, self).__init__(**kw_args)
+
+    def select_targets(self, I):
+        """
+        Return a :py:class:`BatchedGP` for the targets I (columns of y),
+        sharing the inputs, covariance function and likelihood.
+        """
+        return BatchedGP(batch_size=self.batch_size, covar_func=self.covar,
+                         likelihood=self.likelihood, x=self.x, y=self.y[:, I])
+
+    def _batches(self):
+        B = self.y.shape[1]
+        batch_size = self.batch_size or B
+        return [slice(i, min(i + batch_size, B)) for i in xrange(0, B, batch_size)]
+
+    def get_covariances(self, hyperparams):
+        """
+        Return the stacked covariance structure::
+
+            K     [B x N x N] (without the likelihood noise)
+            Kinv  [B x N x N]
+            alpha [N x B]
+            logdet [B]
+
+        If batch_size is smaller than the number of targets only
+        alpha and logdet are stored; see :py:meth:`_get_batch`.
+        """
+        key = self._cache_key(hyperparams)
+        KV = self._factorization_cache.get(key)
+        if KV is not None:
+            self._covar_cache = KV
+            return KV
+        batches = self._batches()
+        B = self.y.shape[1]
+        KV = {'alpha': SP.empty([self._get_input_dimension(), B]), 'logdet': SP.empty(B)}
+        for b in batches:
+            Kb = self._get_batch(hyperparams, b)
+            KV['alpha'][:, b] = Kb['alpha']
+            KV['logdet'][b] = Kb['logdet']
+            if len(batches) == 1:
+                KV.update({'K': Kb['K'], 'Kinv': Kb['Kinv']})
+        KV['hyperparams'] = dict([(k, SP.array(v, copy=True)) for k, v in hyperparams.iteritems()])
+        self._covar_cache = KV
+        self._factorization_cache.put(key, KV)
+        return KV
+
+    def _get_batch(self, hyperparams, b):
+        """
+        stacked covariance structure of the targets b (a slice); targets
+        whose covariance is not positive definite get infinite logdet
+        and nan alpha/Kinv, so that the remaining targets are unaffected
+        """
+        try:
+            return self._factorize_batch(hyperparams, b)
+        except NP.linalg.LinAlgError:
+            if b.stop - b.start == 1:
+                n = self._get_input_dimension()
+                nan = SP.nan * SP.ones([1, n, n])
+                return {'K': nan, 'Kinv': nan, 'alpha': SP.nan * SP.ones([n, 1]), 'logdet': SP.array([SP.inf])}
+        RV = [self._get_batch(hyperparams, slice(i, i + 1)) for i in xrange(b.start, b.stop)]
+        return {'K': SP.concatenate([r['K'] for r in RV]),
+                'Kinv': SP.concatenate([r['Kinv'] for r in RV]),
+                'alpha': SP.concatenate([r['alpha'] for r in RV], axis=1),
+                'logdet': SP.concatenate([r['logdet'] for r in RV])}
+
+    def _factorize_batch(self, hyperparams, b):
+        x = self._get_x()
+        I = SP.arange(x.shape[0])
+        K = self.covar.K_batch(hyperparams['covar'][b], x)
+        if self.likelihood is not None:
+            sigma = SP.exp(2 * hyperparams['lik'][b, 0])
+            K[:, I, I] += sigma[:, SP.newaxis]
+        #batched Cholesky for the determinant, inverses from the factors for alpha and gradients
+        L = NP.linalg.cholesky(K)
+        if self.likelihood is not None:
+            #K is kept without noise for the gradients (see contract_grad_theta_batch)
+            K[:, I, I] -= sigma[:, SP.newaxis]
+        logdet = 2 * SP.log(L[:, I, I]).sum(1)
+        Kinv = SP.empty(L.shape)
+        for i in xrange(L.shape[0]):
+            Kinv_i, info = scipy.lib.lapack.flapack.dpotri(L[i], lower=1)
+            if info != 0:
+                raise NP.linalg.LinAlgError('dpotri failed (%d)' % info)
+            # mirror the strictly lower triangle to obtain the full inverse
+            Kinv[i] = Kinv_i + SP.tril(Kinv_i, -1).T
+        y = self._get_y()[:, b]
+        alpha = NP.matmul(Kinv, y.T[:, :, SP.newaxis])[:, :, 0].T
+        return {'K': K, 'Kinv': Kinv, 'alpha': alpha, 'logdet': logdet}
+
+    def LML_batch(self, hyperparams):
+        """
+        Negative log marginal likelihood of each target [B]
+        (infinite for targets with non positive definite covariance).
+        """
+        KV = self.get_covariances(hyperparams)
+        lml_quad = 0.5 * (KV['alpha'] * self._get_y()).sum(0)
+        RV = lml_quad + 0.5 * KV['logdet'] + 0.5 * self._get_input_dimension() * SP.log(2 * SP.pi)
+        #the quadratic term is nan for these targets
+        RV[SP.isinf(KV['logdet'])] = SP.inf
+        return RV
+
+    def _LML_covar(self, hyperparams):
+        try:
+            LML = self.LML_batch(hyperparams).sum()
+        except NP.linalg.LinAlgError:
+            LG.error("exception caught (%s)" % (str(hyperparams)))
+            return 1E6
+        if not SP.isfinite(LML):
+            LG.error("non positive definite covariance (%s)" % (str(hyperparams)))
+            return 1E6
+        return LML
+
+    def _LMLgrad_covar(self, hyperparams):
+        try:
+            #copies: callers subtract prior gradients in place, the cached gradients must stay intact
+            return dict([(k, v.copy()) for k, v in self._LMLgrad_batch(hyperparams).iteritems()])
+        except NP.linalg.LinAlgError:
+            LG.error("exception caught (%s)" % (str(hyperparams)))
+            RV = {'covar': SP.zeros(hyperparams['covar'].shape)}
+            if self.likelihood is not None:
+                RV['lik'] = SP.zeros(hyperparams['lik'].shape)
+            return RV
+
+    def _LMLgrad_lik(self, hyperparams):
+        return {'lik': self._LMLgrad_covar(hyperparams)['lik']}
+
+    def _LMLgrad_batch(self, hyperparams):
+        """gradients of all targets: contractions of the stacked W = Kinv - alpha alpha'"""
+        KV = self.get_covariances(hyperparams)
+        if 'LMLgrad' in KV:
+            return KV['LMLgrad']
+        x = self._get_x()
+        I = SP.arange(x.shape[0])
+        RV = {'covar': SP.empty(hyperparams['covar'].shape)}
+        if self.likelihood is not None:
+            RV['lik'] = SP.zeros(hyperparams['lik'].shape)
+        for b in self._batches():
+            if 'Kinv' in KV:
+                Kb = KV
+            else:
+                Kb = self._get_batch(hyperparams, b)
+            Kinv = Kb['Kinv']
+            alpha = KV['alpha'][:, b]
+            W = Kinv - alpha.T[:, :, SP.newaxis] * alpha.T[:, SP.newaxis, :]
+            RV['covar'][b] = 0.5 * self.covar.contract_grad_theta_batch(hyperparams['covar'][b], x, W, K=Kb['K'])
+            if self.likelihood is not None:
+                sigma = SP.exp(2 * hyperparams['lik'][b, 0])
+                RV['lik'][b, 0] = sigma * W[:, I, I].sum(1)
+        #targets with non positive definite covariance, as in GP
+        failed = SP.isinf(KV['logdet'])
+        for key in RV.keys():
+            RV[key][failed] = 0
+        KV['LMLgrad'] = RV
+        return RV
+
+    def _LML_prior(self, hyperparams, priors={}):
+        """
+        prior contributions for the stacked hyperparameters [B x P]: the
+        priors of the P hyperparameters apply to every target. Values are
+        arrays [B x 2 x P], such that [:, 0] and [:, 1] select the prior
+        values and gradients [B x P] as for :py:class:`pygp.gp.GP`.
+        """
+        if priors is None:
+            priors = {}
+        RV = {}
+        for key, value in hyperparams.iteritems():
+            value = SP.asarray(value)
+            pvalues = SP.zeros([value.shape[0], 2, value.shape[1]])
+            if key in priors:
+                plist = priors[key]
+                assert len(plist) == value.shape[1], 'priors for %s: %d expected' % (key, value.shape[1])
+                for b in xrange(value.shape[0]):
+                    for i in xrange(value.shape[1]):
+                        pvalues[b, :, i] = plist[i][0](value[b, i], plist[i][1])
+            RV[key] = pvalues
+        return RV
+
+    def predict(self, hyperparams, xstar, var=True):
+        """
+        Predict mean and variance of all targets at xstar.
+        Returns [mu, S2], both [M x B].
+
+        **Parameters:**
+
+        hyperparams : {'covar':[B x P], 'lik':[B x 1]}
+            stacked hyperparameters in logSpace
+
+        xstar : [M x D]
+            prediction inputs
+        """
+        KV = self.get_covariances(hyperparams)
+        x = self._get_x()
+        thetas = hyperparams['covar']
+        B = thetas.shape[0]
+        M = xstar.shape[0]
+        mu = SP.empty([M, B])
+        S2 = SP.empty([M, B])
+        for i in xrange(B):
+            Kstar = self.covar.K(thetas[i], x, xstar)
+            mu[:, i] = SP.dot(Kstar.T, KV['alpha'][:, i])
+            if not var:
+                continue
+            if 'Kinv' in KV:
+                Kinv = KV['Kinv'][i]
+            else:
+                Kinv = self._get_batch(hyperparams, slice(i, i + 1))['Kinv'][0]
+            S2[:, i] = self.covar.Kdiag(thetas[i], xstar) - (Kstar * SP.dot(Kinv, Kstar)).sum(0)
+            if self.likelihood is not None:
+                S2[:, i] += SP.exp(2 * hyperparams['lik'][i, 0])
+        if var:
+            return [mu, abs(S2)]
+        return mu
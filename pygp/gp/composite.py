@@ -2,12 +2,78 @@
 Grouping GP regression classes
 ==============================
 
-Module for composite Gaussian processes models that combine multiple GPs into one model
+Module for composite Gaussian processes models that combine multiple GPs into one model.
+
+The members of a :py:class:`GroupGP` can be evaluated concurrently::
+
+    GroupGP(GPs, executor='thread')    #thread pool, BLAS releases the GIL
+    GroupGP(GPs, executor='process')   #worker processes, forked once
+
+In process mode every worker owns a fixed subset of the members for the
+lifetime of the group, so that their factorization caches stay warm
+between calls. The workers are forked, i.e. the training data is shared
+copy-on-write with the parent instead of being pickled.
+
+Members with identical inputs and the same covariance function and
+likelihood (replicated experiments) are collapsed into a single GP with
+one column of y per member, so that K is factorized once for all of
+them (see the share_inputs argument of :py:class:`GroupGP`).
 """
 
 from pygp.gp import GP
+from multiprocessing.pool import ThreadPool
+import multiprocessing
+import traceback
 import scipy as SP
 
+
+def _call_unit(task):
+    """evaluate a call (method, args, kw_args) on a unit GP"""
+    gp, (method, args, kw_args) = task
+    return getattr(gp, method)(*args, **kw_args)
+
+
+def _group_worker(conn, units):
+    """worker process loop: evaluate one call per owned unit per request"""
+    while True:
+        calls = conn.recv()
+        if calls is None:
+            break
+        try:
+            conn.send(('ok', map(_call_unit, zip(units, calls))))
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+    conn.close()
+
+
+class SharedInputsGP(GP):
+    """
+    Members of a :py:class:`GroupGP` with identical inputs, covariance
+    function and likelihood, collapsed into one GP whose y holds the
+    targets of all members side by side. Its log marginal likelihood
+    and gradients equal the sums over the members; priors are counted
+    once per member as in the separate GPs.
+
+    **Parameters:**
+
+    n_members : int
+        number of collapsed members
+
+    See :py:class:`pygp.gp.GP` for the remaining parameters.
+    """
+    __slots__ = ["n_members"]
+
+    def __init__(self, n_members=1, **kw_args):
+        self.n_members = n_members
+        super(SharedInputsGP, self).__init__(**kw_args)
+
+    def _LML_prior(self, hyperparams, priors={}):
+        RV = GP._LML_prior(self, hyperparams, priors=priors)
+        for key in RV.keys():
+            RV[key] = self.n_members * RV[key]
+        return RV
+
+
 class GroupGP(GP):
     """
     Class to bundle one or more GPs for joint
@@ -17,14 +83,34 @@ class GroupGP(GP):
 
     GPs : [:py:class:`gpr.GP`]
         Array, holding al GP classes to be optimized together
+
+    executor : str
+        evaluation of the members: None (sequential), 'thread' or 'process'
+
+    n_workers : int
+        number of threads or processes (default: min(#GPs, #cpus))
+
+    share_inputs : 'auto' or boolean
+        collapse members with identical inputs into one factorization:
+        'auto' compares the inputs of members of class GP that share
+        the covariance function and likelihood objects; True declares
+        that all members have the same inputs; False disables it.
+        Call :py:meth:`setData` after modifying member data directly.
     """
-    __slots__ = ["N","GPs"]
+    __slots__ = ["N","GPs","executor","n_workers","share_inputs","_units","_pool","_workers"]
 
 
-    def __init__(self,GPs=None):
+    def __init__(self,GPs=None,executor=None,n_workers=None,share_inputs='auto'):
         # create a prototype of the parameter dictionary
         # additional fields will follow
+        assert executor in [None,'thread','process'], 'unknown executor %s' % executor
         self._invalidate_cache()
+        self.executor = executor
+        self.n_workers = n_workers
+        self.share_inputs = share_inputs
+        self._units = None
+        self._pool = None
+        self._workers = None
         if GPs is None:
             print "you need to specify a list of Gaussian Processes to bundle"
             return None
@@ -44,8 +130,7 @@ class GroupGP(GP):
     
         """
         R = 0
-        for n in range(self.N):
-            L = self.GPs[n].LML(hyperparams,**LML_kwargs)
+        for L in self._map('LML',hyperparams,**LML_kwargs):
             R = R+L
         return R
 
@@ -63,14 +148,129 @@ class GroupGP(GP):
 
         """
         #just call them all and add up:
+        return self._sum_grad(self._map('LMLgrad',hyperparams,**lml_kwargs))
+
+    def LML_and_grad(self,hyperparams,**lml_kwargs):
+        """
+        Returns the log Marginal likelihood and its gradient,
+        evaluating each member once.
+
+        See :py:meth:`pygp.gp.GP.LML_and_grad`
+        """
+        RV = self._map('LML_and_grad',hyperparams,**lml_kwargs)
+        return [sum([r[0] for r in RV]),self._sum_grad([r[1] for r in RV])]
+
+    def _sum_grad(self,grads):
         R = 0
-        #calculate them for all N
-        for n in range(self.N):
-            L = self.GPs[n].LMLgrad(hyperparams,**lml_kwargs)
+        for L in grads:
             for key in L.keys():
                 R += (L[key])
         return {'covar':R}
 
+    def _get_units(self):
+        """
+        Returns the units evaluated by the group: [(gp, members)],
+        where gp is either a single member or a :py:class:`SharedInputsGP`
+        holding the targets of all members in order.
+        """
+        if self._units is not None:
+            return self._units
+        groups = []
+        for n in range(self.N):
+            gp = self.GPs[n]
+            for group in groups:
+                if self._shares_inputs(self.GPs[group[0]],gp):
+                    group.append(n)
+                    break
+            else:
+                groups.append([n])
+        self._units = []
+        for members in groups:
+            if len(members) == 1:
+                self._units.append((self.GPs[members[0]],members))
+                continue
+            gp = self.GPs[members[0]]
+            y = SP.concatenate([self.GPs[n].y for n in members],axis=1)
+            shared = SharedInputsGP(n_members=len(members),covar_func=gp.covar,likelihood=gp.likelihood,x=gp.x,y=y)
+            self._units.append((shared,members))
+        return self._units
+
+    def _shares_inputs(self,gp0,gp):
+        if not self.share_inputs:
+            return False
+        if self.share_inputs == 'auto':
+            for g in [gp0,gp]:
+                if type(g) is not GP or g._active_set_indices is not None:
+                    return False
+            if gp.covar is not gp0.covar or gp.likelihood is not gp0.likelihood:
+                return False
+            return gp.x.shape == gp0.x.shape and (gp.x == gp0.x).all()
+        return True
+
+    def _get_n_workers(self):
+        if self.n_workers is not None:
+            return min(self.n_workers,len(self._get_units()))
+        return min(multiprocessing.cpu_count(),len(self._get_units()))
+
+    def _map(self,method,*args,**kw_args):
+        """evaluate method(*args,**kw_args) on all units, results in unit order"""
+        return self._map_units([(method,args,kw_args)]*len(self._get_units()))
+
+    def _map_units(self,calls):
+        """evaluate one call (method, args, kw_args) per unit, results in unit order"""
+        units = [gp for gp,members in self._get_units()]
+        if self.executor is None or len(units) < 2:
+            return map(_call_unit,zip(units,calls))
+        if self.executor == 'thread':
+            if self._pool is None:
+                self._pool = ThreadPool(self._get_n_workers())
+            return self._pool.map(_call_unit,zip(units,calls))
+        #process: send the calls to all workers, then collect
+        if self._workers is None:
+            self._start_workers()
+        for conn,owned,process in self._workers:
+            conn.send([calls[u] for u in owned])
+        RV = [None]*len(units)
+        errors = []
+        for conn,owned,process in self._workers:
+            status,results = conn.recv()
+            if status == 'error':
+                errors.append(results)
+                continue
+            for u,r in zip(owned,results):
+                RV[u] = r
+        if errors:
+            raise RuntimeError('GroupGP worker failed:\n%s' % errors[0])
+        return RV
+
+    def _start_workers(self):
+        """fork the worker processes, unit u is owned by worker u % n_workers"""
+        units = [gp for gp,members in self._get_units()]
+        n_workers = self._get_n_workers()
+        self._workers = []
+        for w in range(n_workers):
+            owned = range(w,len(units),n_workers)
+            conn,child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_group_worker,
+                                              args=(child_conn,[units[u] for u in owned]))
+            process.daemon = True
+            process.start()
+            child_conn.close()
+            self._workers.append((conn,owned,process))
+
+    def close(self):
+        """shut down the thread pool or worker processes (restarted on demand)"""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        if self._workers is not None:
+            for conn,owned,process in self._workers:
+                conn.send(None)
+                conn.close()
+                process.join()
+            self._workers = None
+
     def setData(self,x,y):
         """
         set inputs x and outputs y with **Parameters:**
@@ -88,6 +288,9 @@ class GroupGP(GP):
             subtract mean and rescale inputs
 
         """
+        #worker processes and shared units hold copies of the members' data
+        self.close()
+        self._units = None
         for n in range(self.N):
             xn = x[n]
             yn = y[n]
@@ -99,7 +302,7 @@ class GroupGP(GP):
             data.append(self.GPs[n].getData())
         return data
             
-    def predict(self,*args,**kwargs):
+    def predict(self,hyperparams,xstar,output=0,var=True,**kwargs):
         '''
         Predict mean and variance for each GP and given Parameters.
         
@@ -122,11 +325,28 @@ class GroupGP(GP):
             
         See :py:class:`pygp.gp.basic_gp.GP` for individual prediction outputs.
         '''
+        #shared units predict all columns at once, split up below
+        calls = []
+        for gp,members in self._get_units():
+            unit_output = output if len(members) == 1 else None
+            calls.append(('predict',(hyperparams,xstar),dict(kwargs,output=unit_output,var=var)))
         means = []
-        var = []
-        for n in range(self.N):
-            prediction = self.GPs[n].predict(*args,**kwargs)
-            means.append(prediction[0])
-            var.append(prediction[1])
-            
-        return SP.array([means,var])
+        variances = []
+        for (gp,members),prediction in zip(self._get_units(),self._map_units(calls)):
+            if not var:
+                prediction = [prediction,None]
+            if len(members) == 1:
+                means.append(prediction[0])
+                variances.append(prediction[1])
+                continue
+            start = 0
+            for n in members:
+                columns = SP.arange(start,start+self.GPs[n].y.shape[1])
+                start += len(columns)
+                if output is not None:
+                    columns = columns[output]
+                means.append(prediction[0][:,columns])
+                variances.append(prediction[1])
+        if var:
+            return SP.array([means,variances])
+        return SP.array(means)
@@ -0,0 +1,117 @@
+"""
+Frozen GP posterior
+===================
+
+Compact, immutable posterior of a GP at fixed hyperparameters
+(see :py:meth:`pygp.gp.GP.freeze`) for low-latency prediction.
+Prediction only involves the stored arrays, the frozen covariance
+function (:py:class:`pygp.covar.FrozenCF`) and a triangular solve.
+
+Frozen posteriors are picklable; :py:meth:`FrozenGP.save` and
+:py:func:`load` store the arrays as .npy files, which can be memory
+mapped and thereby shared between worker processes.
+"""
+
+import os
+import cPickle
+import scipy as SP
+import scipy.linalg as linalg
+
+
+class FrozenGP(object):
+    """
+    Posterior of a GP with fixed hyperparameters.
+
+    **Parameters:**
+
+    covar : :py:class:`pygp.covar.FrozenCF`
+        frozen covariance function
+
+    x : [N x D]
+        training inputs, transformed by covar.prepare
+
+    alpha : [N x d]
+        K^{-1} y
+
+    L : [N x N]
+        lower Cholesky factor of K (including noise)
+
+    likelihood, lik_theta :
+        likelihood model and its parameters, used for the predictive variance
+    """
+    __slots__ = ["covar", "x", "alpha", "L", "likelihood", "lik_theta"]
+    #all (also inherited) attributes and the arrays among them
+    _fields = __slots__
+    _arrays = ["x", "alpha", "L"]
+
+    def __init__(self, covar, x, alpha, L, likelihood=None, lik_theta=None):
+        self.covar = covar
+        self.x = x
+        self.alpha = alpha
+        self.L = L
+        self.likelihood = likelihood
+        self.lik_theta = lik_theta
+        for name in self._arrays:
+            getattr(self, name).flags.writeable = False
+
+    def __getstate__(self):
+        return dict([(name, getattr(self, name)) for name in self._fields])
+
+    def __setstate__(self, state):
+        for name in self._fields:
+            setattr(self, name, state[name])
+
+    def predict(self, xstar, output=0, var=True):
+        """
+        Predict mean and variance at the inputs xstar.
+
+        **Parameters:**
+
+        See :py:meth:`pygp.gp.GP.predict`
+        """
+        Kstar = self.covar.K(self.x, xstar)
+        if output is None:
+            mu = SP.dot(Kstar.T, self.alpha)
+        else:
+            mu = SP.dot(Kstar.T, self.alpha[:, output])
+        if not var:
+            return mu
+        Kss_diag = self.covar.Kdiag(xstar)
+        if self.likelihood is not None:
+            Kss_diag = Kss_diag + self.likelihood.Kdiag(self.lik_theta, xstar)
+        v = linalg.solve_triangular(self.L, Kstar, lower=True, overwrite_b=True)
+        S2 = abs(Kss_diag - (v * v).sum(0))
+        return [mu, S2]
+
+    def save(self, dirname):
+        """
+        Save to directory dirname: the arrays as .npy files
+        and the remaining attributes as a pickle
+        """
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        for name in self._arrays:
+            SP.save(os.path.join(dirname, name + '.npy'), getattr(self, name))
+        state = self.__getstate__()
+        for name in self._arrays:
+            state[name] = None
+        state['__class__'] = self.__class__
+        f = open(os.path.join(dirname, 'frozen.pickle'), 'wb')
+        cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL)
+        f.close()
+
+
+def load(dirname, mmap_mode='r'):
+    """
+    Load a :py:class:`FrozenGP` (or subclass) written by :py:meth:`FrozenGP.save`;
+    by default the arrays are memory mapped read-only (mmap_mode as in scipy.load).
+    """
+    f = open(os.path.join(dirname, 'frozen.pickle'), 'rb')
+    state = cPickle.load(f)
+    f.close()
+    cls = state.pop('__class__', FrozenGP)
+    for name in cls._arrays:
+        state[name] = SP.load(os.path.join(dirname, name + '.npy'), mmap_mode=mmap_mode)
+    RV = cls.__new__(cls)
+    RV.__setstate__(state)
+    return RV
@@ -15,12 +15,106 @@ Holds all Gaussian Process classes, which hold all informations for a Gaussian P
 
 import copy
 import pdb
+import hashlib
+import functools
+from collections import OrderedDict
 import scipy.linalg as linalg
+import scipy.optimize as OPT
 import scipy as SP
 import logging as LG
 from pygp.linalg import *
+from pygp.gp.frozen import FrozenGP
+from pygp.gp.active_set import greedy_variance_selection
+from pygp.covar.combinators import SumCF
+from pygp.covar.noise import NoiseCFISO
+from pygp.likelihood import GaussLikISO
 import scipy.lib.lapack.flapack
 
+
+def _evaluation(method):
+    """
+    Decorator of the public evaluations of a GP: when the outermost
+    evaluation returns, the kernels memoized by the covariance function
+    are dropped (see :py:meth:`pygp.covar.CovarianceFunction.clear_memo`),
+    so that they are shared within one evaluation (e.g. the likelihood
+    and its gradient) but not kept alive afterwards.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kw_args):
+        self._evaluation_depth += 1
+        try:
+            return method(self, *args, **kw_args)
+        finally:
+            self._evaluation_depth -= 1
+            if self._evaluation_depth == 0 and self.covar is not None:
+                self.covar.clear_memo()
+    return wrapper
+
+
+class FactorizationCache(object):
+    """
+    Bounded least recently used cache for the covariance structures
+    (Cholesky factors, alpha, ...) computed by
+    :py:meth:`GP.get_covariances`.
+
+    **Parameters:**
+
+    max_entries : int
+        maximum number of cached structures
+
+    max_bytes : int
+        maximum total size of all arrays in the cache (None: unbounded).
+        The most recently used entry is always kept.
+
+    The counters *hits* and *misses* record the cache lookups.
+    """
+    __slots__ = ["max_entries", "max_bytes", "hits", "misses", "_entries"]
+
+    def __init__(self, max_entries=4, max_bytes=2**30):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """return the entry for key (or None) and mark it as most recently used"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries[key] = entry
+        return entry
+
+    def put(self, key, entry):
+        """insert entry and evict least recently used entries exceeding the capacity"""
+        self._entries.pop(key, None)
+        self._entries[key] = entry
+        self._evict()
+
+    def clear(self):
+        self._entries.clear()
+
+    def nbytes(self):
+        """total size of the arrays held by the cache"""
+        return sum([self._entry_nbytes(entry) for entry in self._entries.values()])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _entry_nbytes(self, entry):
+        return sum([v.nbytes for v in entry.values() if isinstance(v, SP.ndarray)])
+
+    def _evict(self):
+        while len(self._entries) > 1:
+            too_many = len(self._entries) > self.max_entries
+            too_large = (self.max_bytes is not None) and (self.nbytes() > self.max_bytes)
+            if not (too_many or too_large):
+                break
+            #drop least recently used entry
+            self._entries.popitem(last=False)
+
 class GP(object):
     """
     Gaussian Process regression class. Holds all information
@@ -68,7 +162,8 @@ class GP(object):
     # Subtract mean of Data
     # TODO: added d
     __slots__ = ["x", "y", "n", "d", "covar", "likelihood", \
-                 "_covar_cache", '_active_set_indices', '_active_set_indices_changed']
+                 "_covar_cache", '_active_set_indices', '_active_set_indices_changed',
+                 '_factorization_cache', '_data_version', '_evaluation_depth']
     
     def __init__(self, covar_func=None, likelihood=None, x=None, y=None):
         '''GP(covar_func,likleihood,Smean=True,x=None,y=None)
@@ -116,11 +211,125 @@ class GP(object):
         self._invalidate_cache()
         pass
 
+    def append_data(self, x, y):
+        """
+        append_data(x,y): add observations to the current data set.
+
+        The most recent covariance structure (see :py:meth:`get_covariances`)
+        is extended by a block Cholesky update at cost O(N^2 k) for k new
+        points. Evaluations at other hyperparameters refactorize in full.
+
+        **Parameters:**
+
+        x : inputs: [k x D]
+
+        y : targets/outputs [k x d]
+        """
+        y = y.reshape(-1, self.d)
+        assert x.shape[0] == y.shape[0], 'input/target shape missmatch'
+        KV = self._covar_cache
+        if self._active_set_indices is not None:
+            KV = None
+        n_old = self.n
+        x_old = self.x
+        self.x = SP.concatenate((self.x, x), axis=0)
+        self.y = SP.concatenate((self.y, y), axis=0)
+        self.n = len(self.x)
+        #drop all cached structures, they refer to the old data
+        self._invalidate_cache()
+        if KV is None or 'x' in KV['hyperparams']:
+            return
+        try:
+            KV = self._append_covariances(KV, x_old, x)
+        except linalg.LinAlgError:
+            LG.debug("block Cholesky update failed, refactorizing on demand")
+            return
+        self._covar_cache = KV
+        self._factorization_cache.put(self._cache_key(KV['hyperparams']), KV)
+        pass
+
+    def _append_covariances(self, KV, x_old, x_new):
+        """
+        extend the covariance structure KV of the inputs x_old by the inputs x_new::
+
+            L = [L11   0 ]     L21 = (L11^{-1} K12)'
+                [L21 L22]     L22 = chol(K22 - L21 L21')
+        """
+        hyperparams = KV['hyperparams']
+        #1. covariance blocks (the likelihood noise is diagonal)
+        K12 = self.covar.K(hyperparams['covar'], x_old, x_new)
+        K22 = self.covar.K(hyperparams['covar'], x_new)
+        if self.likelihood is not None:
+            self.likelihood.K_structured(hyperparams['lik'], x_new).add_to(K22)
+        #2. block Cholesky update, including the jitter of the original factorization
+        L11 = KV['L']
+        L21 = linalg.solve_triangular(L11, K12, lower=True).T
+        S = K22 - SP.dot(L21, L21.T)
+        if KV['jitter']:
+            S += KV['jitter'] * SP.eye(S.shape[0])
+        L22 = linalg.cholesky(S, lower=True)
+        n1 = L11.shape[0]
+        n = n1 + L22.shape[0]
+        L = SP.zeros([n, n])
+        L[:n1, :n1] = L11
+        L[n1:, :n1] = L21
+        L[n1:, n1:] = L22
+        K = SP.empty([n, n])
+        K[:n1, :n1] = KV['K']
+        K[:n1, n1:] = K12
+        K[n1:, :n1] = K12.T
+        K[n1:, n1:] = K22
+        #3. alpha against the extended factor; Kinv is rebuilt lazily
+        alpha = solve_chol(L, self._get_y(hyperparams))
+        return {'K': K, 'L': L, 'alpha': alpha, 'jitter': KV['jitter'],
+                'hyperparams': KV['hyperparams']}
+
     def set_active_set_indices(self, active_set_indices):
         self._active_set_indices_changed = True
         self._active_set_indices = active_set_indices
+
+    def select_active_set(self, hyperparams, max_size=None, tol=0.):
+        """
+        Greedily select and set an active set of at most max_size training
+        points (see :py:func:`pygp.gp.active_set.greedy_variance_selection`),
+        stopping early once the largest posterior variance is below tol.
+        Returns the selected indices.
+
+        **Parameters:**
+
+        hyperparams : {'covar':logtheta, ...}
+            hyperparameters used for the selection
+        """
+        noise = None
+        if self.likelihood is not None:
+            noise = self.likelihood.Kdiag(hyperparams['lik'], self.x)
+        indices = greedy_variance_selection(self.covar, hyperparams['covar'], self.x,
+                                            noise=noise, max_size=max_size, tol=tol)
+        self.set_active_set_indices(indices)
+        return indices
+
+    def set_cache_capacity(self, max_entries=None, max_bytes=None):
+        """
+        Set the capacity of the cache of covariance structures
+        (see :py:class:`FactorizationCache`); None leaves a setting unchanged.
+        """
+        if max_entries is not None:
+            self._factorization_cache.max_entries = max_entries
+        if max_bytes is not None:
+            self._factorization_cache.max_bytes = max_bytes
+        self._factorization_cache._evict()
+
+    def get_cache_info(self):
+        """
+        Return statistics of the cache of covariance structures:
+        {'hits','misses','entries','bytes'}
+        """
+        cache = self._factorization_cache
+        return {'hits': cache.hits, 'misses': cache.misses,
+                'entries': len(cache), 'bytes': cache.nbytes()}
     
 
+    @_evaluation
     def LML(self, hyperparams, priors=None):
         """
         Calculate the log Marginal likelihood
@@ -157,6 +366,7 @@ class GP(object):
         return LML
         
 
+    @_evaluation
     def LMLgrad(self, hyperparams, priors=None, **kw_args):
         """
         Returns the log Marginal likelihood for the given logtheta.
@@ -184,6 +394,242 @@ class GP(object):
                 RV[key] -= plml[key][:, 1]                       
         return RV
 
+    @_evaluation
+    def LML_and_grad(self, hyperparams, priors=None, **kw_args):
+        """
+        Returns the log Marginal likelihood and its gradient for the
+        given hyperparameters, sharing one covariance factorization::
+
+            [LML, LMLgrad] = LML_and_grad(hyperparams)
+
+        **Parameters:**
+
+        hyperparams : {'covar':CF_hyperparameters, ...}
+            The hyperparameters which shall be optimized and derived
+
+        priors : [:py:class:`pygp.priors`]
+            the prior beliefs for the hyperparameter values
+        """
+        #LML factorizes, the gradient is served from the factorization cache
+        LML = self.LML(hyperparams, priors=priors)
+        LMLgrad = self.LMLgrad(hyperparams, priors=priors, **kw_args)
+        return [LML, LMLgrad]
+
+    @_evaluation
+    def loo_predict(self, hyperparams):
+        """
+        Leave-one-out predictive means and variances of all training
+        points in closed form (Rasmussen & Williams, 2006, eq. 5.12)::
+
+            mu_i = y_i - alpha_i/[Kinv]_ii,  S2_i = 1/[Kinv]_ii
+
+        Returns [mu, S2] with mu [N x d] and S2 [N].
+
+        **Parameters:**
+
+        hyperparams : {'covar':logtheta, ...}
+            hyperparameters in logSpace
+        """
+        KV = self.get_covariances(hyperparams)
+        Kinv_diag = self._get_Kinv(KV).diagonal()
+        mu = self._get_y(hyperparams) - KV['alpha'] / Kinv_diag[:, SP.newaxis]
+        S2 = 1. / Kinv_diag
+        return [mu, S2]
+
+    @_evaluation
+    def LOO_CV(self, hyperparams, priors=None, **kw_args):
+        """
+        Negative leave-one-out log predictive probability of the training
+        data (Rasmussen & Williams, 2006, eq. 5.11), an alternative
+        objective to :py:meth:`LML` for model selection.
+
+        **Parameters:**
+
+        hyperparams : {'covar':CF_hyperparameters, ... }
+            The hyperparameters for the objective.
+
+        priors : [:py:class:`pygp.priors`]
+            the prior beliefs for the hyperparameter values
+        """
+        try:
+            mu, S2 = self.loo_predict(hyperparams)
+        except linalg.LinAlgError:
+            LG.error("exception caught (%s)" % (str(hyperparams)))
+            return 1E6
+        r = self._get_y(hyperparams) - mu
+        RV = 0.5 * (SP.log(S2)[:, SP.newaxis] + r ** 2 / S2[:, SP.newaxis] + SP.log(2 * SP.pi)).sum()
+        if priors is not None:
+            plml = self._LML_prior(hyperparams, priors=priors)
+            RV -= SP.array([p[:, 0].sum() for p in plml.values()]).sum()
+        return RV
+
+    @_evaluation
+    def LOO_CVgrad(self, hyperparams, priors=None, **kw_args):
+        """
+        Gradient of :py:meth:`LOO_CV` (Rasmussen & Williams, 2006, eq. 5.13).
+        With Z_j = Kinv dK_j, all derivatives are contractions of dK_j with::
+
+            W = Kinv c alpha' - 0.5 Kinv diag(e) Kinv
+            c = alpha/[Kinv]_ii,  e = (1 + alpha^2/[Kinv]_ii)/[Kinv]_ii
+
+        (summed over outputs), so the cost is O(N^3) for all hyperparameters.
+
+        **Parameters:**
+
+        See :py:meth:`LOO_CV`
+        """
+        KV = self.get_covariances(hyperparams)
+        Kinv = self._get_Kinv(KV)
+        Kinv_diag = Kinv.diagonal()
+        alpha = KV['alpha']
+        c = alpha / Kinv_diag[:, SP.newaxis]
+        e = ((1 + alpha * c) / Kinv_diag[:, SP.newaxis]).sum(1)
+        W = SP.dot(SP.dot(Kinv, c), alpha.T)
+        W = 0.5 * (W + W.T)
+        W -= 0.5 * SP.dot(Kinv * e, Kinv)
+        #LOO_CV is the negative LOO log probability
+        W *= -1
+        RV = {'covar': self.covar.contract_grad_theta(hyperparams['covar'], self._get_x(), W)}
+        if self.likelihood is not None:
+            logtheta = hyperparams['lik']
+            RV['lik'] = SP.array([self.likelihood.Kgrad_theta_structured(logtheta, self._get_x(), i).contract(W)
+                                  for i in xrange(len(logtheta))])
+        if priors is not None:
+            plml = self._LML_prior(hyperparams, priors=priors, **kw_args)
+            for key in RV.keys():
+                RV[key] -= plml[key][:, 1]
+        return RV
+
+    @_evaluation
+    def LOO_CV_and_grad(self, hyperparams, priors=None, **kw_args):
+        """
+        Returns :py:meth:`LOO_CV` and :py:meth:`LOO_CVgrad`, sharing one factorization.
+        """
+        return [self.LOO_CV(hyperparams, priors=priors, **kw_args),
+                self.LOO_CVgrad(hyperparams, priors=priors, **kw_args)]
+
+    @_evaluation
+    def noise_sweep(self, hyperparams, noise_values):
+        """
+        Negative log marginal likelihood and its derivative with respect
+        to the isotropic noise parameter for a range of noise values,
+        at O(N d) per value. The eigendecomposition of the signal
+        covariance (all hyperparameters but the noise) is computed once
+        and cached (see :py:meth:`get_eigen_covariances`).
+
+        The swept parameter is hyperparams['lik'][0] of a
+        :py:class:`pygp.likelihood.GaussLikISO` likelihood or, without
+        one, the parameter of a :py:class:`pygp.covar.noise.NoiseCFISO`
+        term in a :py:class:`pygp.covar.combinators.SumCF`; a second
+        isotropic noise term is kept fixed, and the covariance of any
+        other likelihood is part of the fixed signal covariance.
+
+        **Parameters:**
+
+        hyperparams : {'covar':logtheta, ...}
+            hyperparameters in logSpace
+
+        noise_values : [double]
+            values of the noise parameter (log standard deviation)
+
+        **Returns:**
+
+        [LML, LMLgrad] : arrays over noise_values
+        """
+        KV = self.get_eigen_covariances(hyperparams)
+        key, index = self._get_noise_parameter()
+        noise_values = SP.array(noise_values, dtype='float').reshape(-1)
+        #noise of the remaining isotropic noise term
+        hp = copy.deepcopy(hyperparams)
+        hp[key][index] = -SP.inf
+        sigma0 = self._get_noise_variance(hp)
+        d = self._get_target_dimension()
+        n = self._get_input_dimension()
+        y_rot2 = (KV['y_rot'] ** 2).sum(1)
+        LML = SP.empty(len(noise_values))
+        LMLgrad = SP.empty(len(noise_values))
+        for i in xrange(len(noise_values)):
+            sigma = SP.exp(2 * noise_values[i])
+            Sn = KV['S'] + sigma0 + sigma
+            LML[i] = 0.5 * (y_rot2 / Sn).sum() + 0.5 * d * SP.log(Sn).sum() + 0.5 * n * d * SP.log(2 * SP.pi)
+            #chain rule: dSn/dtheta = 2*sigma
+            LMLgrad[i] = sigma * (d / Sn - y_rot2 / Sn ** 2).sum()
+        return [LML, LMLgrad]
+
+    def optimize_noise(self, hyperparams, bounds=(-10, 5), xtol=1E-5):
+        """
+        Optimize the isotropic noise parameter (see :py:meth:`noise_sweep`)
+        within bounds, keeping all other hyperparameters fixed.
+        Returns [hyperparams, LML] at the optimum.
+        """
+        key, index = self._get_noise_parameter()
+        f = lambda v: self.noise_sweep(hyperparams, [v])[0][0]
+        v = OPT.fminbound(f, bounds[0], bounds[1], xtol=xtol)
+        RV = copy.deepcopy(hyperparams)
+        RV[key][index] = v
+        return [RV, f(v)]
+
+    def get_eigen_covariances(self, hyperparams):
+        """
+        Return the eigendecomposition of the signal covariance, i.e.
+        the covariance without isotropic noise::
+
+            [S,U] = eigh(K_signal)
+            y_rot = U'y
+
+        The covariance of a likelihood other than
+        :py:class:`pygp.likelihood.GaussLikISO` is included in K_signal.
+        The structure is cached independently of the isotropic noise parameters.
+        """
+        hp = {'covar': self._get_signal_theta(hyperparams['covar'])}
+        if self.likelihood is not None and not isinstance(self.likelihood, GaussLikISO):
+            hp['lik'] = SP.array(hyperparams['lik'], dtype='float')
+        key = 'eigh' + self._cache_key(hp)
+        KV = self._factorization_cache.get(key)
+        if KV is None:
+            K = self.covar.K(hp['covar'], self._get_x())
+            if 'lik' in hp:
+                self.likelihood.K_structured(hp['lik'], self._get_x()).add_to(K)
+            S, U = linalg.eigh(K)
+            #clip round-off of the positive semidefinite signal covariance
+            S = SP.maximum(S, 0)
+            KV = {'S': S, 'U': U, 'y_rot': SP.dot(U.T, self._get_y(hyperparams)), 'hyperparams': hp}
+            self._factorization_cache.put(key, KV)
+        return KV
+
+    def _get_noise_parameter(self):
+        """return (key, index) of the isotropic noise parameter swept by :py:meth:`noise_sweep`"""
+        if isinstance(self.likelihood, GaussLikISO):
+            return ('lik', 0)
+        I = self._get_noise_covar_indices()
+        assert len(I) > 0, 'noise sweep requires a GaussLikISO likelihood or a NoiseCFISO term in a SumCF'
+        return ('covar', I[0])
+
+    def _get_noise_covar_indices(self):
+        """indices of the hyperparameters of NoiseCFISO terms in a top-level SumCF"""
+        if not isinstance(self.covar, SumCF):
+            return []
+        I = []
+        for nc in xrange(len(self.covar.covars)):
+            if isinstance(self.covar.covars[nc], NoiseCFISO):
+                I.extend(self.covar.covars_theta_I[nc])
+        return I
+
+    def _get_signal_theta(self, theta):
+        """covariance hyperparameters with all isotropic noise terms switched off"""
+        theta = SP.array(theta, dtype='float')
+        theta[self._get_noise_covar_indices()] = -SP.inf
+        return theta
+
+    def _get_noise_variance(self, hyperparams):
+        """total isotropic noise variance of likelihood and NoiseCFISO terms"""
+        sigma = 0
+        if isinstance(self.likelihood, GaussLikISO):
+            sigma += SP.exp(2 * hyperparams['lik'][0])
+        for i in self._get_noise_covar_indices():
+            sigma += SP.exp(2 * hyperparams['covar'][i])
+        return sigma
+
     def get_covariances(self, hyperparams):
         """
         Return the Cholesky decompositions L and alpha::
@@ -192,6 +638,9 @@ class GP(object):
             L     = chol(K)
             alpha = solve(L,t)
             return [covar_struct] = get_covariances(hyperparam)
+
+        The inverse covariance is not part of the structure;
+        use :py:meth:`_get_Kinv` if it is needed.
             
         **Parameters:**
         
@@ -203,36 +652,43 @@ class GP(object):
             If one/both is/are set, there will be no chaching allowed
             
         """
-        if self._is_cached(hyperparams) and not self._active_set_indices_changed:
-            pass
+        key = self._cache_key(hyperparams)
+        KV = self._factorization_cache.get(key)
+        if KV is not None:
+            self._covar_cache = KV
         else:
-            Knoise = 0
-            #1. use likelihood object to perform the inference
-            if self.likelihood is not None:
-                Knoise = self.likelihood.K(hyperparams['lik'], self._get_x())
-            K = self.covar.K(hyperparams['covar'], self._get_x())
-            K+= Knoise
-            L = jitChol(K)[0].T # lower triangular
-            alpha = solve_chol(L, self._get_y(hyperparams)) # TODO: not sure about this one
-
-	    # DPOTRI computes the inverse of a real symmetric positive definite
-	    # matrix A using the Cholesky factorization 
-	    Linv = scipy.lib.lapack.flapack.dpotri(L)[0]
-	    # Copy the matrix and kill the diagonal (we don't want to have 2*var)
-	    Kinv = Linv.copy()
-	    SP.fill_diagonal(Linv, 0)
-	    # build the full inverse covariance matrix. This is correct: verified
-	    # by doing SP.allclose(Kinv, linalg.inv(K))
-	    Kinv += Linv.T
-	    
-	    self._covar_cache = {'K': K, 'L':L, 'alpha':alpha, 'Kinv': Kinv}
-            #store hyperparameters for cachine
-            self._covar_cache['hyperparams'] = copy.deepcopy(hyperparams)
-            self._active_set_indices_changed = False
+            self._covar_cache = self._factorize(hyperparams)
+            self._factorization_cache.put(key, self._covar_cache)
+        self._active_set_indices_changed = False
         return self._covar_cache 
+
+    def _factorize(self, hyperparams, K=None):
+        """
+        covariance structure of :py:meth:`get_covariances` (without caching)
+
+        **Parameters:**
+
+        K : [N x N]
+            covariance of covar at the training inputs, if it is already
+            available; it is overwritten by the noisy covariance
+        """
+        if K is None:
+            K = self.covar.K(hyperparams['covar'], self._get_x())
+        #1. use likelihood object to perform the inference (noise is added in place)
+        if self.likelihood is not None:
+            self.likelihood.K_structured(hyperparams['lik'], self._get_x()).add_to(K)
+        L, jitter = jitChol(K)
+        L = L.T # lower triangular
+        alpha = solve_chol(L, self._get_y(hyperparams)) # TODO: not sure about this one
+        #the inverse Kinv is only built on demand (see _get_Kinv)
+        KV = {'K': K, 'L':L, 'alpha':alpha, 'jitter':jitter}
+        #store hyperparameters for cachine
+        KV['hyperparams'] = copy.deepcopy(hyperparams)
+        return KV
        
         
-    def predict(self, hyperparams, xstar, output=0, var=True):
+    @_evaluation
+    def predict(self, hyperparams, xstar, output=0, var=True, chunk_size=None, out=None):
         '''
         Predict mean and variance for given **Parameters:**
 
@@ -250,30 +706,109 @@ class GP(object):
             or scipy array-like of integer indices, denoting 
             which x indices to predict from data. 
         
-        output   : output dimension for prediction (0)
+        output   : output dimension for prediction (0);
+            a list of output dimensions or None (all outputs) returns
+            an [M x len(output)] mean from a single cross covariance
+            and solve; the variance is shared by all outputs
+
+        chunk_size : int
+            number of test points processed at once (default: all);
+            bounds the memory of the cross covariance to N x chunk_size
+
+        out : [mu, S2]
+            preallocated arrays (e.g. memory maps) receiving the
+            predictions; S2 is only needed if var is True
         '''
         # TODO: removes this or figure out how to do it right.
         # This is currenlty not compatible with the structure:
         # Get interval_indices right
         # interval_indices are meant to not must set data new, 
         # if predicting on an subset of data only.
+        M = xstar.shape[0]
+        if out is None:
+            if output is None:
+                mu_shape = (M, self._get_target_dimension())
+            elif SP.isscalar(output):
+                mu_shape = (M,)
+            else:
+                mu_shape = (M, len(output))
+            out = [SP.empty(mu_shape), SP.empty(M) if var else None]
+        mu, S2 = out[0], out[1] if var else None
+        for rows, block in self.predict_iter(hyperparams, xstar, output=output, var=var, chunk_size=chunk_size, indices=True):
+            if(var):
+                mu[rows], S2[rows] = block
+            else:
+                mu[rows] = block
+        if(var):
+            return [mu, S2]
+        else:
+            return mu
+
+    def predict_iter(self, hyperparams, xstar, output=0, var=True, chunk_size=1000, indices=False):
+        '''
+        Generator version of :py:meth:`predict`, processing xstar in
+        blocks of chunk_size points and yielding [mu, S2] (or mu) per block.
+
+        **Parameters:**
+
+        See :py:meth:`predict`
+
+        indices : boolean
+            yield (slice of xstar, prediction) pairs
+        '''
         KV = self.get_covariances(hyperparams)
-            
-        #cross covariance:
-        Kstar = self.covar.K(hyperparams['covar'], self._get_x(), xstar)
-        mu = SP.dot(Kstar.transpose(), KV['alpha'][:, output])
+        M = xstar.shape[0]
+        if chunk_size is None:
+            chunk_size = max(M, 1)
+        for i0 in xrange(0, M, chunk_size):
+            rows = slice(i0, min(i0 + chunk_size, M))
+            block = self._predict_block(hyperparams, KV, xstar[rows], output, var)
+            if indices:
+                yield rows, block
+            else:
+                yield block
+
+    def _predict_block(self, hyperparams, KV, xstar, output, var):
+        """predictions for the test inputs xstar given the covariance structure KV"""
+        #cross covariance (tiled to bound the size of intermediates):
+        Kstar = self.covar.K_tiled(hyperparams['covar'], self._get_x(), xstar)
+        if output is None:
+            alpha = KV['alpha']
+        else:
+            alpha = KV['alpha'][:, output]
+        mu = SP.dot(Kstar.transpose(), alpha)
         if(var):
             Kss_diag = self.covar.Kdiag(hyperparams['covar'], xstar)
             if self.likelihood is not None:
-                Kss_diag += self.likelihood.Kdiag(hyperparams['lik'],xstar)
-            v = linalg.solve(KV['L'], Kstar)
-            S2 = Kss_diag - sum(v * v, 0).transpose()
+                Kss_diag = Kss_diag + self.likelihood.Kdiag(hyperparams['lik'],xstar)
+            v = linalg.solve_triangular(KV['L'], Kstar, lower=True, overwrite_b=True)
+            S2 = Kss_diag - (v * v).sum(0)
             S2 = abs(S2)
             return [mu, S2]
         else:
             return mu
 
 
+    def freeze(self, hyperparams):
+        """
+        Return the posterior at the given hyperparameters as an
+        immutable :py:class:`pygp.gp.frozen.FrozenGP` for fast prediction.
+
+        **Parameters:**
+
+        hyperparams : {'covar':logtheta, ...}
+            hyperparameters in logSpace
+        """
+        KV = self.get_covariances(hyperparams)
+        covar = self.covar.freeze(hyperparams['covar'])
+        x = SP.array(covar.prepare(self._get_x()))
+        lik_theta = None
+        if self.likelihood is not None:
+            lik_theta = SP.array(hyperparams['lik'])
+        return FrozenGP(covar, x, KV['alpha'].copy(), KV['L'].copy(),
+                        likelihood=self.likelihood, lik_theta=lik_theta)
+
+
     ########PRIVATE FUNCTIONS########
 
 
@@ -308,14 +843,13 @@ class GP(object):
         L = KV['L']
 
         alpha = KV['alpha']
-        W = self._get_target_dimension() * KV['Kinv'] - SP.dot(alpha, alpha.transpose())
+        d = self._get_target_dimension()
+        W = d * self._get_Kinv(KV)
+        W -= SP.dot(alpha, alpha.transpose())
         self._covar_cache['W'] = W
 
 
-        LMLgrad = SP.zeros(len(logtheta))
-        for i in xrange(len(logtheta)):
-            Kd = self.covar.Kgrad_theta(hyperparams['covar'], self._get_x(), i)
-            LMLgrad[i] = 0.5 * (W * Kd).sum()
+        LMLgrad = 0.5 * self.covar.contract_grad_theta(hyperparams['covar'], self._get_x(), W)
         RV = {'covar': LMLgrad}
         return RV
 
@@ -330,19 +864,54 @@ class GP(object):
 
         LMLgrad = SP.zeros(len(logtheta))
         for i in xrange(len(logtheta)):
-            Kd = self.likelihood.Kgrad_theta(logtheta, self._get_x(), i)
-            LMLgrad[i] = 0.5 * (W * Kd).sum()
+            Kd = self.likelihood.Kgrad_theta_structured(logtheta, self._get_x(), i)
+            LMLgrad[i] = 0.5 * Kd.contract(W)
         RV = {'lik': LMLgrad}
         return RV
 
                    
+    def _get_Kinv(self, KV):
+        """
+        Return the inverse covariance of the covariance structure KV,
+        computed from the Cholesky factor on first use and stored in KV.
+        """
+        if KV.get('Kinv') is None:
+            # DPOTRI computes the inverse of a real symmetric positive definite
+            # matrix A using the (lower) Cholesky factorization; only the
+            # lower triangle is filled
+            Kinv = scipy.lib.lapack.flapack.dpotri(KV['L'], lower=1)[0]
+            # mirror the strictly lower triangle to obtain the full inverse
+            Kinv += SP.tril(Kinv, -1).T
+            KV['Kinv'] = Kinv
+        return KV['Kinv']
+
     def _invalidate_cache(self):
         """reset cache structure"""
         self._active_set_indices = None
         self._active_set_indices_changed = False
         self._covar_cache = None
+        if hasattr(self, '_factorization_cache'):
+            self._factorization_cache.clear()
+            self._data_version += 1
+        else:
+            self._factorization_cache = FactorizationCache()
+            self._data_version = 0
+            self._evaluation_depth = 0
         pass
 
+    def _cache_key(self, hyperparams):
+        """hash of the hyperparameters, data version and active set, identifying cached covariances"""
+        h = hashlib.sha1()
+        for key in sorted(hyperparams.keys()):
+            value = SP.asarray(hyperparams[key])
+            h.update(key)
+            h.update(str(value.shape))
+            h.update(value.tostring())
+        h.update(str(self._data_version))
+        if self._active_set_indices is not None:
+            h.update(SP.asarray(self._active_set_indices).tostring())
+        return h.hexdigest()
+
     def _LML_prior(self, hyperparams, priors={}):
         """calculate the prior contribution to the log marginal likelihood"""
         if priors is None:
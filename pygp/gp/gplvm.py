@@ -5,6 +5,7 @@ This is really not ready for release yet but is used by the gpasso model
 import sys
 sys.path.append('./../..')
 from pygp.gp import GP
+from pygp.gp.gp_base import _evaluation
 import pdb
 from pygp.optimize.optimize_base import opt_hyper
 import scipy as SP
@@ -55,6 +56,7 @@ class GPLVM(GP):
             self.x[:, self.gplvm_dimensions] = hyperparams['x']
 
   
+    @_evaluation
     def LML(self, hyperparams, priors=None, **kw_args):
         """
         Calculate the log Marginal likelihood
@@ -95,6 +97,7 @@ class GPLVM(GP):
         return LML
         
 
+    @_evaluation
     def LMLgrad(self, hyperparams, priors=None, **kw_args):
 #        pdb.set_trace()
         """
@@ -104,20 +104,15 @@ class GPLVMARD(GPLVM.GPLVM):
             LG.error("exception caught (%s)" % (str(hyperparams)))
             return 1E6
 
-        LMLgrad = SP.zeros(len(logtheta))
-        for i in xrange(len(logtheta)):
-            #1. derivative of the log det term
-            Kd = self.covar.Kgrad_theta(hyperparams['covar'], self._get_x(), i)
-            #rotate Kd with U, U.T
-            Kd_rot = SP.dot(SP.dot(KV['U'].T,Kd),KV['U'])
-            #now loop over the various different noise levels which is efficient at this point
-            dldet = 0.5*(Kd_rot.diagonal()[:,SP.newaxis]*KV['Si']).sum()            
-            #2. deriative of the quadratic term
-            y_roti = KV['y_roti']
-            DKy_roti = SP.dot(Kd_rot,KV['y_roti'])
-            dlquad  = -0.5*(y_roti*DKy_roti).sum()
-
-            if VERBOSE:
+        #the gradient is the contraction of the kernel derivatives with
+        #W = U*diag(sum_d Si)*U' - (U*y_roti)*(U*y_roti)'
+        #(derivative of the log det and the quadratic term for all dimensions)
+        UYi = SP.dot(KV['U'],KV['y_roti'])
+        W = SP.dot(KV['U']*KV['Si'].sum(axis=1),KV['U'].T) - SP.dot(UYi,UYi.T)
+        LMLgrad = 0.5*self.covar.contract_grad_theta(hyperparams['covar'], self._get_x(), W)
+
+        if VERBOSE:
+            for i,Kd in enumerate(self.covar.Kgrad_theta_all(hyperparams['covar'], self._get_x())):
                 dldet_ = SP.zeros([self.d])
                 dlquad_ = SP.zeros([self.d])
                 for d in xrange(self.d):
@@ -126,13 +121,7 @@ class GPLVMARD(GPLVM.GPLVM):
                     dldet_[d] = 0.5*SP.dot(_Ki,Kd).trace()
                     dKq = SP.dot(SP.dot(_Ki,Kd),_Ki)
                     dlquad_[d] = -0.5*SP.dot(SP.dot(self.y[:,d],dKq),self.y[:,d])
-
-                    
-                assert SP.absolute(dldet-dldet_.sum())<1E-3, 'outch'
-                assert SP.absolute(dlquad-dlquad_.sum())<1E-3, 'outch'
-
-            #set results
-            LMLgrad[i] = dldet + dlquad
+                assert SP.absolute(LMLgrad[i]-dldet_.sum()-dlquad_.sum())<1E-3, 'outch'
         RV = {'covar': LMLgrad}
         return RV
 
@@ -0,0 +1,174 @@
+"""
+Matrix-free GP regression
+=========================
+
+GP regression for large N without Cholesky factorization. The covariance
+matrix is only accessed through block-wise matrix-vector products
+(:py:meth:`pygp.covar.CovarianceFunction.K_dot`):
+
+* K^{-1}y by Jacobi preconditioned conjugate gradients
+* log|K| by stochastic Lanczos quadrature from the same CG run
+* tr(K^{-1} dK) by Hutchinson estimates with the same probe vectors
+
+Time is O(N^2) per CG iteration and extra memory O(N) (times the number
+of outputs and probes). Log marginal likelihood and gradients are
+stochastic estimates; the probe vectors are drawn once per data set so
+that the objective is a deterministic function of the hyperparameters.
+"""
+
+from pygp.gp import GP
+from pygp.linalg import cg, slq_logdet, rademacher
+import scipy as SP
+import logging as LG
+
+
+class IterativeGP(GP):
+    """
+    GP regression with a matrix-free iterative inference engine.
+
+    **Parameters:**
+
+    n_probes : int
+        number of random probe vectors for log-determinant and trace estimates
+
+    tol : double
+        relative residual tolerance of conjugate gradients
+
+    maxiter : int
+        maximum number of CG iterations
+
+    max_memory : int
+        memory budget of a single kernel block (see :py:func:`pygp.covar.tile_slices`)
+
+    seed : int
+        random seed of the probe vectors
+
+    See :py:class:`pygp.gp.GP` for the remaining parameters.
+    """
+    __slots__ = ["n_probes", "tol", "maxiter", "max_memory", "seed", "_probes"]
+
+    def __init__(self, n_probes=16, tol=1E-6, maxiter=1000, max_memory=None, seed=0, **kw_args):
+        self.n_probes = n_probes
+        self.tol = tol
+        self.maxiter = maxiter
+        self.max_memory = max_memory
+        self.seed = seed
+        self._probes = None
+        super(IterativeGP, self).__init__(**kw_args)
+
+    def _invalidate_cache(self):
+        GP._invalidate_cache(self)
+        self._probes = None
+
+    def _get_probes(self):
+        n = self._get_input_dimension()
+        if self._probes is None or self._probes.shape[0] != n:
+            self._probes = rademacher(n, self.n_probes, SP.random.RandomState(self.seed))
+        return self._probes
+
+    def _Kdiag(self, hyperparams, x):
+        D = self.covar.Kdiag(hyperparams['covar'], x)
+        if self.likelihood is not None:
+            D = D + self.likelihood.Kdiag(hyperparams['lik'], x)
+        return D
+
+    def _K_dot(self, hyperparams, x, V):
+        KV = self.covar.K_dot(hyperparams['covar'], x, V, max_memory=self.max_memory)
+        if self.likelihood is not None:
+            KV += self.likelihood.Kdiag(hyperparams['lik'], x)[:, SP.newaxis] * V
+        return KV
+
+    def _solve(self, hyperparams, B, lanczos=False):
+        """
+        Solve K X = B by CG on the Jacobi scaled matrix D^{-1/2} K D^{-1/2}.
+        Returns [X, Dsqrt(, coefficients)].
+        """
+        x = self._get_x()
+        Ds = SP.sqrt(self._Kdiag(hyperparams, x))[:, SP.newaxis]
+        matvec = lambda V: self._K_dot(hyperparams, x, V / Ds) / Ds
+        RV = cg(matvec, B / Ds, tol=self.tol, maxiter=self.maxiter, lanczos=lanczos)
+        if lanczos:
+            return [RV[0] / Ds, Ds, RV[1]]
+        return [RV / Ds, Ds]
+
+    def get_covariances(self, hyperparams):
+        """
+        Return the iterative covariance structure::
+
+            alpha  = K^{-1} y
+            U      = K^{-1} D^{1/2} Z    (Z: probe vectors)
+            Zs     = D^{-1/2} Z
+            logdet ~ log|K|
+
+        with D = diag(K), such that tr(K^{-1} dK) ~ mean_j Zs_j' dK U_j.
+
+        **Parameters:**
+
+        hyperparams: dict
+            The hyperparameters for the solves
+        """
+        key = self._cache_key(hyperparams)
+        KV = self._factorization_cache.get(key)
+        if KV is not None:
+            self._covar_cache = KV
+            return KV
+        y = self._get_y(hyperparams)
+        d = y.shape[1]
+        Z = self._get_probes()
+        #1. one CG run for the targets and the probes (CG on the scaled matrix sees Z itself)
+        Ds = SP.sqrt(self._Kdiag(hyperparams, self._get_x()))[:, SP.newaxis]
+        X, Ds, coefficients = self._solve(hyperparams, SP.concatenate((y, Z * Ds), axis=1), lanczos=True)
+        #2. log|K| = log|D^{-1/2} K D^{-1/2}| + log|D|
+        logdet = slq_logdet(coefficients[d:], (Z * Z).sum(0)) + 2 * SP.log(Ds).sum()
+        KV = {'alpha': X[:, :d], 'U': X[:, d:], 'Zs': Z / Ds, 'logdet': logdet}
+        KV['hyperparams'] = dict([(k, SP.array(v, copy=True)) for k, v in hyperparams.iteritems()])
+        self._covar_cache = KV
+        self._factorization_cache.put(key, KV)
+        return KV
+
+    def _LML_covar(self, hyperparams):
+        """negative log marginal likelihood estimate"""
+        KV = self.get_covariances(hyperparams)
+        lml_quad = 0.5 * (KV['alpha'] * self._get_y(hyperparams)).sum()
+        lml_det = 0.5 * self._get_target_dimension() * KV['logdet']
+        lml_const = 0.5 * self._get_target_dimension() * self._get_input_dimension() * SP.log(2 * SP.pi)
+        return lml_quad + lml_det + lml_const
+
+    def _gradW(self, KV):
+        """low rank factors [A,B] of W = d*K^{-1} - alpha alpha', with the trace part estimated by the probes"""
+        d = self._get_target_dimension()
+        p = KV['U'].shape[1]
+        A = SP.concatenate((KV['U'] * (float(d) / p), -KV['alpha']), axis=1)
+        B = SP.concatenate((KV['Zs'], KV['alpha']), axis=1)
+        return [A, B]
+
+    def _LMLgrad_covar(self, hyperparams):
+        KV = self.get_covariances(hyperparams)
+        A, B = self._gradW(KV)
+        LMLgrad = 0.5 * self.covar.contract_grad_theta_lowrank(hyperparams['covar'], self._get_x(), A, B, max_memory=self.max_memory)
+        return {'covar': LMLgrad}
+
+    def _LMLgrad_lik(self, hyperparams):
+        KV = self.get_covariances(hyperparams)
+        A, B = self._gradW(KV)
+        Wdiag = (A * B).sum(1)
+        logtheta = hyperparams['lik']
+        x = self._get_x()
+        LMLgrad = SP.array([0.5 * SP.dot(Wdiag, self.likelihood.Kgrad_theta_diag(logtheta, x, i))
+                            for i in xrange(len(logtheta))])
+        return {'lik': LMLgrad}
+
+    def _predict_block(self, hyperparams, KV, xstar, output, var):
+        """predictions for xstar; the variance requires one CG solve per test point"""
+        Kstar = self.covar.K(hyperparams['covar'], self._get_x(), xstar)
+        if output is None:
+            alpha = KV['alpha']
+        else:
+            alpha = KV['alpha'][:, output]
+        mu = SP.dot(Kstar.T, alpha)
+        if not var:
+            return mu
+        Kss_diag = self._Kdiag(hyperparams, xstar)
+        v = self._solve(hyperparams, Kstar)[0]
+        S2 = abs(Kss_diag - (v * Kstar).sum(0))
+        return [mu, S2]
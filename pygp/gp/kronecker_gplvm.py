@@ -331,18 +331,16 @@ class KroneckerGPLVM(GPLVM.GPLVM):
         RV = {}
 
         #row:
-        logtheta_r = hyperparams['covar_r']
-        LMLgrad_r = SP.zeros(len(logtheta_r))
-        for i in xrange(len(logtheta_r)):
-            #get derivative matrix with respect to hyperparam i:
-            Kd = self.covar_r.Kgrad_theta(hyperparams['covar_r'], self.x_r, i)           
-            #calc
-            grad_logdet= 0.5*self._gradLogDet(hyperparams,Kd,columns =False )
-            grad_quad = 0.5*self._gradQuadrForm(hyperparams,Kd,columns =False )
-            LMLgrad_r[i] = grad_logdet + grad_quad
-            
-            if VERBOSE:
-                print "expensive gradcheck"
+        #gradients are contractions of the kernel derivatives with W (see _gradW)
+        W_r = self._gradW(hyperparams,columns=False)
+        LMLgrad_r = 0.5*self.covar_r.contract_grad_theta(hyperparams['covar_r'], self.x_r, W_r)
+
+        if VERBOSE:
+            print "expensive gradcheck"
+            for i,Kd in enumerate(self.covar_r.Kgrad_theta_all(hyperparams['covar_r'], self.x_r)):
+                grad_logdet= 0.5*self._gradLogDet(hyperparams,Kd,columns =False )
+                grad_quad = 0.5*self._gradQuadrForm(hyperparams,Kd,columns =False )
+                check_dist(LMLgrad_r[i],grad_logdet+grad_quad)
                 #1. logdet term
                 dKl = SP.kron(Kd,KV['Kc'])
                 grad_logdet_ = 0.5 * SP.dot(Ki,dKl).trace()
@@ -355,27 +353,22 @@ class KroneckerGPLVM(GPLVM.GPLVM):
         RV['covar_r'] = LMLgrad_r
 
         #column:
-        logtheta_c = hyperparams['covar_c']
-        LMLgrad_c = SP.zeros(len(logtheta_c))
-        for i in xrange(len(logtheta_c)):
-            #get derivative matrix with respect to hyperparam i:
-            Kd = self.covar_c.Kgrad_theta(hyperparams['covar_c'], self.x_c, i)
-            #calc
-            grad_logdet= 0.5*self._gradLogDet(hyperparams,Kd,columns =True )
-            grad_quad = 0.5*self._gradQuadrForm(hyperparams,Kd,columns =True )
-            LMLgrad_c[i] = grad_logdet + grad_quad
+        W_c = self._gradW(hyperparams,columns=True)
+        LMLgrad_c = 0.5*self.covar_c.contract_grad_theta(hyperparams['covar_c'], self.x_c, W_c)
 
-            if VERBOSE:
-                print "expensive gradcheck"
+        if VERBOSE:
+            print "expensive gradcheck"
+            for i,Kd in enumerate(self.covar_c.Kgrad_theta_all(hyperparams['covar_c'], self.x_c)):
+                grad_logdet= 0.5*self._gradLogDet(hyperparams,Kd,columns =True )
+                grad_quad=0.5*self._gradQuadrForm(hyperparams,Kd,columns =True )
+                check_dist(LMLgrad_c[i],grad_logdet+grad_quad)
                 #1. logdet term
                 dKl = SP.kron(KV['Kr'],Kd)
                 grad_logdet_ = 0.5 * SP.dot(Ki,dKl).trace()
-                grad_logdet= 0.5*self._gradLogDet(hyperparams,Kd,columns =True )
                 check_dist(grad_logdet,grad_logdet_)
                 #2. quadratic part
                 dKq = SP.dot(SP.dot(Ki,dKl),Ki)
                 grad_quad_ = - 0.5* SP.dot(SP.dot(self.y.ravel(),dKq),self.y.ravel())
-                grad_quad=0.5*self._gradQuadrForm(hyperparams,Kd,columns =True )
                 check_dist(grad_quad,grad_quad_)
 
         RV['covar_c'] = LMLgrad_c
@@ -496,6 +489,26 @@ class KroneckerGPLVM(GPLVM.GPLVM):
 
 
     #### derivatives w.r.t. to kernel parameters #####
+    def _gradW(self, hyperparams, columns=False):
+        """weight matrix W such that (W*dK).sum() = gradLogDet + gradQuadrForm
+        for any derivative dK of the row (or column) covariance"""
+        KV = self.get_covariances(hyperparams)
+        Si = KV['Si']
+        Ytilde = (KV['YSi'])
+        if columns:
+            #logdet: diag(Uc'dKUc).(Sr Si)
+            W = SP.dot(KV['Uc']*SP.dot(KV['Sr'],Si),KV['Uc'].T)
+            #quadratic form: -(Uc Ytilde' Sr Ytilde Uc') . dK
+            B = SP.dot(Ytilde,KV['Uc'].T)
+            W -= SP.dot(B.T*KV['Sr'],B)
+        else:
+            #logdet: diag(Ur'dKUr).(Si Sc)
+            W = SP.dot(KV['Ur']*SP.dot(Si,KV['Sc']),KV['Ur'].T)
+            #quadratic form: -(Ur Ytilde Sc Ytilde' Ur') . dK
+            A = SP.dot(KV['Ur'],Ytilde)
+            W -= SP.dot(A*KV['Sc'],A.T)
+        return W
+
     def _gradLogDet(self, hyperparams,dK,columns =False ):
         """gradient of logdet w.r.t. kernel derivative matrix (dK)"""
         KV = self.get_covariances(hyperparams)
@@ -0,0 +1,87 @@
+"""
+Sliding window GP for streaming data
+====================================
+
+Regression on the most recent observations of an unbounded stream.
+New observations extend the cached Cholesky factor
+(:py:meth:`pygp.gp.GP.append_data`), the oldest observations are removed
+by a rank-k update of the trailing block of the factor. Each step costs
+O(W^2) at fixed hyperparameters, W being the window size.
+"""
+
+from pygp.gp import GP
+from pygp.linalg import chol_update, solve_chol
+import scipy as SP
+import scipy.linalg as linalg
+import logging as LG
+
+
+class SlidingWindowGP(GP):
+    """
+    GP regression keeping the window_size most recent observations
+    (rows of x and y are ordered by arrival).
+
+    **Parameters:**
+
+    window_size : int
+        maximum number of observations kept in the model
+
+    Usage::
+
+        gp = SlidingWindowGP(window_size=200, covar_func=covar, likelihood=lik)
+        for x,y in stream:
+            gp.update(hyperparams, x, y)
+            [mu,var] = gp.predict(hyperparams, xstar)
+    """
+    __slots__ = ["window_size"]
+
+    def __init__(self, window_size=100, **kw_args):
+        self.window_size = window_size
+        super(SlidingWindowGP, self).__init__(**kw_args)
+
+    def update(self, hyperparams, x, y):
+        """
+        Add observations x,y and discard the oldest observations exceeding the window.
+        The factorization for hyperparams is kept up to date.
+
+        **Parameters:**
+
+        hyperparams : {'covar':logtheta, ...}
+            hyperparameters of the streaming model
+
+        x : inputs: [k x D]
+
+        y : targets/outputs [k x d]
+        """
+        if getattr(self, 'x', None) is None or x.shape[0] >= self.window_size:
+            self.setData(x=x[-self.window_size:], y=y[-self.window_size:])
+            return
+        #1. factorization of the current window, then extend it
+        self.get_covariances(hyperparams)
+        self.append_data(x, y)
+        #2. shrink to the window size
+        n_drop = self.n - self.window_size
+        if n_drop > 0:
+            self.remove_oldest(n_drop)
+        pass
+
+    def remove_oldest(self, k):
+        """
+        Remove the k oldest observations. With the factor
+        L = [L11 0; L21 L22] the remaining covariance is
+        L21*L21' + L22*L22', obtained from L22 by a rank-k update.
+        """
+        KV = self._covar_cache
+        self.x = self.x[k:]
+        self.y = self.y[k:]
+        self.n = len(self.x)
+        self._invalidate_cache()
+        if KV is None or 'x' in KV['hyperparams']:
+            return
+        L = chol_update(KV['L'][k:, k:], KV['L'][k:, :k])
+        K = KV['K'][k:, k:].copy()
+        alpha = solve_chol(L, self._get_y(KV['hyperparams']))
+        self._covar_cache = {'K': K, 'L': L, 'alpha': alpha, 'jitter': KV['jitter'],
+                             'hyperparams': KV['hyperparams']}
+        self._factorization_cache.put(self._cache_key(KV['hyperparams']), self._covar_cache)
+        pass
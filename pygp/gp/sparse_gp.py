@@ -0,0 +1,229 @@
+"""
+Sparse GP regression with inducing inputs
+=========================================
+
+Approximate GP regression based on M inducing inputs Xm, replacing the
+prior covariance by the low rank approximation::
+
+    Qnn = Knm Kmm^{-1} Kmn
+
+Supported approximations (Quinonero-Candela & Rasmussen, 2005; Titsias, 2009):
+
+* 'dtc':  deterministic training conditional, K ~ Qnn + noise
+* 'fitc': fully independent training conditional, K ~ Qnn + diag(Knn-Qnn) + noise
+* 'vfe':  variational free energy, the DTC likelihood with the
+  additional trace term 0.5*tr(noise^{-1}(Knn-Qnn))
+
+The observation noise is modelled by a diagonal likelihood
+(:py:class:`pygp.likelihood.GaussLikISO`), not by a noise covariance.
+Log marginal likelihood and gradients cost O(NM^2). The inducing inputs
+are optimized along with the other hyperparameters if they are passed as
+hyperparams['Xm'].
+"""
+
+from pygp.gp import GP
+from pygp.linalg import jitChol
+import scipy as SP
+import scipy.linalg as linalg
+import logging as LG
+
+
+class SparseGP(GP):
+    """
+    Sparse GP regression with inducing inputs.
+
+    **Parameters:**
+
+    Xm : [M x D]
+        inducing inputs (overridden by hyperparams['Xm'] if present)
+
+    method : str
+        approximation: 'fitc' (default), 'vfe' or 'dtc'
+
+    See :py:class:`pygp.gp.GP` for the remaining parameters.
+    """
+    __slots__ = ["Xm", "method"]
+
+    def __init__(self, Xm=None, method='fitc', **kw_args):
+        assert method in ['fitc', 'vfe', 'dtc'], 'unknown sparse approximation %s' % method
+        self.Xm = Xm
+        self.method = method
+        super(SparseGP, self).__init__(**kw_args)
+
+    def set_inducing_inputs(self, Xm):
+        """set the (fixed) inducing inputs Xm [M x D]"""
+        self.Xm = Xm
+        self._invalidate_cache()
+
+    def get_covariances(self, hyperparams):
+        """
+        Return the factorization of the sparse approximation::
+
+            Lm    = chol(Kmm)
+            V     = Lm^{-1} Kmn
+            Lam   = noise (+ diag(Knn-Qnn) for FITC)
+            La    = chol(I + V Lam^{-1} V')
+            alpha = (Qnn+Lam)^{-1} y
+            w     = Kmm^{-1} Kmn alpha
+
+        **Parameters:**
+
+        hyperparams: dict
+            The hyperparameters for the factorization
+        """
+        key = self._cache_key(hyperparams)
+        KV = self._factorization_cache.get(key)
+        if KV is not None:
+            self._covar_cache = KV
+            return KV
+        theta = hyperparams['covar']
+        x = self._get_x()
+        y = self._get_y(hyperparams)
+        Xm = self._get_Xm(hyperparams)
+        M = Xm.shape[0]
+        #1. covariance blocks
+        Kmm = self.covar.K(theta, Xm)
+        Lm, jitter = jitChol(Kmm)
+        Lm = Lm.T
+        Kmn = self.covar.K(theta, Xm, x)
+        knn = self.covar.Kdiag(theta, x)
+        noise = self.likelihood.Kdiag(hyperparams['lik'], x)
+        #2. low rank approximation Qnn = V'V
+        V = linalg.solve_triangular(Lm, Kmn, lower=True)
+        qnn = (V * V).sum(0)
+        Lam = noise.copy()
+        if self.method == 'fitc':
+            Lam += knn - qnn
+        #3. Woodbury: (Qnn+Lam)^{-1} = Lam^{-1} - C'C with C = La^{-1} V Lam^{-1}
+        Vl = V / SP.sqrt(Lam)
+        A = SP.dot(Vl, Vl.T)
+        A.flat[::M + 1] += 1
+        La = linalg.cholesky(A, lower=True)
+        C = linalg.solve_triangular(La, V / Lam, lower=True)
+        alpha = y / Lam[:, SP.newaxis] - SP.dot(C.T, SP.dot(C, y))
+        #P = Kmm^{-1} Kmn
+        P = linalg.solve_triangular(Lm, V, lower=True, trans=1)
+        w = SP.dot(P, alpha)
+        KV = {'Lm': Lm, 'V': V, 'C': C, 'P': P, 'La': La, 'Lam': Lam, 'alpha': alpha,
+              'w': w, 'knn': knn, 'qnn': qnn, 'noise': noise, 'jitter': jitter}
+        KV['hyperparams'] = dict([(k, SP.array(v, copy=True)) for k, v in hyperparams.iteritems()])
+        self._covar_cache = KV
+        self._factorization_cache.put(key, KV)
+        return KV
+
+    def _get_Xm(self, hyperparams):
+        if 'Xm' in hyperparams:
+            return hyperparams['Xm']
+        return self.Xm
+
+    def _LML_covar(self, hyperparams):
+        """negative log marginal likelihood of the sparse approximation"""
+        try:
+            KV = self.get_covariances(hyperparams)
+        except linalg.LinAlgError:
+            LG.error("exception caught (%s)" % (str(hyperparams)))
+            return 1E6
+        y = self._get_y(hyperparams)
+        d = self._get_target_dimension()
+        n = self._get_input_dimension()
+        #y'(Qnn+Lam)^{-1}y and log|Qnn+Lam|
+        lml_quad = 0.5 * (KV['alpha'] * y).sum()
+        lml_det = 0.5 * d * SP.log(KV['Lam']).sum() + d * SP.log(KV['La'].diagonal()).sum()
+        lml_const = 0.5 * d * n * SP.log(2 * SP.pi)
+        RV = lml_quad + lml_det + lml_const
+        if self.method == 'vfe':
+            RV += 0.5 * d * ((KV['knn'] - KV['qnn']) / KV['noise']).sum()
+        return RV
+
+    def _LMLgrad_covar(self, hyperparams):
+        #copies: callers subtract prior gradients in place, the cached gradients must stay intact
+        RV = self._LMLgrad_sparse(hyperparams)
+        return dict([(k, v.copy()) for k, v in RV.iteritems() if k != 'lik'])
+
+    def _LMLgrad_lik(self, hyperparams):
+        return {'lik': self._LMLgrad_sparse(hyperparams)['lik'].copy()}
+
+    def _LMLgrad_sparse(self, hyperparams):
+        """
+        Gradients of all hyperparameters, obtained by contracting the
+        derivatives of Kmm, Kmn, diag(Knn) and the noise with the
+        respective partial derivatives Wmm, Wmn, wnn, wnoise of the
+        objective. Stored in the covariance structure for reuse.
+        """
+        theta = hyperparams['covar']
+        try:
+            KV = self.get_covariances(hyperparams)
+        except linalg.LinAlgError:
+            LG.error("exception caught (%s)" % (str(hyperparams)))
+            RV = {'covar': SP.zeros(len(theta)), 'lik': SP.zeros(len(hyperparams['lik']))}
+            if 'Xm' in hyperparams:
+                RV['Xm'] = SP.zeros(hyperparams['Xm'].shape)
+            return RV
+        if 'LMLgrad' in KV:
+            return KV['LMLgrad']
+        x = self._get_x()
+        Xm = self._get_Xm(hyperparams)
+        M = Xm.shape[0]
+        d = self._get_target_dimension()
+        P, C, alpha = KV['P'], KV['C'], KV['alpha']
+        #1. G = d (Qnn+Lam)^{-1} - alpha alpha' enters through diag(G), P G and P G P'
+        g = d * (1. / KV['Lam'] - (C * C).sum(0)) - (alpha * alpha).sum(1)
+        PSi = P / KV['Lam'] - SP.dot(SP.dot(P, C.T), C)
+        Palpha = SP.dot(P, alpha)
+        PG = d * PSi - SP.dot(Palpha, alpha.T)
+        PGP = d * SP.dot(PSi, P.T) - SP.dot(Palpha, Palpha.T)
+        #2. partial derivatives with respect to qnn, knn and the noise
+        if self.method == 'fitc':
+            h = -0.5 * g
+            wnn = 0.5 * g
+            wnoise = 0.5 * g
+        elif self.method == 'vfe':
+            h = -0.5 * d / KV['noise']
+            wnn = -h
+            wnoise = 0.5 * g - 0.5 * d * (KV['knn'] - KV['qnn']) / KV['noise'] ** 2
+        else:
+            h = SP.zeros(g.shape)
+            wnn = h
+            wnoise = 0.5 * g
+        Wmn = PG + 2 * P * h
+        Wmm = -0.5 * PGP - SP.dot(P * h, P.T)
+        Wmm = 0.5 * (Wmm + Wmm.T)
+        #3. covariance hyperparameters
+        grad_covar = self.covar.contract_grad_theta(theta, Xm, Wmm)
+        grad_covar += self.covar.contract_grad_theta_cross(theta, Xm, x, Wmn)
+        for i in xrange(len(theta)):
+            grad_covar[i] += SP.dot(wnn, self.covar.Kgrad_theta_diag(theta, x, i))
+        RV = {'covar': grad_covar}
+        #4. likelihood
+        theta_lik = hyperparams['lik']
+        RV['lik'] = SP.array([SP.dot(wnoise, self.likelihood.Kgrad_theta_diag(theta_lik, x, i))
+                              for i in xrange(len(theta_lik))])
+        #5. inducing inputs
+        if 'Xm' in hyperparams:
+            grad_Xm = SP.zeros(Xm.shape)
+            for dim in xrange(Xm.shape[1]):
+                Kx = self.covar.Kgrad_x(theta, Xm, Xm, dim)
+                #the diagonal contributes once, off-diagonals twice (row and column)
+                Kx.flat[::M + 1] = 0.5 * self.covar.Kgrad_xdiag(theta, Xm, dim)
+                grad_Xm[:, dim] = 2 * (Wmm * Kx).sum(1)
+                grad_Xm[:, dim] += (Wmn * self.covar.Kgrad_x(theta, Xm, x, dim)).sum(1)
+            RV['Xm'] = grad_Xm
+        KV['LMLgrad'] = RV
+        return RV
+
+    def _predict_block(self, hyperparams, KV, xstar, output, var):
+        """predictions of the sparse approximation for the test inputs xstar"""
+        theta = hyperparams['covar']
+        Ksm = self.covar.K(theta, self._get_Xm(hyperparams), xstar)
+        if output is None:
+            mu = SP.dot(Ksm.T, KV['w'])
+        else:
+            mu = SP.dot(Ksm.T, KV['w'][:, output])
+        if not var:
+            return mu
+        #k** - Q** + K*m (Kmm + Kmn Lam^{-1} Knm)^{-1} Km*
+        Vs = linalg.solve_triangular(KV['Lm'], Ksm, lower=True)
+        Ws = linalg.solve_triangular(KV['La'], Vs, lower=True)
+        S2 = self.covar.Kdiag(theta, xstar) + self.likelihood.Kdiag(hyperparams['lik'], xstar)
+        S2 = S2 - (Vs * Vs).sum(0) + (Ws * Ws).sum(0)
+        return [mu, abs(S2)]
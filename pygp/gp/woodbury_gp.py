@@ -0,0 +1,335 @@
+"""
+Low rank plus diagonal GP regression
+====================================
+
+GP regression for covariances of the form::
+
+    K = Lambda + U V'
+
+with Lambda a positive diagonal (noise terms and Gaussian likelihoods)
+and U V' of rank r << N (linear covariance functions on r features),
+e.g. ::
+
+    covar = SumCF((LinearCFISO(D), NoiseCFISO()))
+
+The structure is read from :py:meth:`pygp.covar.CovarianceFunction.K_structured`.
+Inverse and determinant follow from the Woodbury identity and the
+[r x r] capacitance matrix C = I + V' Lambda^{-1} U::
+
+    K^{-1} = Lambda^{-1} - Lambda^{-1} U C^{-1} V' Lambda^{-1}
+    log|K| = log|Lambda| + log|C|
+
+so that log marginal likelihood, gradients and predictions cost
+O(N r^2) time and O(N r) memory; no N x N matrix is formed.
+"""
+
+from pygp.gp import GP
+from pygp.gp.frozen import FrozenGP
+from pygp.linalg import Sum, Diagonal, LowRank
+import scipy.linalg as linalg
+import numpy as NP
+import scipy as SP
+import logging as LG
+
+
+def _flatten(S):
+    """list of the non-sum terms of a structured matrix"""
+    if isinstance(S, Sum):
+        return sum([_flatten(term) for term in S.terms], [])
+    return [S]
+
+
+def _lowrank_plus_diagonal(S):
+    """
+    [U, V, lam] with S = diag(lam) + U V' for a structured matrix S of
+    low rank and diagonal terms, None for any other structure
+    """
+    lam = SP.zeros(min(S.shape))
+    lowrank = []
+    for term in _flatten(S):
+        if isinstance(term, Diagonal):
+            lam += term.d
+        elif isinstance(term, LowRank):
+            lowrank.append(term)
+        else:
+            return None
+    U = SP.concatenate([SP.zeros([S.shape[0], 0])] + [term.U for term in lowrank], axis=1)
+    V = SP.concatenate([SP.zeros([S.shape[1], 0])] + [term.V for term in lowrank], axis=1)
+    return [U, V, lam]
+
+
+def _Kinv_dot(KV, B):
+    """K^{-1} B for B [N x k] in O(N r k), given the Woodbury structure KV"""
+    RV = B / KV['lam'][:, SP.newaxis]
+    RV -= SP.dot(KV['P'], NP.linalg.solve(KV['C'], SP.dot(KV['Q'].T, B)))
+    return RV
+
+
+def _predict(covar, theta, x, KV, alpha, xstar, var, likelihood=None, lik_theta=None):
+    """predictions at xstar given the Woodbury structure KV; low rank cross covariances U V' are not formed"""
+    #1. cross covariance [N x M], either low rank or dense
+    Kstar = covar.K_structured(theta, x, xstar)
+    RV = _lowrank_plus_diagonal(Kstar)
+    lowrank = RV is not None and not RV[2].any()
+    if lowrank:
+        U, V = RV[0], RV[1]
+        mu = SP.dot(V, SP.dot(U.T, alpha))
+    else:
+        Kstar = Kstar.to_dense()
+        mu = SP.dot(Kstar.T, alpha)
+    if not var:
+        return mu
+    #2. variance
+    Kss_diag = covar.Kdiag(theta, xstar)
+    if likelihood is not None:
+        Kss_diag = Kss_diag + likelihood.Kdiag(lik_theta, xstar)
+    if lowrank:
+        S2 = Kss_diag - (SP.dot(V, SP.dot(U.T, _Kinv_dot(KV, U))) * V).sum(1)
+    else:
+        S2 = Kss_diag - (Kstar * _Kinv_dot(KV, Kstar)).sum(0)
+    return [mu, abs(S2)]
+
+
+class WoodburyGP(GP):
+    """
+    GP regression through the Woodbury identity for low rank plus
+    diagonal covariances; other covariances are handled by the dense
+    Cholesky factorization of :py:class:`pygp.gp.GP`.
+
+    **Parameters:**
+
+    woodbury : 'auto' or boolean
+        'auto': use the Woodbury identity if the covariance is low rank
+        plus a positive diagonal with rank r < N/2;
+        True: always use it (ValueError for other covariances);
+        False: always factorize the dense covariance
+
+    See :py:class:`pygp.gp.GP` for the remaining parameters.
+    """
+    __slots__ = ["woodbury"]
+
+    def __init__(self, woodbury='auto', **kw_args):
+        assert woodbury in ['auto', True, False], 'unknown woodbury mode %s' % str(woodbury)
+        self.woodbury = woodbury
+        super(WoodburyGP, self).__init__(**kw_args)
+
+    def _factorize(self, hyperparams, K=None):
+        """
+        Woodbury structure::
+
+            lam   : diagonal of Lambda [N]
+            P, Q  : Lambda^{-1} U, Lambda^{-1} V [N x r]
+            C     : capacitance matrix I + V' Lambda^{-1} U [r x r]
+            alpha : K^{-1} y
+            logdet: log|K|
+
+        or the dense structure of :py:meth:`pygp.gp.GP.get_covariances`.
+        """
+        if self.woodbury is False:
+            return GP._factorize(self, hyperparams, K)
+        x = self._get_x()
+        n = x.shape[0]
+        #1. structure of the noisy covariance
+        S = self.covar.K_structured(hyperparams['covar'], x)
+        Sn = S
+        if self.likelihood is not None:
+            Sn = S + self.likelihood.K_structured(hyperparams['lik'], x)
+        RV = _lowrank_plus_diagonal(Sn)
+        if self.woodbury is True:
+            if RV is None:
+                raise ValueError('WoodburyGP: covariance is not low rank plus diagonal')
+            if (RV[2] <= 0).any():
+                raise linalg.LinAlgError('WoodburyGP: diagonal is not positive')
+        elif RV is None or (RV[2] <= 0).any() or 2 * RV[0].shape[1] >= n:
+            LG.debug("WoodburyGP: no low rank plus diagonal structure, dense factorization")
+            return GP._factorize(self, hyperparams, S.to_dense())
+        U, V, lam = RV
+        #2. capacitance matrix and determinant
+        P = U / lam[:, SP.newaxis]
+        Q = V / lam[:, SP.newaxis]
+        C = SP.eye(U.shape[1]) + SP.dot(V.T, P)
+        sign, logdetC = NP.linalg.slogdet(C)
+        if sign <= 0:
+            raise linalg.LinAlgError('WoodburyGP: covariance is not positive definite')
+        KV = {'lam': lam, 'P': P, 'Q': Q, 'C': C, 'logdet': SP.log(lam).sum() + logdetC}
+        KV['alpha'] = _Kinv_dot(KV, self._get_y(hyperparams))
+        KV['hyperparams'] = dict([(k, SP.array(v, copy=True)) for k, v in hyperparams.iteritems()])
+        return KV
+
+    def _is_woodbury(self, KV):
+        return 'C' in KV
+
+    def _get_Kinv_diag(self, KV):
+        """diagonal of K^{-1} in O(N r^2), stored in KV"""
+        if KV.get('Kinv_diag') is None:
+            R = NP.linalg.solve(KV['C'], KV['Q'].T)
+            KV['Kinv_diag'] = 1. / KV['lam'] - (KV['P'] * R.T).sum(1)
+        return KV['Kinv_diag']
+
+    def _get_Kinv(self, KV):
+        """dense inverse covariance; O(N^2 r) for the Woodbury structure"""
+        if not self._is_woodbury(KV):
+            return GP._get_Kinv(self, KV)
+        if KV.get('Kinv') is None:
+            KV['Kinv'] = _Kinv_dot(KV, SP.eye(KV['lam'].shape[0]))
+        return KV['Kinv']
+
+    def _contract(self, KV, G):
+        """
+        (G * W).sum() for W = d*K^{-1} - alpha alpha' and a structured
+        derivative G, without forming W for diagonal and low rank terms
+        """
+        d = self._get_target_dimension()
+        alpha = KV['alpha']
+        if isinstance(G, Sum):
+            return sum([self._contract(KV, term) for term in G.terms])
+        if isinstance(G, Diagonal):
+            return SP.dot(G.d, d * self._get_Kinv_diag(KV) - (alpha * alpha).sum(1))
+        if isinstance(G, LowRank):
+            return (d * (G.U * _Kinv_dot(KV, G.V)).sum()
+                    - (SP.dot(alpha.T, G.U) * SP.dot(alpha.T, G.V)).sum())
+        return G.contract(d * self._get_Kinv(KV) - SP.dot(alpha, alpha.T))
+
+    def _LML_covar(self, hyperparams):
+        try:
+            KV = self.get_covariances(hyperparams)
+        except linalg.LinAlgError:
+            LG.error("exception caught (%s)" % (str(hyperparams)))
+            return 1E6
+        if not self._is_woodbury(KV):
+            return GP._LML_covar(self, hyperparams)
+        lml_quad = 0.5 * (KV['alpha'] * self._get_y(hyperparams)).sum()
+        lml_det = 0.5 * self._get_target_dimension() * KV['logdet']
+        lml_const = 0.5 * self._get_target_dimension() * self._get_input_dimension() * SP.log(2 * SP.pi)
+        return lml_quad + lml_det + lml_const
+
+    def _LMLgrad_covar(self, hyperparams):
+        logtheta = hyperparams['covar']
+        try:
+            KV = self.get_covariances(hyperparams)
+        except linalg.LinAlgError:
+            LG.error("exception caught (%s)" % (str(hyperparams)))
+            return {'covar': SP.zeros(len(logtheta))}
+        if not self._is_woodbury(KV):
+            return GP._LMLgrad_covar(self, hyperparams)
+        x = self._get_x()
+        LMLgrad = SP.array([0.5 * self._contract(KV, self.covar.Kgrad_theta_structured(logtheta, x, i))
+                            for i in xrange(len(logtheta))])
+        return {'covar': LMLgrad}
+
+    def _LMLgrad_lik(self, hyperparams):
+        logtheta = hyperparams['lik']
+        try:
+            KV = self.get_covariances(hyperparams)
+        except linalg.LinAlgError:
+            return {'lik': SP.zeros(len(logtheta))}
+        if not self._is_woodbury(KV):
+            return GP._LMLgrad_lik(self, hyperparams)
+        x = self._get_x()
+        LMLgrad = SP.array([0.5 * self._contract(KV, self.likelihood.Kgrad_theta_structured(logtheta, x, i))
+                            for i in xrange(len(logtheta))])
+        return {'lik': LMLgrad}
+
+    def loo_predict(self, hyperparams):
+        KV = self.get_covariances(hyperparams)
+        if not self._is_woodbury(KV):
+            return GP.loo_predict(self, hyperparams)
+        Kinv_diag = self._get_Kinv_diag(KV)
+        mu = self._get_y(hyperparams) - KV['alpha'] / Kinv_diag[:, SP.newaxis]
+        return [mu, 1. / Kinv_diag]
+
+    def _append_covariances(self, KV, x_old, x_new):
+        """the Woodbury structure of the extended data is recomputed in O(N r^2)"""
+        if not self._is_woodbury(KV):
+            return GP._append_covariances(self, KV, x_old, x_new)
+        return self._factorize(KV['hyperparams'])
+
+    def _predict_block(self, hyperparams, KV, xstar, output, var):
+        """predictions for xstar; low rank cross covariances U V' are not formed"""
+        if not self._is_woodbury(KV):
+            return GP._predict_block(self, hyperparams, KV, xstar, output, var)
+        if output is None:
+            alpha = KV['alpha']
+        else:
+            alpha = KV['alpha'][:, output]
+        lik_theta = hyperparams['lik'] if self.likelihood is not None else None
+        return _predict(self.covar, hyperparams['covar'], self._get_x(), KV, alpha, xstar, var,
+                        likelihood=self.likelihood, lik_theta=lik_theta)
+
+    def freeze(self, hyperparams):
+        """
+        Return the posterior at the given hyperparameters for fast
+        prediction: a :py:class:`FrozenWoodburyGP` holding the O(N r)
+        Woodbury factors, or a :py:class:`pygp.gp.frozen.FrozenGP`
+        for the dense factorization.
+
+        **Parameters:**
+
+        hyperparams : {'covar':logtheta, ...}
+            hyperparameters in logSpace
+        """
+        KV = self.get_covariances(hyperparams)
+        if not self._is_woodbury(KV):
+            return GP.freeze(self, hyperparams)
+        lik_theta = None
+        if self.likelihood is not None:
+            lik_theta = SP.array(hyperparams['lik'])
+        return FrozenWoodburyGP(self.covar, hyperparams['covar'], self._get_x(), KV,
+                                likelihood=self.likelihood, lik_theta=lik_theta)
+
+
+class FrozenWoodburyGP(FrozenGP):
+    """
+    Frozen posterior of a :py:class:`WoodburyGP`, storing the training
+    inputs, alpha and the Woodbury factors (O(N r) memory) instead of a
+    Cholesky factor. Predictions cost O((N+M) r^2) for low rank cross
+    covariances.
+
+    **Parameters:**
+
+    covar : :py:class:`pygp.covar.CovarianceFunction`
+        covariance function (evaluated through K_structured)
+
+    theta : [double]
+        its hyperparameters
+
+    x : [N x D]
+        training inputs
+
+    KV : dict
+        Woodbury structure of :py:meth:`WoodburyGP.get_covariances`
+
+    likelihood, lik_theta :
+        likelihood model and its parameters, used for the predictive variance
+    """
+    __slots__ = ["theta", "lam", "P", "Q", "C"]
+    _fields = ["covar", "theta", "x", "alpha", "lam", "P", "Q", "C", "likelihood", "lik_theta"]
+    _arrays = ["x", "alpha", "lam", "P", "Q", "C"]
+
+    def __init__(self, covar, theta, x, KV, likelihood=None, lik_theta=None):
+        self.covar = covar
+        self.theta = SP.array(theta, dtype='float')
+        self.likelihood = likelihood
+        self.lik_theta = lik_theta
+        self.L = None
+        self.x = SP.array(x)
+        for name in ["alpha", "lam", "P", "Q", "C"]:
+            setattr(self, name, SP.array(KV[name]))
+        for name in self._arrays:
+            getattr(self, name).flags.writeable = False
+
+    def predict(self, xstar, output=0, var=True):
+        """
+        Predict mean and variance at the inputs xstar.
+
+        **Parameters:**
+
+        See :py:meth:`pygp.gp.GP.predict`
+        """
+        if output is None:
+            alpha = self.alpha
+        else:
+            alpha = self.alpha[:, output]
+        KV = {'lam': self.lam, 'P': self.P, 'Q': self.Q, 'C': self.C}
+        return _predict(self.covar, self.theta, self.x, KV, alpha, xstar, var,
+                        likelihood=self.likelihood, lik_theta=self.lik_theta)
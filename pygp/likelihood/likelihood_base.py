@@ -7,7 +7,14 @@ import copy
 
 class ALik(object):
     """abstract class for arbitrary likelihood model"""
-    pass
+
+    def K_structured(self,theta,x1):
+        """noise covariance as a structured matrix (default: dense)"""
+        return Dense(self.K(theta,x1))
+
+    def Kgrad_theta_structured(self,theta,x1,i):
+        """derivative with respect to the i-th hyperparameter as a structured matrix (default: dense)"""
+        return Dense(self.Kgrad_theta(theta,x1,i))
 
 
 
@@ -41,9 +48,18 @@ class GaussGroupLikISO(ALik):
         **Parameters:**
         See :py:class:`pygp.covar.CovarianceFunction`
         """
+        return SP.diag(self.Kgrad_theta_diag(theta,x1,i))
+
+    def K_structured(self,theta,x1):
+        return Diagonal(self.Kdiag(theta,x1))
+
+    def Kgrad_theta_structured(self,theta,x1,i):
+        return Diagonal(self.Kgrad_theta_diag(theta,x1,i))
+
+    def Kgrad_theta_diag(self,theta,x1,i):
+        """diagonal of the derivative with respect to the i-th hyperparameter"""
         sigma = SP.exp(2*theta[i])
-        Knoise = SP.diag(2*sigma*(1.0*(x1[:,self.column]==i)))
-        return Knoise
+        return 2*sigma*(1.0*(x1[:,self.column]==i))
 
 
 class GaussLikISO(ALik):
@@ -82,6 +98,17 @@ class GaussLikISO(ALik):
         assert i==0, 'unknown hyperparameter'
         return 2*K
 
+    def Kgrad_theta_diag(self,theta,x1,i):
+        """diagonal of the derivative with respect to the i-th hyperparameter"""
+        assert i==0, 'unknown hyperparameter'
+        return 2*self.Kdiag(theta,x1)
+
+    def K_structured(self,theta,x1):
+        return Diagonal(self.Kdiag(theta,x1))
+
+    def Kgrad_theta_structured(self,theta,x1,i):
+        return Diagonal(self.Kgrad_theta_diag(theta,x1,i))
+
 
 
 class GaussLikARD(ALik):
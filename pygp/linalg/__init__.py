@@ -11,3 +11,5 @@ except ImportError:
 
 #Default: import linalg_base
 from linalg_matrix import *
+from iterative import *
+from structured import *
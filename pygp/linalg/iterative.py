@@ -0,0 +1,131 @@
+"""
+Iterative solvers for large covariance matrices
+===============================================
+
+Matrix-free routines which only access a symmetric positive definite
+matrix through matrix-vector products:
+
+* :py:func:`cg`: conjugate gradients for several right hand sides at once,
+  optionally recording the Lanczos coefficients of each column
+* :py:func:`slq_logdet`: stochastic Lanczos quadrature estimate of log|A|
+  from the coefficients recorded by :py:func:`cg` for random probe vectors
+* :py:func:`rademacher`: probe vectors for Hutchinson trace estimates
+"""
+
+import scipy as SP
+import scipy.linalg as linalg
+import logging as LG
+
+
+def rademacher(n, n_probes, random_state=None):
+    """
+    Return [n x n_probes] random vectors with entries +-1, i.e. E[zz'] = I.
+    """
+    if random_state is None:
+        random_state = SP.random
+    return 2.0 * (random_state.rand(n, n_probes) > 0.5) - 1.0
+
+
+def cg(matvec, B, tol=1E-6, maxiter=None, lanczos=False):
+    """
+    Solve A X = B with conjugate gradients, all columns of B at once::
+
+        [X, coefficients] = cg(matvec, B, lanczos=True)
+
+    **Parameters:**
+
+    matvec : function
+        matvec(V) returns A*V for an [n x k] matrix V
+
+    B : [n x k]
+        right hand sides
+
+    tol : double
+        relative residual norm at which a column has converged
+
+    maxiter : int
+        maximum number of iterations (default: n)
+
+    lanczos : boolean
+        also return the CG coefficients [(alpha_j, beta_j)] of each column,
+        which define the Lanczos tridiagonal matrix (see :py:func:`slq_logdet`)
+    """
+    B = SP.array(B, dtype='float', ndmin=2)
+    if B.shape[0] == 1 and B.shape[1] > 1:
+        B = B.T
+    n, k = B.shape
+    if maxiter is None:
+        maxiter = n
+    X = SP.zeros([n, k])
+    R = B.copy()
+    P = R.copy()
+    rr = (R * R).sum(0)
+    bnorm = SP.sqrt(rr)
+    active = bnorm > 0
+    coefficients = [[] for j in xrange(k)]
+    for it in xrange(maxiter):
+        if not active.any():
+            break
+        AP = matvec(P[:, active])
+        pAp = (P[:, active] * AP).sum(0)
+        a = rr[active] / pAp
+        X[:, active] += P[:, active] * a
+        R[:, active] -= AP * a
+        rr_new = (R[:, active] * R[:, active]).sum(0)
+        b = rr_new / rr[active]
+        if lanczos:
+            for j, aj, bj in zip(SP.nonzero(active)[0], a, b):
+                coefficients[j].append((aj, bj))
+        P[:, active] = R[:, active] + P[:, active] * b
+        rr[active] = rr_new
+        active = active & (SP.sqrt(rr) > tol * bnorm)
+    if active.any():
+        LG.warning("cg: %d of %d systems did not converge in %d iterations" % (active.sum(), k, maxiter))
+    if lanczos:
+        return [X, coefficients]
+    return X
+
+
+def lanczos_tridiag(coefficients):
+    """
+    Lanczos tridiagonal matrix T of a CG run from its coefficients
+    [(alpha_j, beta_j)]::
+
+        T[0,0]   = 1/alpha_0
+        T[j,j]   = 1/alpha_j + beta_{j-1}/alpha_{j-1}
+        T[j,j+1] = sqrt(beta_j)/alpha_j
+    """
+    m = len(coefficients)
+    a = SP.array([c[0] for c in coefficients])
+    b = SP.array([c[1] for c in coefficients])
+    T = SP.zeros([m, m])
+    T[SP.arange(m), SP.arange(m)] = 1. / a
+    T[SP.arange(1, m), SP.arange(1, m)] += b[:-1] / a[:-1]
+    off = SP.sqrt(b[:-1]) / a[:-1]
+    T[SP.arange(m - 1), SP.arange(1, m)] = off
+    T[SP.arange(1, m), SP.arange(m - 1)] = off
+    return T
+
+
+def slq_logdet(coefficients, probe_norms2):
+    """
+    Stochastic Lanczos quadrature estimate of log|A|::
+
+        log|A| = E[z' log(A) z] ~ mean_j |z_j|^2 sum_k (e_1'v_k)^2 log(theta_k)
+
+    with the eigenpairs (theta_k, v_k) of the Lanczos matrix of probe z_j.
+
+    **Parameters:**
+
+    coefficients : [[(alpha,beta)]]
+        CG coefficients of the probe systems (see :py:func:`cg`)
+
+    probe_norms2 : [double]
+        squared norms of the probe vectors
+    """
+    RV = 0
+    for coef, z2 in zip(coefficients, probe_norms2):
+        T = lanczos_tridiag(coef)
+        theta, V = linalg.eigh(T)
+        RV += z2 * (V[0, :] ** 2 * SP.log(theta)).sum()
+    return RV / len(coefficients)
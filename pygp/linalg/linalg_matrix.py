@@ -25,6 +25,45 @@ def solve_chol(A,B):
 
 
 
+def chol_update(L, X, overwrite=False):
+    """
+    Rank-k update of a lower Cholesky factor::
+
+        return chol(L*L' + X*X')
+
+    in O(n^2 k) through k sequential rank-1 (Givens) updates.
+
+    **Parameters:**
+
+    L : [n x n]
+        lower triangular Cholesky factor
+
+    X : [n x k] or [n]
+        update vectors
+
+    overwrite : boolean
+        update L in place
+    """
+    if not overwrite:
+        L = L.copy()
+    X = SP.array(X, dtype='float', ndmin=2)
+    if X.shape[0] != L.shape[0]:
+        X = X.T
+    n = L.shape[0]
+    for j in xrange(X.shape[1]):
+        x = X[:, j].copy()
+        for k in xrange(n):
+            r = SP.sqrt(L[k, k] ** 2 + x[k] ** 2)
+            c = r / L[k, k]
+            s = x[k] / L[k, k]
+            L[k, k] = r
+            L[k + 1:, k] += s * x[k + 1:]
+            L[k + 1:, k] /= c
+            x[k + 1:] *= c
+            x[k + 1:] -= s * L[k + 1:, k]
+    return L
+
+
 def jitChol(A, maxTries=10, warning=True):
 
     """Do a Cholesky decomposition with jitter.
@@ -0,0 +1,194 @@
+"""
+Structured covariance matrices
+==============================
+
+Light-weight representations of covariance terms which avoid dense
+N x N arrays where the structure allows:
+
+* :py:class:`Dense`: an ordinary array
+* :py:class:`Diagonal`: diag(d), e.g. noise terms
+* :py:class:`LowRank`: U V', e.g. linear kernels on few features
+* :py:class:`Sum`: a sum of structured terms
+
+All representations support adding themselves to a dense array in place
+(:py:meth:`StructuredMatrix.add_to`), contraction with a weight matrix
+W, i.e. (A*W).sum(), as needed for log marginal likelihood gradients
+(:py:meth:`StructuredMatrix.contract`), products with vectors and
+conversion to dense arrays. Covariance functions and likelihoods return
+them from K_structured / Kgrad_theta_structured.
+"""
+
+import scipy as SP
+
+__all__ = ['StructuredMatrix', 'Dense', 'Diagonal', 'LowRank', 'Sum', 'as_structured']
+
+
+class StructuredMatrix(object):
+    """base class of structured matrices with the given shape"""
+    __slots__ = ["shape"]
+
+    def to_dense(self):
+        """new dense array"""
+        RV = SP.zeros(self.shape)
+        self.add_to(RV)
+        return RV
+
+    def add_to(self, out):
+        """out += self (in place), returns out"""
+        raise NotImplementedError
+
+    def diagonal(self):
+        raise NotImplementedError
+
+    def contract(self, W):
+        """(self * W).sum() for a dense W of the same shape"""
+        raise NotImplementedError
+
+    def dot(self, V):
+        """matrix product self * V"""
+        raise NotImplementedError
+
+    def __add__(self, other):
+        return Sum([self, as_structured(other)])
+
+
+class Dense(StructuredMatrix):
+    """
+    Dense matrix A.
+    """
+    __slots__ = ["A"]
+
+    def __init__(self, A):
+        self.A = A
+        self.shape = A.shape
+
+    def to_dense(self):
+        return self.A.copy()
+
+    def add_to(self, out):
+        out += self.A
+        return out
+
+    def diagonal(self):
+        return self.A.diagonal()
+
+    def contract(self, W):
+        return SP.vdot(self.A, W)
+
+    def dot(self, V):
+        return SP.dot(self.A, V)
+
+
+class Diagonal(StructuredMatrix):
+    """
+    Square diagonal matrix diag(d); contractions and products are O(N).
+    """
+    __slots__ = ["d"]
+
+    def __init__(self, d):
+        self.d = SP.asarray(d, dtype='float')
+        self.shape = (self.d.shape[0], self.d.shape[0])
+
+    def to_dense(self):
+        return SP.diag(self.d)
+
+    def add_to(self, out):
+        out.flat[::out.shape[1] + 1] += self.d
+        return out
+
+    def diagonal(self):
+        return self.d
+
+    def contract(self, W):
+        return SP.dot(self.d, W.diagonal())
+
+    def dot(self, V):
+        if V.ndim == 1:
+            return self.d * V
+        return self.d[:, SP.newaxis] * V
+
+
+class LowRank(StructuredMatrix):
+    """
+    Low rank matrix U V' with U [N x k] and V [M x k]; contractions
+    and products are O(NMk) / O((N+M)k) without forming the matrix.
+    """
+    __slots__ = ["U", "V"]
+
+    def __init__(self, U, V=None):
+        if V is None:
+            V = U
+        self.U = U
+        self.V = V
+        self.shape = (U.shape[0], V.shape[0])
+
+    def to_dense(self):
+        return SP.dot(self.U, self.V.T)
+
+    def add_to(self, out):
+        out += SP.dot(self.U, self.V.T)
+        return out
+
+    def diagonal(self):
+        return (self.U * self.V).sum(axis=1)
+
+    def contract(self, W):
+        return (self.U * SP.dot(W, self.V)).sum()
+
+    def dot(self, V):
+        return SP.dot(self.U, SP.dot(self.V.T, V))
+
+
+class Sum(StructuredMatrix):
+    """
+    Sum of structured matrices (terms); an empty sum is the zero matrix of the given shape.
+    """
+    __slots__ = ["terms"]
+
+    def __init__(self, terms, shape=None):
+        self.terms = [as_structured(term) for term in terms]
+        if shape is None:
+            shape = self.terms[0].shape
+        self.shape = shape
+
+    def to_dense(self):
+        """dense terms are summed first, diagonal and low rank terms are added in place"""
+        dense = [term for term in self.terms if isinstance(term, Dense) and term.shape == self.shape]
+        if dense:
+            RV = dense[0].to_dense()
+        else:
+            RV = SP.zeros(self.shape)
+        for term in self.terms:
+            if not dense or term is not dense[0]:
+                term.add_to(RV)
+        return RV
+
+    def add_to(self, out):
+        for term in self.terms:
+            term.add_to(out)
+        return out
+
+    def diagonal(self):
+        RV = SP.zeros(min(self.shape))
+        for term in self.terms:
+            RV += term.diagonal()
+        return RV
+
+    def contract(self, W):
+        return sum([term.contract(W) for term in self.terms])
+
+    def dot(self, V):
+        RV = SP.zeros((self.shape[0],) + V.shape[1:])
+        for term in self.terms:
+            RV += term.dot(V)
+        return RV
+
+    def __add__(self, other):
+        return Sum(self.terms + [as_structured(other)], self.shape)
+
+
+def as_structured(A):
+    """wrap dense arrays as :py:class:`Dense`, structured matrices are returned as they are"""
+    if isinstance(A, StructuredMatrix):
+        return A
+    return Dense(SP.asarray(A))
@@ -11,6 +11,7 @@ for hyperparameters of covariance functions
 
 # import scipy:
 import scipy as SP
+import numpy as NP
 import scipy.optimize as OPT
 import logging as LG
 import pdb
@@ -110,7 +111,13 @@ def opt_hyper(gpr,hyperparams,Ifilter=None,maxiter=1000,gradcheck=False,bounds =
     gradcheck: boolean 
         check gradients comparing the analytical gradients to their approximations
     optimizer: :py:class:`scipy.optimize`
-        which scipy optimizer to use? (standard lbfgsb)
+        which scipy optimizer to use? (standard tnc). For
+        fmin_tnc and fmin_l_bfgs_b the objective and gradient are
+        evaluated jointly (:py:meth:`pygp.gp.GP.LML_and_grad`); a string
+        selects the method of scipy.optimize.minimize (jac=True).
+    objective: str (keyword only)
+        objective to minimize: 'LML' (negative log marginal likelihood,
+        default) or 'LOO_CV' (negative leave-one-out log predictive probability)
 
     ** argument passed onto LML**
 
@@ -119,10 +126,16 @@ def opt_hyper(gpr,hyperparams,Ifilter=None,maxiter=1000,gradcheck=False,bounds =
         first index amplitude, last noise, rest:lengthscales
     """
 
+    #objective function, gradient and both jointly
+    objective = kw_args.pop('objective','LML')
+    obj_f = getattr(gpr,objective)
+    obj_df = getattr(gpr,objective+'grad')
+    obj_fdf = getattr(gpr,objective+'_and_grad')
+
     def f(x):
         x_ = X0
         x_[Ifilter_x] = x
-        rv =  gpr.LML(param_list_to_dict(x_,param_struct,skeys),*args,**kw_args)
+        rv =  obj_f(param_list_to_dict(x_,param_struct,skeys),*args,**kw_args)
         #LG.debug("L("+str(x_)+")=="+str(rv))
         if SP.isnan(rv):
             return 1E6
@@ -131,7 +144,7 @@ def opt_hyper(gpr,hyperparams,Ifilter=None,maxiter=1000,gradcheck=False,bounds =
     def df(x):
         x_ = X0
         x_[Ifilter_x] = x
-        rv =  gpr.LMLgrad(param_list_to_dict(x_,param_struct,skeys),*args,**kw_args)
+        rv =  obj_df(param_list_to_dict(x_,param_struct,skeys),*args,**kw_args)
         rv = param_dict_to_list(rv,skeys)
         #LG.debug("dL("+str(x_)+")=="+str(rv))
         if not SP.isfinite(rv).all(): #SP.isnan(rv).any():
@@ -139,6 +152,18 @@ def opt_hyper(gpr,hyperparams,Ifilter=None,maxiter=1000,gradcheck=False,bounds =
             rv[In] = 1E6
         return rv[Ifilter_x]
 
+    def fdf(x):
+        x_ = X0
+        x_[Ifilter_x] = x
+        rv, grad = obj_fdf(param_list_to_dict(x_,param_struct,skeys),*args,**kw_args)
+        grad = param_dict_to_list(grad,skeys)
+        if SP.isnan(rv):
+            rv = 1E6
+        if not SP.isfinite(grad).all():
+            In = SP.isnan(grad)
+            grad[In] = 1E6
+        return rv, grad[Ifilter_x]
+
     #0. store parameter structure
     skeys = SP.sort(hyperparams.keys())
     param_struct = dict([(name,hyperparams[name].shape) for name in skeys])
@@ -180,7 +205,15 @@ def opt_hyper(gpr,hyperparams,Ifilter=None,maxiter=1000,gradcheck=False,bounds =
     #general optimizer interface
     #note: x is a subset of X, indexing the parameters that are optimized over
     # Ifilter_x pickes the subest of X, yielding x
-    opt_RV=optimizer(f, x, fprime=df, maxfun=int(maxiter),pgtol=gradient_tolerance, messages=False, bounds=bounds)
+    if optimizer is OPT.fmin_tnc:
+        opt_RV=optimizer(fdf, x, fprime=None, maxfun=int(maxiter),pgtol=gradient_tolerance, messages=False, bounds=bounds)
+    elif optimizer is OPT.fmin_l_bfgs_b:
+        opt_RV=optimizer(fdf, x, fprime=None, maxfun=int(maxiter),pgtol=gradient_tolerance, bounds=bounds)
+    elif isinstance(optimizer,str):
+        res = OPT.minimize(fdf, x, method=optimizer, jac=True, bounds=bounds, options={'maxiter':int(maxiter)})
+        opt_RV = [res.x]
+    else:
+        opt_RV=optimizer(f, x, fprime=df, maxfun=int(maxiter),pgtol=gradient_tolerance, messages=False, bounds=bounds)
     # optimizer = OPT.fmin_l_bfgs_b
     # opt_RV=optimizer(f, x, fprime=df, maxfun=int(maxiter),iprint =1, bounds=bounds, factr=10.0, pgtol=1e-10)
     opt_x = opt_RV[0]
@@ -191,7 +224,7 @@ def opt_hyper(gpr,hyperparams,Ifilter=None,maxiter=1000,gradcheck=False,bounds =
     #convert into dictionary
     opt_hyperparams = param_list_to_dict(Xopt,param_struct,skeys)
     #get the log marginal likelihood at the optimum:
-    opt_lml = gpr.LML(opt_hyperparams,**kw_args)
+    opt_lml = obj_f(opt_hyperparams,**kw_args)
 
     if gradcheck:
 	checkgrad(f, df, opt_RV[0])
@@ -207,3 +240,91 @@ def opt_hyper(gpr,hyperparams,Ifilter=None,maxiter=1000,gradcheck=False,bounds =
     LG.debug("grad:"+str(df(opt_x)))
     
     return [opt_hyperparams,opt_lml]
+
+
+def opt_hyper_batch(gpr,hyperparams,maxiter=200,gradient_tolerance=1E-4,max_linesearch=30):
+    """
+    Optimize the hyperparameters of all targets of a
+    :py:class:`pygp.gp.batched_gp.BatchedGP` independently, running one
+    BFGS optimizer per target in lockstep: every iteration evaluates the
+    objectives and gradients of all targets in a single batched call.
+
+    **Parameters:**
+
+    gpr : :py:class:`pygp.gp.batched_gp.BatchedGP`
+        batched GP regression class
+    hyperparams : {'covar':[B x P], 'lik':[B x 1]}
+        stacked starting hyperparameters, one row per target
+    maxiter: int
+        maximum number of BFGS iterations
+    gradient_tolerance: double
+        a target has converged once all its gradient entries are below this value
+    max_linesearch: int
+        maximum number of step halvings of the backtracking line search
+
+    **Returns:**
+
+    [opt_hyperparams, opt_lml] with the negative log marginal likelihood of each target
+    """
+    #0. store parameter structure: one row of X per target
+    skeys = SP.sort(hyperparams.keys())
+    widths = [hyperparams[key].shape[1] for key in skeys]
+    bounds = SP.cumsum([0]+widths)
+
+    def to_dict(X):
+        return dict([(key,X[:,bounds[i]:bounds[i+1]].copy()) for i,key in enumerate(skeys)])
+
+    def fdf(X, rows=None):
+        #rows: evaluate the targets rows only
+        gp = gpr
+        if rows is not None and len(rows)<B:
+            gp = gpr.select_targets(rows)
+        hp = to_dict(X)
+        f = gp.LML_batch(hp)
+        grad = gp.LMLgrad(hp)
+        return [f, SP.concatenate([grad[key] for key in skeys],axis=1)]
+
+    #1. start: scaled steepest descent
+    X = SP.concatenate([hyperparams[key] for key in skeys],axis=1)
+    B,P = X.shape
+    f,g = fdf(X)
+    I = SP.eye(P)
+    H = I[SP.newaxis,:,:]/SP.maximum(1,SP.sqrt((g*g).sum(1)))[:,SP.newaxis,SP.newaxis]
+    active = SP.isfinite(f) & (abs(g).max(1)>gradient_tolerance)
+    it = 0
+    for it in xrange(maxiter):
+        if not active.any():
+            break
+        #2. search directions, restart where BFGS fails to give a descent direction
+        d = -(H*g[:,SP.newaxis,:]).sum(2)
+        restart = active & ~((d*g).sum(1)<0)
+        H[restart] = I/SP.maximum(1,SP.sqrt((g[restart]**2).sum(1)))[:,SP.newaxis,SP.newaxis]
+        d[restart] = -g[restart]/SP.maximum(1,SP.sqrt((g[restart]**2).sum(1)))[:,SP.newaxis]
+        #3. backtracking (Armijo) line search, evaluating the pending targets only
+        step = SP.ones(B)
+        pending = active.copy()
+        Xn,fn,gn = X.copy(),f.copy(),g.copy()
+        for ls in xrange(max_linesearch):
+            rows = SP.nonzero(pending)[0]
+            Xt = X[rows]+step[rows,SP.newaxis]*d[rows]
+            ft,gt = fdf(Xt,rows)
+            ok = SP.isfinite(ft) & SP.isfinite(gt).all(1) & (ft<=f[rows]+1E-4*step[rows]*(d[rows]*g[rows]).sum(1))
+            Xn[rows[ok]],fn[rows[ok]],gn[rows[ok]] = Xt[ok],ft[ok],gt[ok]
+            pending[rows[ok]] = False
+            if not pending.any():
+                break
+            step[pending] *= 0.5
+        #4. BFGS update of the inverse Hessians
+        s = Xn-X
+        y = gn-g
+        sy = (s*y).sum(1)
+        upd = active & ~pending & (sy>1E-10)
+        if upd.any():
+            rho = 1./sy[upd]
+            V = I[SP.newaxis]-rho[:,SP.newaxis,SP.newaxis]*s[upd][:,:,SP.newaxis]*y[upd][:,SP.newaxis,:]
+            H[upd] = NP.matmul(NP.matmul(V,H[upd]),V.transpose(0,2,1))+rho[:,SP.newaxis,SP.newaxis]*s[upd][:,:,SP.newaxis]*s[upd][:,SP.newaxis,:]
+        X,f,g = Xn,fn,gn
+        #targets whose line search failed cannot be improved further
+        active &= ~pending & (abs(g).max(1)>gradient_tolerance)
+    LG.debug("opt_hyper_batch: %d iterations, %d of %d targets not converged" % (it,active.sum(),B))
+    return [to_dict(X),f]